@@ -11,16 +11,17 @@ from app.db.base import Base
 # Import ALL models so that Base.metadata contains them for autogenerate
 from app.models import (  # noqa: F401
     Book, BookFile,
-    BookChunk,
+    BookChunk, BookEmbedding,
     Category, Tag, BookTag, BookCategory,
-    Topic, BookTopic, TopicRelation,
-    BookInsight, InsightConnection,
+    Topic, BookTopic, TopicRelation, TopicLabel,
+    BookInsight, InsightConnection, BookEdge, InsightMapShard,
     ReadingProgress, ReadingSession,
     ChatSession, ChatMessage,
     FeedItem,
-    ProcessingJob,
+    ProcessingJob, LLMBatch,
     ExternalMetadata,
     LearningPath, LearningPathBook,
+    Recommendation,
 )
 
 # this is the Alembic Config object, which provides
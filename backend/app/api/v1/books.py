@@ -3,7 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_async_session
-from app.services import book_service
+from app.services import book_service, knowledge_service
 from app.schemas.book import BookOut, BookDetailOut, BookUpdate, BookListResponse
 from app.config import settings
 import os
@@ -91,4 +91,8 @@ async def delete_book(book_id: int, db: AsyncSession = Depends(get_async_session
     success = await book_service.delete_book(db, book_id)
     if not success:
         raise HTTPException(status_code=404, detail="Book not found")
+    # The delete cascades to the book's connections and edges; drop cached
+    # knowledge responses once it's committed
+    await db.commit()
+    await knowledge_service.bump_knowledge_version()
     return {"message": "Book deleted"}
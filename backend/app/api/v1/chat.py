@@ -1,10 +1,16 @@
 """Chat endpoints."""
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import logging
+from contextlib import aclosing
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.session import get_async_session
+from app.db.session import get_async_session, async_session_factory
 from app.services import chat_service
 from app.schemas.chat import ChatSessionCreate, ChatSessionOut, ChatMessageCreate, ChatMessageOut
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -45,3 +51,39 @@ async def send_message(
 ):
     message = await chat_service.send_message(db, session_id, request.content)
     return ChatMessageOut.model_validate(message)
+
+
+@router.post("/sessions/{session_id}/messages/stream")
+async def stream_message(
+    session_id: int,
+    request: ChatMessageCreate,
+    http_request: Request,
+):
+    """Server-sent events variant of send_message.
+
+    Emits `sources`, then `content` tokens as they arrive, then `done`. If the
+    client disconnects, the generator is closed, which aborts the upstream LLM
+    request and rolls back the exchange.
+    """
+
+    async def event_stream():
+        # Own session: a Depends() session would be closed before the body streams
+        async with async_session_factory() as db:
+            try:
+                async with aclosing(chat_service.stream_message(db, session_id, request.content)) as events:
+                    async for event in events:
+                        if await http_request.is_disconnected():
+                            logger.info(f"SSE client disconnected from chat session {session_id}")
+                            await db.rollback()
+                            return
+                        yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,8 +1,12 @@
 """Configuration endpoints."""
 from fastapi import APIRouter
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.config import settings
 from app.llm.client import llm_client
+from app.llm.rate_limit import rate_limiter
+from app.llm.routing import latency
+from app.llm.semantic_cache import semantic_cache
+from app.llm.structured import parse_stats
 
 router = APIRouter()
 
@@ -25,6 +29,11 @@ class ModelConfig(BaseModel):
     model_id: str
 
 
+class RouteConfig(BaseModel):
+    task_type: str
+    models: list[str] = Field(min_length=1)
+
+
 @router.get("", response_model=ConfigOut)
 async def get_config():
     return ConfigOut(
@@ -51,6 +60,7 @@ async def update_config(update: ConfigUpdate):
 async def get_models():
     return {
         "current": llm_client.registry.get_all_models(),
+        "routes": llm_client.registry.get_all_routes(),
         "available_tasks": ["default", "insight", "chat", "feed", "topic", "summary"],
     }
 
@@ -59,3 +69,49 @@ async def get_models():
 async def set_model(config: ModelConfig):
     llm_client.registry.set_model(config.task_type, config.model_id)
     return {"task_type": config.task_type, "model_id": config.model_id}
+
+
+@router.put("/routes")
+async def set_route(config: RouteConfig):
+    """Primary model followed by fallbacks for a task type."""
+    llm_client.registry.set_route(config.task_type, config.models)
+    return {"task_type": config.task_type, "route": llm_client.registry.get_route(config.task_type)}
+
+
+@router.get("/llm-latency")
+async def get_llm_latency():
+    """Per-model latency percentiles that drive request hedging (this process)."""
+    return {"models": latency.snapshot()}
+
+
+@router.get("/llm-cache")
+async def get_llm_cache_stats():
+    return {"semantic": semantic_cache.stats()}
+
+
+@router.delete("/llm-cache")
+async def clear_llm_cache():
+    semantic_cache.clear()
+    return {"cleared": True}
+
+
+@router.get("/llm-json-stats")
+async def get_llm_json_stats():
+    """JSON parse outcomes per model, across the API and Celery workers."""
+    return {"models": await parse_stats.snapshot()}
+
+
+@router.delete("/llm-json-stats")
+async def reset_llm_json_stats():
+    await parse_stats.reset()
+    return {"reset": True}
+
+
+@router.get("/llm-rate-limits")
+async def get_llm_rate_limits():
+    """Bucket levels, utilization and active backoff per model."""
+    models = sorted(set(llm_client.registry.get_all_models().values()))
+    return {
+        "enabled": rate_limiter.enabled,
+        **(await rate_limiter.status(models) if rate_limiter.enabled else {"models": {}}),
+    }
@@ -1,5 +1,5 @@
 """Knowledge/second brain endpoints."""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_async_session
 from app.services import knowledge_service
@@ -10,22 +10,7 @@ router = APIRouter()
 
 @router.get("/connections")
 async def get_connections(limit: int = 50, db: AsyncSession = Depends(get_async_session)):
-    connections = await knowledge_service.get_knowledge_connections(db, limit=limit)
-    results = []
-    for conn in connections:
-        results.append({
-            "connection_type": conn["connection"].connection_type,
-            "strength": conn["connection"].strength,
-            "insight_a": {
-                "title": conn["insight_a"]["insight"].title,
-                "book_title": conn["insight_a"]["book"].title if conn["insight_a"]["book"] else None,
-            },
-            "insight_b": {
-                "title": conn["insight_b"]["insight"].title,
-                "book_title": conn["insight_b"]["book"].title if conn["insight_b"]["book"] else None,
-            },
-        })
-    return results
+    return await knowledge_service.get_knowledge_connections(db, limit=limit)
 
 
 @router.get("/learning-paths")
@@ -50,5 +35,9 @@ async def get_learning_path(path_id: int, db: AsyncSession = Depends(get_async_s
 
 
 @router.get("/map")
-async def knowledge_map(db: AsyncSession = Depends(get_async_session)):
-    return await knowledge_service.get_knowledge_map(db)
+async def knowledge_map(
+    min_strength: float = Query(0.5, ge=0.0, le=1.0),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_async_session),
+):
+    return await knowledge_service.get_knowledge_map(db, min_strength=min_strength, limit=limit)
@@ -3,7 +3,7 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_async_session
 from app.services import library_service
-from app.schemas.processing import ScanRequest, ScanResponse, LibraryStatsOut
+from app.schemas.processing import ScanRequest, ScanResponse, LibraryStatsOut, LLMBatchOut
 from app.config import settings
 
 router = APIRouter()
@@ -82,3 +82,12 @@ async def get_processing_status(db: AsyncSession = Depends(get_async_session)):
             for j in failures
         ],
     }
+
+
+@router.get("/batches", response_model=list[LLMBatchOut])
+async def get_llm_batches(limit: int = 20, db: AsyncSession = Depends(get_async_session)):
+    from sqlalchemy import select
+    from app.models.processing import LLMBatch
+
+    result = await db.execute(select(LLMBatch).order_by(LLMBatch.submitted_at.desc()).limit(limit))
+    return [LLMBatchOut.model_validate(b) for b in result.scalars().all()]
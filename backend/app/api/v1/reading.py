@@ -22,13 +22,22 @@ async def update_progress(
     update: ReadingProgressUpdate,
     db: AsyncSession = Depends(get_async_session),
 ):
+    previous = await reading_service.get_reading_progress(db, book_id)
+    status_before = previous.status if previous else None
     progress = await reading_service.update_reading_progress(
         db, book_id,
         current_page=update.current_page,
         total_pages=update.total_pages,
         epub_cfi=update.epub_cfi,
     )
-    return ReadingProgressOut.model_validate(progress)
+    out = ReadingProgressOut.model_validate(progress)
+    # Page turns don't change recommendations; starting or finishing a book
+    # does. Commit first so the refresh can't read the old reading state.
+    if progress.status != status_before:
+        await db.commit()
+        from celery_app.tasks.recommendation_tasks import schedule_recommendation_refresh
+        schedule_recommendation_refresh()
+    return out
 
 
 @router.post("/sessions/{book_id}/start")
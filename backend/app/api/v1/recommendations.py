@@ -1,9 +1,9 @@
 """Recommendation endpoints."""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_async_session
 from app.services import recommendation_service
-from app.schemas.book import BookOut
+from app.schemas.book import BookOut, RecommendationStatusOut
 
 router = APIRouter()
 
@@ -17,13 +17,27 @@ async def get_recommendations(
     return [BookOut.model_validate(b) for b in books]
 
 
+@router.get("/status", response_model=RecommendationStatusOut)
+async def get_recommendation_status(db: AsyncSession = Depends(get_async_session)):
+    status = await recommendation_service.get_recommendation_status(db)
+    return RecommendationStatusOut(**status)
+
+
+@router.post("/refresh")
+async def refresh_recommendations():
+    from celery_app.tasks.recommendation_tasks import refresh_recommendations
+    task = refresh_recommendations.delay(force=True)
+    return {"task_id": task.id, "message": "Recommendation refresh queued"}
+
+
 @router.get("/similar/{book_id}")
 async def get_similar_books(
     book_id: int,
     limit: int = 6,
+    mode: str | None = Query(None, pattern="^(centroid|chapters)$"),
     db: AsyncSession = Depends(get_async_session),
 ):
-    results = await recommendation_service.get_similar_books(db, book_id, limit=limit)
+    results = await recommendation_service.get_similar_books(db, book_id, limit=limit, mode=mode)
     return [
         {"book": BookOut.model_validate(r["book"]), "similarity": r["similarity"]}
         for r in results
@@ -14,10 +14,11 @@ async def search(
     q: str = Query(..., min_length=1),
     limit: int = 20,
     book_ids: str | None = None,
+    rerank: bool | None = None,
     db: AsyncSession = Depends(get_async_session),
 ):
     bid_list = [int(x) for x in book_ids.split(",")] if book_ids else None
-    results = await search_service.hybrid_search(db, q, limit=limit, book_ids=bid_list)
+    results = await search_service.hybrid_search(db, q, limit=limit, book_ids=bid_list, rerank=rerank)
     return SearchResponse(
         results=[SearchResult(**r) for r in results],
         query=q,
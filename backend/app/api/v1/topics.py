@@ -9,8 +9,8 @@ router = APIRouter()
 
 
 @router.get("", response_model=list[TopicOut])
-async def list_topics(db: AsyncSession = Depends(get_async_session)):
-    topics = await topic_service.get_topics(db)
+async def list_topics(level: int | None = None, db: AsyncSession = Depends(get_async_session)):
+    topics = await topic_service.get_topics(db, level=level)
     return [TopicOut.model_validate(t) for t in topics]
 
 
@@ -13,6 +13,26 @@ class Settings(BaseSettings):
     # OpenRouter
     openrouter_api_key: str = ""
     default_model: str = "stepfun/step-3.5-flash:free"
+    llm_base_url: str = "https://openrouter.ai/api/v1"
+    llm_http2: bool = True
+    llm_max_connections: int = 20
+    llm_keepalive_expiry: float = 60.0
+    llm_timeout: float = 120.0
+    llm_max_concurrency_per_provider: int = 8
+    llm_max_concurrency_per_model: int = 3
+    llm_json_mode: bool = True  # request response_format=json_object for JSON prompts
+    llm_max_retries: int = 3  # 429s and transient provider errors
+    llm_rate_limit_enabled: bool = True
+    llm_default_rpm: int = 20
+    llm_default_tpm: int = 200000
+    llm_rate_limits: dict[str, dict[str, int]] = {}  # {"model": {"rpm": 60, "tpm": 400000}}
+    llm_rate_limit_max_wait: float = 300.0
+    llm_coalesce_enabled: bool = True  # share identical in-flight requests across processes
+    llm_fallback_models: dict[str, list[str]] = {}  # {"chat": ["fallback/model-a", ...]}
+    llm_hedge_tasks: list[str] = ["chat"]  # task types that race the next model after a delay
+    llm_hedge_quantile: float = 0.95
+    llm_hedge_min_delay: float = 1.0
+    llm_hedge_default_delay: float = 8.0  # until enough latency samples exist
 
     # Paths
     books_path: str = "/books"
@@ -22,6 +42,81 @@ class Settings(BaseSettings):
     embedding_model: str = "all-MiniLM-L6-v2"
     embedding_dimension: int = 384
 
+    # Book centroids (book_embeddings): also keep one per chapter
+    book_embedding_chapters: bool = True
+
+    # Similar books: "centroid" or "chapters" (max-sim over chapter centroids)
+    similar_books_mode: str = "centroid"
+    similar_books_ef_search: int = 100
+    similar_books_max_chapters: int = 30
+
+    # Materialized recommendations
+    recommendation_count: int = 50
+    recommendation_history_books: int = 5
+    recommendation_refresh_delay: float = 10.0
+    recommendation_refresh_interval: float = 1800.0
+
+    # Knowledge endpoint response cache (seconds, 0 disables)
+    knowledge_cache_ttl: int = 3600
+
+    # Re-ranking
+    rerank_enabled: bool = False
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_top_n: int = 30
+    rerank_budget_ms: int = 150
+
+    # Chat context packing (tokens)
+    chat_context_budget: int = 6000
+    chat_history_budget: int = 1500
+    chat_retrieval_limit: int = 16
+    chat_history_turns: int = 20
+
+    # Semantic response cache
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_ttl: int = 86400
+    semantic_cache_max_entries: int = 2000
+
+    # Exact-match LLM response cache
+    llm_cache_backend: str = "redis"  # redis, disk, off
+    llm_cache_redis_url: str = ""  # defaults to redis_url
+    llm_cache_dir: str = "/app/cache/llm"
+    llm_cache_ttl: int = 604800
+    llm_cache_max_temperature: float = 0.3
+
+    # Insight generation
+    insight_context_mode: str = "map_reduce"  # map_reduce, representative, first_n
+    insight_map_window_tokens: int = 6000
+    insight_context_tokens: int = 12000  # model tokens for representative selection, within MAX_CONTENT_CHARS
+
+    # Cross-book insight connections (background k-NN over insight embeddings)
+    insight_connection_k: int = 5
+    insight_connection_threshold: float = 0.75
+    insight_connection_batch_size: int = 5000
+    insight_connection_interval: float = 1800.0
+
+    # Insight batch mode: queue insight jobs and submit them as provider batches
+    insight_batch_mode: bool = False
+    insight_batch_max_books: int = 200
+    insight_batch_max_attempts: int = 3
+    insight_batch_submit_interval: float = 600.0
+    llm_batch_backend: str = "local"  # openai (Files + Batches API), local (simulated)
+    llm_batch_base_url: str = ""  # defaults to llm_base_url
+    llm_batch_api_key: str = ""  # defaults to openrouter_api_key
+    llm_batch_completion_window: str = "24h"
+    llm_batch_poll_interval: float = 300.0
+    llm_batch_dir: str = "/app/cache/batches"
+    llm_batch_local_latency: float = 0.0
+
+    # Topic modeling: frequent incremental updates, full refit weekly
+    topic_update_interval: float = 900.0
+    topic_max_subtopics: int = 6
+    topic_min_subtopic_books: int = 3
+    # LLM topic names: one batched call per hierarchy level, cached by membership
+    topic_llm_labels: bool = True
+    topic_label_batch_size: int = 40
+    topic_relabel_min_overlap: float = 0.7  # keep a name while this much of its membership remains
+
     # Orchestrator
     orchestrator_intensity: str = "normal"
     orchestrator_tick_interval: int = 300
@@ -0,0 +1,176 @@
+"""Batch chat-completion backends for bulk, latency-insensitive work.
+
+Requests are OpenAI batch JSONL lines:
+    {"custom_id": ..., "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+and results come back as {"custom_id", "response": {"status_code", "body"}, "error"}.
+
+`openai` submits to any provider exposing the OpenAI Files + Batches API,
+which typically bills batch traffic at a discount and runs it within a
+completion window. `local` simulates such a provider. It keeps the JSONL on
+disk and, once a batch has aged `llm_batch_local_latency` seconds, hands it
+to its own worker task, which runs it through the regular chat-completions
+endpoint. That is useful for testing, and for providers (such as
+OpenRouter) without a batch API.
+"""
+import io
+import json
+import logging
+import time
+import uuid
+from pathlib import Path
+from openai import OpenAI
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+# A local batch's running marker not touched for this long belongs to a dead worker
+LOCAL_STALE_SECONDS = 900
+
+# Normalized provider batch states
+IN_PROGRESS, COMPLETED, FAILED = "in_progress", "completed", "failed"
+
+
+def batch_line(custom_id: str, body: dict) -> dict:
+    return {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+
+
+def result_content(result: dict) -> str | None:
+    """Assistant text of one result line, or None if that request failed."""
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    choices = response.get("body", {}).get("choices") or []
+    return choices[0]["message"].get("content") if choices else None
+
+
+def _to_jsonl(lines: list[dict]) -> bytes:
+    return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+def _from_jsonl(text: str) -> list[dict]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class OpenAIBatchBackend:
+    name = "openai"
+
+    def __init__(self, base_url: str, api_key: str):
+        self.client = OpenAI(base_url=base_url, api_key=api_key)
+
+    def submit(self, lines: list[dict]) -> str:
+        upload = self.client.files.create(file=("batch.jsonl", io.BytesIO(_to_jsonl(lines))), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=settings.llm_batch_completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return COMPLETED
+        if batch.status in ("failed", "expired", "cancelled"):
+            return FAILED
+        return IN_PROGRESS
+
+    def results(self, batch_id: str) -> list[dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.extend(_from_jsonl(self.client.files.content(file_id).text))
+        return results
+
+
+class LocalBatchBackend:
+    name = "local"
+
+    def __init__(self, directory: str, latency_seconds: float = 0.0):
+        self.directory = Path(directory)
+        self.latency_seconds = latency_seconds
+
+    def _path(self, batch_id: str, kind: str) -> Path:
+        return self.directory / f"{batch_id}.{kind}.jsonl"
+
+    def submit(self, lines: list[dict]) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        batch_id = f"local_{uuid.uuid4().hex}"
+        self._path(batch_id, "input").write_bytes(_to_jsonl(lines))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        """Due batches are claimed and queued for `run` on a worker of their
+        own, so polling never blocks on (or repeats) the provider calls."""
+        output = self._path(batch_id, "output")
+        if output.exists():
+            return COMPLETED
+        source = self._path(batch_id, "input")
+        if not source.exists():
+            return FAILED
+        if time.time() - source.stat().st_mtime < self.latency_seconds:
+            return IN_PROGRESS
+        if self._claim(batch_id):
+            from celery_app.tasks.insight_tasks import run_local_batch
+            run_local_batch.delay(batch_id)
+        return IN_PROGRESS
+
+    def _claim(self, batch_id: str) -> bool:
+        """Atomically create the running marker; False if a live run holds it."""
+        marker = self._path(batch_id, "running")
+        try:
+            if time.time() - marker.stat().st_mtime < LOCAL_STALE_SECONDS:
+                return False
+            # Only one poller can move a stale marker aside
+            stale = self._path(batch_id, f"stale.{uuid.uuid4().hex}")
+            marker.rename(stale)
+            stale.unlink()
+            logger.warning(f"Local batch {batch_id}: previous run went quiet, restarting it")
+        except FileNotFoundError:
+            pass
+        try:
+            with marker.open("x"):
+                return True
+        except FileExistsError:
+            return False
+
+    def run(self, batch_id: str):
+        """Send every request of a claimed batch and write its output file."""
+        from app.llm.client import get_sync_llm_client
+
+        marker = self._path(batch_id, "running")
+        if self._path(batch_id, "output").exists():
+            marker.unlink(missing_ok=True)
+            return
+        client = get_sync_llm_client()
+        results = []
+        for line in _from_jsonl(self._path(batch_id, "input").read_text()):
+            marker.touch()
+            try:
+                body = client.create(line["body"]).model_dump()
+                results.append({
+                    "custom_id": line["custom_id"],
+                    "response": {"status_code": 200, "body": body},
+                    "error": None,
+                })
+            except Exception as e:
+                logger.warning(f"Local batch {batch_id}: {line['custom_id']} failed: {e}")
+                results.append({"custom_id": line["custom_id"], "response": None, "error": {"message": str(e)}})
+        tmp = self._path(batch_id, "output.tmp")
+        tmp.write_bytes(_to_jsonl(results))
+        tmp.replace(self._path(batch_id, "output"))
+        marker.unlink(missing_ok=True)
+
+    def results(self, batch_id: str) -> list[dict]:
+        return _from_jsonl(self._path(batch_id, "output").read_text())
+
+
+def get_batch_backend():
+    if settings.llm_batch_backend == "openai":
+        return OpenAIBatchBackend(
+            base_url=settings.llm_batch_base_url or settings.llm_base_url,
+            api_key=settings.llm_batch_api_key or settings.openrouter_api_key,
+        )
+    return LocalBatchBackend(settings.llm_batch_dir, settings.llm_batch_local_latency)
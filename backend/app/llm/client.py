@@ -1,19 +1,119 @@
-"""Model-agnostic LLM client via OpenRouter."""
+"""Model-agnostic LLM client via OpenRouter.
+
+`LLMClient` (async, used by the API) and `SyncLLMClient` (used by Celery
+workers) share model routing, the response cache and a pooled keep-alive
+HTTP/2 transport. Build clients once per process and reuse them: creating
+one per call pays connection setup and TLS handshakes every time.
+
+Each task type runs along a model route with fallback and optional
+hedging (app.llm.routing). Identical requests already in flight, here or in
+another process, share one upstream call (app.llm.coalesce). Every request
+is admitted by the shared per-model rate limiter first, and 429s and
+transient provider errors are retried here (the SDK's own retries are off,
+since they would bypass the limiter).
+"""
+import asyncio
 import logging
-from openai import AsyncOpenAI
+import os
+import time
+from contextlib import aclosing
+import httpx
+from openai import (
+    APIConnectionError, AsyncOpenAI, BadRequestError, InternalServerError, OpenAI, RateLimitError,
+)
 from app.config import settings
+from app.llm.coalesce import coalescer
 from app.llm.models import ModelRegistry
+from app.llm.rate_limit import RateLimitTimeout, estimate_cost, rate_limiter
+from app.llm.response_cache import response_cache
+from app.llm.routing import hedged, hedged_stream, latency
+from app.llm.structured import (
+    JSON_RESPONSE_FORMAT, LLMJSONError, json_mode_supported, looks_truncated, mark_json_mode_unsupported, parse_json,
+)
+from app.llm.tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
 
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry,
+    )
+
+
+def _retry_delay(error: Exception, attempt: int) -> float | None:
+    """Seconds to wait before retrying a transient error; None if it isn't one."""
+    if attempt >= settings.llm_max_retries:
+        return None
+    if isinstance(error, (APIConnectionError, InternalServerError)):
+        return min(30.0, 2.0 ** attempt)
+    return None
+
+
+async def _aadmit(model: str, reserved: int, backoff: float):
+    """Take a rate-limiter slot, then sleep off whatever part of a 429
+    backoff the limiter didn't already wait out (it's disabled, or failed
+    open because Redis is unreachable)."""
+    waited = await rate_limiter.aacquire(model, reserved)
+    if backoff > waited:
+        await asyncio.sleep(backoff - waited)
+
+
+def _admit(model: str, reserved: int, backoff: float):
+    waited = rate_limiter.acquire(model, reserved)
+    if backoff > waited:
+        time.sleep(backoff - waited)
+
+
+def _can_fall_back(error: Exception) -> bool:
+    """Errors another model on the route might not hit; a bad request would
+    fail the same way everywhere."""
+    return isinstance(error, (APIConnectionError, InternalServerError, RateLimitError, RateLimitTimeout))
+
+
+def _used_tokens(response, reserved: int) -> int:
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage and usage.total_tokens else reserved
+
+
+def _cache_key(model, messages, temperature, max_tokens, cache, json_mode, kwargs) -> str | None:
+    if not response_cache.should_use(temperature, cache):
+        return None
+    return _flight_key(model, messages, temperature, max_tokens, json_mode, kwargs)
+
+
+def _flight_key(model, messages, temperature, max_tokens, json_mode, kwargs) -> str:
+    return response_cache.make_key(model, messages, temperature, max_tokens, json_mode=json_mode, **kwargs)
+
+
+def _cacheable(content: str, json_mode: bool) -> bool:
+    """JSON replies are cached only if they parse as complete documents, so
+    a truncated or garbled reply isn't replayed on every later call."""
+    if not json_mode:
+        return True
+    try:
+        parse_json(content)
+    except LLMJSONError:
+        return False
+    return not looks_truncated(content)
+
+
 class LLMClient:
-    def __init__(self):
+    def __init__(self, registry: ModelRegistry | None = None, base_url: str | None = None):
         self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=base_url or settings.llm_base_url,
             api_key=settings.openrouter_api_key,
+            timeout=settings.llm_timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                http2=settings.llm_http2,
+                limits=_http_limits(),
+                timeout=settings.llm_timeout,
+            ),
         )
-        self.registry = ModelRegistry()
+        self.registry = registry or ModelRegistry()
 
     async def complete(
         self,
@@ -21,22 +121,90 @@ class LLMClient:
         task_type: str = "default",
         temperature: float = 0.7,
         max_tokens: int = 4096,
+        cache: bool | None = None,
+        json_mode: bool = False,
         **kwargs,
     ) -> str:
-        model = self.registry.get_model(task_type)
-        try:
-            response = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                **kwargs,
+        """Chat completion. `cache=None` caches only low-temperature calls;
+        True/False forces the response cache on or off. `json_mode` requests
+        the provider's JSON output mode when the model supports it.
+
+        Runs along the task type's model route: falls back to the next model
+        on failure and, for hedged task types, races it after the current
+        model's p95 latency (see app.llm.routing)."""
+
+        async def call(model: str) -> str:
+            return await self._complete_model(
+                model, messages, task_type, temperature, max_tokens, cache, json_mode, kwargs,
             )
+
+        return await hedged(
+            self.registry.get_route(task_type), call,
+            lambda model: self.registry.hedge_delay(task_type, model),
+        )
+
+    async def _complete_model(self, model, messages, task_type, temperature, max_tokens, cache, json_mode, kwargs):
+        cache_key = _cache_key(model, messages, temperature, max_tokens, cache, json_mode, kwargs)
+        if cache_key:
+            cached = await response_cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        async def fetch() -> str:
+            response = await self._create(model, messages, temperature, max_tokens, json_mode, kwargs)
             return response.choices[0].message.content or ""
+
+        try:
+            content = await coalescer.run(
+                _flight_key(model, messages, temperature, max_tokens, json_mode, kwargs), fetch,
+            )
+            if cache_key and _cacheable(content, json_mode):
+                await response_cache.aset(cache_key, content)
+            return content
         except Exception as e:
             logger.error(f"LLM call failed (model={model}, task={task_type}): {e}")
             raise
 
+    async def _create(self, model, messages, temperature, max_tokens, json_mode, kwargs):
+        request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        if json_mode and json_mode_supported(model):
+            try:
+                return await self._send({**request, "response_format": JSON_RESPONSE_FORMAT})
+            except BadRequestError as e:
+                if "response_format" not in str(e):
+                    raise
+                mark_json_mode_unsupported(model, e)
+        return await self._send(request)
+
+    async def _send(self, request: dict):
+        model = request["model"]
+        reserved = estimate_cost(request["messages"], model, request.get("max_tokens"))
+        attempt, backoff = 0, 0.0
+        while True:
+            await _aadmit(model, reserved, backoff)
+            backoff = 0.0
+            started = time.perf_counter()
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(**request)
+            except RateLimitError as e:
+                pause = await rate_limiter.arecord_rate_limited(model, e.response.headers, reserved)
+                if attempt >= settings.llm_max_retries:
+                    raise
+                backoff = pause or 2.0 ** attempt
+                attempt += 1
+                continue
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            response = raw.parse()
+            latency.observe(model, "complete", time.perf_counter() - started)
+            await rate_limiter.arecord_response(model, raw.headers, reserved, _used_tokens(response, reserved))
+            return response
+
     async def complete_stream(
         self,
         messages: list[dict],
@@ -45,22 +213,197 @@ class LLMClient:
         max_tokens: int = 4096,
         **kwargs,
     ):
-        model = self.registry.get_model(task_type)
-        try:
-            stream = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True,
-                **kwargs,
+        """Stream completion deltas; concurrent identical streams share one
+        upstream response. Routed like `complete`, racing on first token."""
+
+        def open_stream(model: str):
+            key = _flight_key(model, messages, temperature, max_tokens, False, {**kwargs, "stream": True})
+            return coalescer.stream(
+                key, lambda: self._stream(model, task_type, messages, temperature, max_tokens, kwargs),
             )
+
+        route = self.registry.get_route(task_type)
+        async with aclosing(hedged_stream(
+            route, open_stream, lambda model: self.registry.hedge_delay(task_type, model, "first_token"),
+        )) as deltas:
+            async for delta in deltas:
+                yield delta
+
+    async def _stream(self, model, task_type, messages, temperature, max_tokens, kwargs):
+        reserved = estimate_cost(messages, model, max_tokens)
+        stream = None
+        streamed = []
+        try:
+            attempt, backoff = 0, 0.0
+            while stream is None:
+                await _aadmit(model, reserved, backoff)
+                backoff = 0.0
+                started = time.perf_counter()
+                try:
+                    stream = await self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        **kwargs,
+                    )
+                except RateLimitError as e:
+                    pause = await rate_limiter.arecord_rate_limited(model, e.response.headers, reserved)
+                    if attempt >= settings.llm_max_retries:
+                        raise
+                    backoff = pause or 2.0 ** attempt
+                    attempt += 1
+                except Exception as e:
+                    delay = _retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
             async for chunk in stream:
                 if chunk.choices and chunk.choices[0].delta.content:
+                    if not streamed:
+                        latency.observe(model, "first_token", time.perf_counter() - started)
+                    streamed.append(chunk.choices[0].delta.content)
                     yield chunk.choices[0].delta.content
         except Exception as e:
             logger.error(f"LLM stream failed (model={model}, task={task_type}): {e}")
             raise
+        finally:
+            # Closing the response aborts the upstream request when the consumer stops early
+            if stream is not None:
+                await stream.close()
+                used = estimate_cost(messages, model, 0) + count_tokens("".join(streamed), model)
+                await rate_limiter.arecord_response(model, stream.response.headers, reserved, used)
+
+
+class SyncLLMClient:
+    """Blocking facade with the same routing and caching as `LLMClient`."""
+
+    def __init__(self, registry: ModelRegistry | None = None, base_url: str | None = None):
+        self.client = OpenAI(
+            base_url=base_url or settings.llm_base_url,
+            api_key=settings.openrouter_api_key,
+            timeout=settings.llm_timeout,
+            max_retries=0,
+            http_client=httpx.Client(
+                http2=settings.llm_http2,
+                limits=_http_limits(),
+                timeout=settings.llm_timeout,
+            ),
+        )
+        self.registry = registry or ModelRegistry()
+
+    def complete(
+        self,
+        messages: list[dict],
+        task_type: str = "default",
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        cache: bool | None = None,
+        json_mode: bool = False,
+        **kwargs,
+    ) -> str:
+        """Falls back along the task type's model route; batch work isn't
+        latency-bound, so there's no hedging here."""
+        route = self.registry.get_route(task_type)
+        for i, model in enumerate(route):
+            try:
+                return self._complete_model(
+                    model, messages, task_type, temperature, max_tokens, cache, json_mode, kwargs,
+                )
+            except Exception as e:
+                if i == len(route) - 1 or not _can_fall_back(e):
+                    raise
+                logger.warning(f"LLM call on {model} failed, trying {route[i + 1]}: {e}")
+
+    def _complete_model(self, model, messages, task_type, temperature, max_tokens, cache, json_mode, kwargs):
+        cache_key = _cache_key(model, messages, temperature, max_tokens, cache, json_mode, kwargs)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        def fetch() -> str:
+            response = self._create(model, messages, temperature, max_tokens, json_mode, kwargs)
+            return response.choices[0].message.content or ""
+
+        try:
+            content = coalescer.run_sync(
+                _flight_key(model, messages, temperature, max_tokens, json_mode, kwargs), fetch,
+            )
+            if cache_key and _cacheable(content, json_mode):
+                response_cache.set(cache_key, content)
+            return content
+        except Exception as e:
+            logger.error(f"LLM call failed (model={model}, task={task_type}): {e}")
+            raise
+
+    def _create(self, model, messages, temperature, max_tokens, json_mode, kwargs):
+        request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        if json_mode and json_mode_supported(model):
+            try:
+                return self._send({**request, "response_format": JSON_RESPONSE_FORMAT})
+            except BadRequestError as e:
+                if "response_format" not in str(e):
+                    raise
+                mark_json_mode_unsupported(model, e)
+        return self._send(request)
+
+    def _send(self, request: dict):
+        model = request["model"]
+        reserved = estimate_cost(request["messages"], model, request.get("max_tokens"))
+        attempt, backoff = 0, 0.0
+        while True:
+            _admit(model, reserved, backoff)
+            backoff = 0.0
+            started = time.perf_counter()
+            try:
+                raw = self.client.chat.completions.with_raw_response.create(**request)
+            except RateLimitError as e:
+                pause = rate_limiter.record_rate_limited(model, e.response.headers, reserved)
+                if attempt >= settings.llm_max_retries:
+                    raise
+                backoff = pause or 2.0 ** attempt
+                attempt += 1
+                continue
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            response = raw.parse()
+            latency.observe(model, "complete", time.perf_counter() - started)
+            rate_limiter.record_response(model, raw.headers, reserved, _used_tokens(response, reserved))
+            return response
+
+    def create(self, request: dict):
+        """One raw chat-completion request (a batch line's body) through the
+        rate limiter and retries, without routing, caching or coalescing."""
+        return self._send(request)
+
+    def close(self):
+        self.client.close()
+
+
+_sync_client: SyncLLMClient | None = None
+_sync_client_pid: int | None = None
+
+
+def get_sync_llm_client() -> SyncLLMClient:
+    """Per-process SyncLLMClient.
+
+    Celery's prefork pool forks workers after import; sockets must not be
+    shared across a fork, so the client is rebuilt when the pid changes.
+    """
+    global _sync_client, _sync_client_pid
+    pid = os.getpid()
+    if _sync_client is None or _sync_client_pid != pid:
+        _sync_client = SyncLLMClient()
+        _sync_client_pid = pid
+    return _sync_client
 
 
 llm_client = LLMClient()
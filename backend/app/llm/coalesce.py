@@ -0,0 +1,420 @@
+"""Single-flight coalescing of identical in-flight LLM requests.
+
+When the same request (model, messages and sampling params) is already in
+flight, later callers wait for that call instead of sending their own.
+Within a process they share a future. Across processes the first caller
+takes a Redis lock and publishes the result on a pub/sub channel; it also
+stores the result briefly so a follower that subscribes late still sees it.
+If the leader dies, the lock expires and a follower takes over.
+
+Streams fan out the same way. One background task reads the upstream
+stream into a buffer that every local consumer reads from, and mirrors each
+delta into a Redis list that followers in other processes replay and then
+tail. The upstream request is cancelled once no consumer is left anywhere.
+If Redis is unreachable, coalescing falls back to in-process only.
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import Future
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "llmflight:"
+RESULT_TTL_SECONDS = 30
+POLL_SECONDS = 1.0
+
+# Delete the lock only if we still own it
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class CoalescedCallError(RuntimeError):
+    """The shared upstream call this caller was waiting on failed."""
+
+
+def _lock_key(key: str) -> str:
+    return f"{KEY_PREFIX}lock:{key}"
+
+
+def _flight_keys(key: str, token: str) -> dict[str, str]:
+    """Keys of one flight; scoped by the leader's token so a later flight of
+    the same request never sees this one's leftovers."""
+    return {kind: f"{KEY_PREFIX}{kind}:{key}:{token}" for kind in ("result", "chan", "chunks")}
+
+
+def _lock_ms() -> int:
+    return int((settings.llm_timeout + settings.llm_rate_limit_max_wait) * 1000)
+
+
+def _unpack(raw: bytes | str) -> str:
+    payload = json.loads(raw)
+    if "error" in payload:
+        raise CoalescedCallError(payload["error"])
+    return payload["result"]
+
+
+class _LocalStream:
+    """Buffer of one upstream stream, read independently by each consumer."""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Exception | None = None
+        self.consumers = 0
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def push(self, delta: str):
+        self.chunks.append(delta)
+        self._notify()
+
+    def finish(self, error: Exception | None = None):
+        self.done, self.error = True, error
+        self._notify()
+
+    async def consume(self) -> AsyncIterator[str]:
+        self.consumers += 1
+        i = 0
+        try:
+            while True:
+                while i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise CoalescedCallError(str(self.error)) from self.error
+                    return
+                await self.changed.wait()
+        finally:
+            self.consumers -= 1
+            if self.consumers == 0:
+                self._notify()
+
+
+class Coalescer:
+    def __init__(self, redis_url: str, enabled: bool = True):
+        self.redis_url = redis_url
+        self.enabled = enabled
+        self._redis = None
+        self._async_redis = None
+        self._release = None
+        self._async_release = None
+        self._local: dict[str, asyncio.Future] = {}
+        self._local_sync: dict[str, Future] = {}
+        self._local_sync_lock = threading.Lock()
+        self._streams: dict[str, _LocalStream] = {}
+
+    # Clients are created lazily so importing this module never connects
+
+    def _sync_client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url)
+            self._release = self._redis.register_script(_RELEASE)
+        return self._redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+            self._async_release = self._async_redis.register_script(_RELEASE)
+        return self._async_redis
+
+    # -- async completions --
+
+    async def run(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        if not self.enabled:
+            return await call()
+        pending = self._local.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if pending.cancelled():  # the leading caller went away, not us
+                    return await self.run(key, call)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._local[key] = future
+        try:
+            result = await self._run_shared(key, call)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved; waiters re-raise it themselves
+            raise
+        finally:
+            self._local.pop(key, None)
+
+    async def _run_shared(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        token = uuid.uuid4().hex
+        try:
+            client = self._async_client()
+            leader = await client.set(_lock_key(key), token, nx=True, px=_lock_ms())
+        except Exception as e:
+            logger.debug(f"Coalescing unavailable, calling directly: {e}")
+            return await call()
+        if not leader:
+            return await self._follow(key, call)
+
+        payload = None
+        try:
+            result = await call()
+            payload = {"result": result}
+            return result
+        except Exception as e:
+            payload = {"error": str(e)}
+            raise
+        finally:
+            # Cancelled leaders publish nothing; followers see the lock go and take over
+            await self._finish(key, token, payload)
+
+    async def _finish(self, key: str, token: str, payload: dict | None):
+        keys = _flight_keys(key, token)
+        try:
+            if payload is not None:
+                raw = json.dumps(payload)
+                pipe = self._async_client().pipeline()
+                pipe.set(keys["result"], raw, ex=RESULT_TTL_SECONDS)
+                pipe.publish(keys["chan"], raw)
+                await pipe.execute()
+            await self._async_release(keys=[_lock_key(key)], args=[token])
+        except Exception as e:
+            logger.debug(f"Coalescing publish failed: {e}")
+
+    async def _follow(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        client = self._async_client()
+        token = await client.get(_lock_key(key))
+        if token is None:
+            return await self._run_shared(key, call)
+        keys = _flight_keys(key, token.decode())
+        pubsub = client.pubsub()
+        await pubsub.subscribe(keys["chan"])
+        try:
+            while True:
+                # Checked after subscribing, so a result published in between isn't missed
+                raw = await client.get(keys["result"])
+                if raw is not None:
+                    return _unpack(raw)
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_SECONDS)
+                if message is not None:
+                    return _unpack(message["data"])
+                if await client.get(_lock_key(key)) != token:
+                    raw = await client.get(keys["result"])
+                    if raw is not None:
+                        return _unpack(raw)
+                    logger.warning("Coalesced LLM call lost its leader; retrying")
+                    return await self._run_shared(key, call)
+        finally:
+            await pubsub.unsubscribe(keys["chan"])
+            await pubsub.aclose()
+
+    # -- sync completions (Celery workers) --
+
+    def run_sync(self, key: str, call: Callable[[], str]) -> str:
+        if not self.enabled:
+            return call()
+        with self._local_sync_lock:
+            pending = self._local_sync.get(key)
+            if pending is None:
+                future = self._local_sync[key] = Future()
+        if pending is not None:
+            return pending.result()
+
+        try:
+            result = self._run_shared_sync(key, call)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._local_sync_lock:
+                self._local_sync.pop(key, None)
+
+    def _run_shared_sync(self, key: str, call: Callable[[], str]) -> str:
+        token = uuid.uuid4().hex
+        try:
+            client = self._sync_client()
+            leader = client.set(_lock_key(key), token, nx=True, px=_lock_ms())
+        except Exception as e:
+            logger.debug(f"Coalescing unavailable, calling directly: {e}")
+            return call()
+        if not leader:
+            return self._follow_sync(key, call)
+
+        payload = None
+        try:
+            result = call()
+            payload = {"result": result}
+            return result
+        except Exception as e:
+            payload = {"error": str(e)}
+            raise
+        finally:
+            self._finish_sync(key, token, payload)
+
+    def _finish_sync(self, key: str, token: str, payload: dict | None):
+        keys = _flight_keys(key, token)
+        try:
+            if payload is not None:
+                raw = json.dumps(payload)
+                pipe = self._sync_client().pipeline()
+                pipe.set(keys["result"], raw, ex=RESULT_TTL_SECONDS)
+                pipe.publish(keys["chan"], raw)
+                pipe.execute()
+            self._release(keys=[_lock_key(key)], args=[token])
+        except Exception as e:
+            logger.debug(f"Coalescing publish failed: {e}")
+
+    def _follow_sync(self, key: str, call: Callable[[], str]) -> str:
+        client = self._sync_client()
+        token = client.get(_lock_key(key))
+        if token is None:
+            return self._run_shared_sync(key, call)
+        keys = _flight_keys(key, token.decode())
+        pubsub = client.pubsub()
+        pubsub.subscribe(keys["chan"])
+        try:
+            while True:
+                raw = client.get(keys["result"])
+                if raw is not None:
+                    return _unpack(raw)
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_SECONDS)
+                if message is not None:
+                    return _unpack(message["data"])
+                if client.get(_lock_key(key)) != token:
+                    raw = client.get(keys["result"])
+                    if raw is not None:
+                        return _unpack(raw)
+                    logger.warning("Coalesced LLM call lost its leader; retrying")
+                    return self._run_shared_sync(key, call)
+        finally:
+            pubsub.close()
+
+    # -- streams --
+
+    async def stream(self, key: str, open_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        if not self.enabled:
+            async with aclosing(open_stream()) as upstream:
+                async for delta in upstream:
+                    yield delta
+            return
+
+        flight = self._streams.get(key)
+        if flight is None:
+            token = uuid.uuid4().hex
+            try:
+                client = self._async_client()
+                leader = await client.set(_lock_key(key), token, nx=True, px=_lock_ms())
+            except Exception as e:
+                logger.debug(f"Stream coalescing limited to this process: {e}")
+                client, leader = None, True
+
+            if not leader:
+                async for delta in self._follow_stream(key, open_stream):
+                    yield delta
+                return
+
+            flight = self._streams[key] = _LocalStream()
+            flight.task = asyncio.create_task(self._pump(key, token, client, flight, open_stream))
+
+        async for delta in flight.consume():
+            yield delta
+
+    async def _pump(self, key: str, token: str, client, flight: _LocalStream, open_stream):
+        keys = _flight_keys(key, token)
+        listeners = 0
+        error = None
+
+        async def mirror(entry: dict):
+            nonlocal client, listeners
+            if client is None:
+                return
+            try:
+                pipe = client.pipeline()
+                pipe.rpush(keys["chunks"], json.dumps(entry))
+                pipe.expire(keys["chunks"], RESULT_TTL_SECONDS)
+                pipe.pexpire(_lock_key(key), _lock_ms())
+                pipe.publish(keys["chan"], "1")
+                listeners = (await pipe.execute())[-1]
+            except Exception as e:
+                logger.debug(f"Stream mirroring stopped: {e}")
+                client, listeners = None, 0
+
+        try:
+            async with aclosing(open_stream()) as upstream:
+                async for delta in upstream:
+                    flight.push(delta)
+                    await mirror({"d": delta})
+                    if flight.consumers == 0 and listeners == 0:
+                        logger.debug("All stream consumers left; cancelling upstream")
+                        break
+            await mirror({"end": True})
+        except Exception as e:
+            error = e
+            await mirror({"error": str(e)})
+        finally:
+            flight.finish(error)
+            self._streams.pop(key, None)
+            if client is not None:
+                try:
+                    await self._async_release(keys=[_lock_key(key)], args=[token])
+                except Exception as e:
+                    logger.debug(f"Coalescing lock release failed: {e}")
+
+    async def _follow_stream(self, key: str, open_stream) -> AsyncIterator[str]:
+        client = self._async_client()
+        token = await client.get(_lock_key(key))
+        if token is None:
+            # The leader finished between our lock attempt and now
+            async for delta in self.stream(key, open_stream):
+                yield delta
+            return
+        keys = _flight_keys(key, token.decode())
+        pubsub = client.pubsub()
+        await pubsub.subscribe(keys["chan"])
+        received = 0
+        try:
+            while True:
+                for raw in await client.lrange(keys["chunks"], received, -1):
+                    received += 1
+                    entry = json.loads(raw)
+                    if "error" in entry:
+                        raise CoalescedCallError(entry["error"])
+                    if entry.get("end"):
+                        return
+                    yield entry["d"]
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_SECONDS)
+                if message is None and await client.get(_lock_key(key)) != token:
+                    if await client.llen(keys["chunks"]) > received:
+                        continue
+                    if received:
+                        raise CoalescedCallError("shared LLM stream ended without completing")
+                    logger.warning("Coalesced LLM stream lost its leader; streaming directly")
+                    async with aclosing(open_stream()) as upstream:
+                        async for delta in upstream:
+                            yield delta
+                    return
+        finally:
+            await pubsub.unsubscribe(keys["chan"])
+            await pubsub.aclose()
+
+
+coalescer = Coalescer(settings.redis_url, enabled=settings.llm_coalesce_enabled)
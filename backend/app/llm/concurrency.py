@@ -0,0 +1,66 @@
+"""In-process concurrency caps for fan-out LLM work.
+
+Each call holds one slot for its provider and one for its model, so a burst
+of parallel prompts can't exceed either cap. Async and thread-based callers
+get separate semaphore sets since they can't share primitives.
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+from app.config import settings
+
+_async_semaphores: dict[tuple[str, str], asyncio.Semaphore] = {}
+_sync_semaphores: dict[tuple[str, str], threading.BoundedSemaphore] = {}
+_sync_lock = threading.Lock()
+
+
+def provider_of(base_url: str | None = None) -> str:
+    return urlparse(base_url or settings.llm_base_url).netloc
+
+
+def _keys(model: str) -> list[tuple[tuple[str, str], int]]:
+    provider = provider_of()
+    return [
+        (("provider", provider), settings.llm_max_concurrency_per_provider),
+        (("model", f"{provider}/{model}"), settings.llm_max_concurrency_per_model),
+    ]
+
+
+@asynccontextmanager
+async def llm_slot(model: str):
+    semaphores = []
+    for key, limit in _keys(model):
+        if key not in _async_semaphores:
+            _async_semaphores[key] = asyncio.Semaphore(limit)
+        semaphores.append(_async_semaphores[key])
+
+    acquired = []
+    try:
+        for sem in semaphores:
+            await sem.acquire()
+            acquired.append(sem)
+        yield
+    finally:
+        for sem in reversed(acquired):
+            sem.release()
+
+
+@contextmanager
+def llm_slot_sync(model: str):
+    semaphores = []
+    with _sync_lock:
+        for key, limit in _keys(model):
+            if key not in _sync_semaphores:
+                _sync_semaphores[key] = threading.BoundedSemaphore(limit)
+            semaphores.append(_sync_semaphores[key])
+
+    acquired = []
+    try:
+        for sem in semaphores:
+            sem.acquire()
+            acquired.append(sem)
+        yield
+    finally:
+        for sem in reversed(acquired):
+            sem.release()
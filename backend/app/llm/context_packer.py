@@ -0,0 +1,129 @@
+"""Token-budgeted packing of retrieved chunks and chat history into a prompt."""
+import hashlib
+import logging
+import re
+from dataclasses import dataclass, field
+from app.llm.tokens import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SEPARATOR = "\n\n---\n\n"
+
+
+@dataclass
+class PackedContext:
+    context: str
+    chunks: list[dict] = field(default_factory=list)
+    history: list[dict] = field(default_factory=list)
+    fixed_tokens: int = 0
+    context_tokens: int = 0
+    history_tokens: int = 0
+    dropped_chunks: int = 0
+    duplicate_chunks: int = 0
+    dropped_turns: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.fixed_tokens + self.context_tokens + self.history_tokens
+
+    def usage(self) -> dict:
+        return {
+            "prompt_tokens": self.total_tokens,
+            "context_tokens": self.context_tokens,
+            "history_tokens": self.history_tokens,
+            "chunks_used": len(self.chunks),
+            "chunks_dropped": self.dropped_chunks,
+            "chunks_deduped": self.duplicate_chunks,
+            "turns_used": len(self.history),
+            "turns_dropped": self.dropped_turns,
+        }
+
+
+def _paragraph_key(paragraph: str) -> str:
+    normalized = re.sub(r"\s+", " ", paragraph).strip().lower()
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def format_chunk(chunk: dict) -> str:
+    return f"[{chunk.get('book_title', 'Unknown')} - p.{chunk.get('page_number', '?')}]\n{chunk['content']}"
+
+
+class ContextPacker:
+    """Fit the best chunks and the most recent turns into a token budget.
+
+    `budget` covers the whole prompt (system + history + final user turn).
+    History is filled newest-first up to `history_budget`; chunks then take
+    what remains, highest score first. Paragraphs repeated between chunks
+    (produced by the chunker's overlap window) are stripped so the same text
+    is never paid for twice.
+    """
+
+    def __init__(self, model: str, budget: int, history_budget: int):
+        self.model = model
+        self.budget = budget
+        self.history_budget = history_budget
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def pack(
+        self,
+        chunks: list[dict],
+        history: list[dict],
+        system_prompt: str,
+        user_template: str,
+        question: str,
+    ) -> PackedContext:
+        packed = PackedContext(context="")
+        packed.fixed_tokens = (
+            self.count(system_prompt)
+            + self.count(user_template.format(context="", question=question))
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )
+        remaining = self.budget - packed.fixed_tokens
+
+        # Most recent turns first, stop at the first one that doesn't fit
+        history_room = min(self.history_budget, max(0, remaining))
+        kept_turns = []
+        for turn in reversed(history):
+            cost = self.count(turn["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if cost > history_room:
+                break
+            kept_turns.append(turn)
+            history_room -= cost
+            packed.history_tokens += cost
+        packed.history = list(reversed(kept_turns))
+        packed.dropped_turns = len(history) - len(kept_turns)
+        remaining -= packed.history_tokens
+
+        seen_paragraphs: set[str] = set()
+        parts = []
+        ordered = sorted(
+            chunks,
+            key=lambda c: c.get("rerank_score", c.get("score", 0.0)),
+            reverse=True,
+        )
+        for chunk in ordered:
+            paragraphs = [p for p in re.split(r"\n\s*\n", chunk["content"]) if p.strip()]
+            fresh = [p for p in paragraphs if _paragraph_key(p) not in seen_paragraphs]
+            if not fresh:
+                packed.duplicate_chunks += 1
+                continue
+
+            trimmed = dict(chunk, content="\n\n".join(fresh))
+            text = format_chunk(trimmed)
+            cost = self.count(text) + (self.count(CHUNK_SEPARATOR) if parts else 0)
+            if cost > remaining:
+                packed.dropped_chunks += 1
+                continue
+
+            parts.append(text)
+            packed.chunks.append(trimmed)
+            packed.context_tokens += cost
+            remaining -= cost
+            seen_paragraphs.update(_paragraph_key(p) for p in fresh)
+
+        packed.context = CHUNK_SEPARATOR.join(parts) if parts else "No relevant content found."
+        if not parts:
+            packed.context_tokens = self.count(packed.context)
+        return packed
@@ -1,5 +1,6 @@
 """Model registry - maps task types to OpenRouter models."""
 from app.config import settings
+from app.llm.routing import latency
 
 
 class ModelRegistry:
@@ -13,6 +14,9 @@ class ModelRegistry:
             "topic": settings.default_model,
             "summary": settings.default_model,
         }
+        self._fallbacks: dict[str, list[str]] = {
+            task_type: list(models) for task_type, models in settings.llm_fallback_models.items()
+        }
 
     def get_model(self, task_type: str) -> str:
         if task_type in self._overrides:
@@ -32,3 +36,27 @@ class ModelRegistry:
             self._overrides.pop(task_type, None)
         else:
             self._overrides.clear()
+
+    # Routing policy: primary model, then fallbacks in order
+
+    def get_route(self, task_type: str) -> list[str]:
+        primary = self.get_model(task_type)
+        fallbacks = self._fallbacks.get(task_type, [])
+        return [primary] + [m for m in dict.fromkeys(fallbacks) if m != primary]
+
+    def set_route(self, task_type: str, models: list[str]):
+        self.set_model(task_type, models[0])
+        self._fallbacks[task_type] = list(models[1:])
+
+    def get_all_routes(self) -> dict[str, list[str]]:
+        return {task_type: self.get_route(task_type) for task_type in self._defaults}
+
+    def hedge_delay(self, task_type: str, model: str, kind: str = "complete") -> float | None:
+        """Seconds to wait on `model` before hedging, or None if this task
+        type only falls back on failure."""
+        if task_type not in settings.llm_hedge_tasks:
+            return None
+        observed = latency.quantile(model, kind, settings.llm_hedge_quantile)
+        if observed is None:
+            return settings.llm_hedge_default_delay
+        return max(settings.llm_hedge_min_delay, observed)
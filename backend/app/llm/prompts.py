@@ -98,9 +98,31 @@ Keywords: {keywords}
 
 Respond in JSON: {{"name": "", "description": "", "keywords": []}}"""
 
+LABEL_TOPICS_BATCH = """Name each of these clusters of books from a personal library.
+{context}
+Each cluster lists sample book titles and its most distinctive keywords (word stems).
+
+{clusters}
+
+For every cluster give a short, specific name (2-4 words, unique across clusters) and a
+one-sentence description.
+Respond in JSON: {{"topics": [{{"id": 0, "name": "", "description": ""}}]}}"""
+
 GENERATE_DAILY_QUOTE = """Select the most thought-provoking quote from this content and explain why it matters.
 
 Book: {title} by {author}
 Content: {content}
 
 Respond in JSON: {{"quote": "", "explanation": "", "page_hint": ""}}"""
+
+SUMMARIZE_SECTION = """Summarize this section of a book for later analysis.
+
+Book: {title} by {author}
+Section: {section}
+
+Content:
+{content}
+
+Write a dense summary (150-250 words) that keeps the key ideas and arguments, any named
+frameworks or mental models, concrete advice, and one or two short direct quotes worth keeping.
+Respond in plain text."""
@@ -0,0 +1,320 @@
+"""Shared per-model rate limiter for LLM calls.
+
+Every request takes one unit from a requests/min bucket and its estimated
+token cost from a tokens/min bucket. The buckets live in Redis and are
+updated by Lua scripts, so the API and every Celery worker draw from the
+same budget. The estimate reserves the prompt plus max_tokens; once the
+response reports actual usage the difference is refunded (or charged).
+
+Provider feedback tightens the limiter further. A 429 pauses the model for
+its Retry-After, or for an exponential backoff when none is given.
+Rate-limit headers on successful responses pause the model until the
+reset when the remaining quota hits zero. If Redis is unreachable the
+limiter fails open and calls proceed unthrottled.
+"""
+import asyncio
+import logging
+import re
+import time
+from app.config import settings
+from app.llm.tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "llmrl:"
+BUCKET_TTL_SECONDS = 300
+MAX_BACKOFF_SECONDS = 60.0
+
+# KEYS: request bucket, token bucket, pause key. ARGV: rpm, tpm, cost.
+# Returns "0" when admitted, otherwise the seconds to wait (as a string,
+# since Lua numbers are truncated to integers on the way out).
+_ACQUIRE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local pause = redis.call('PTTL', KEYS[3])
+if pause > 0 then return tostring(pause / 1000) end
+
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local function level(key, capacity)
+  local b = redis.call('HMGET', key, 'level', 'ts')
+  local lvl = tonumber(b[1]) or capacity
+  local ts = tonumber(b[2]) or now
+  return math.min(capacity, lvl + (now - ts) * capacity / 60)
+end
+
+local req, tok = level(KEYS[1], rpm), level(KEYS[2], tpm)
+-- An oversized call waits for a full bucket rather than forever
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local wait = 0
+if req < 1 then wait = (1 - req) * 60 / rpm end
+if tok < cost then wait = math.max(wait, (cost - tok) * 60 / tpm) end
+if wait > 0 then return tostring(wait) end
+
+redis.call('HSET', KEYS[1], 'level', req - 1, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tok - cost, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return '0'
+"""
+
+# KEYS: token bucket. ARGV: tpm, delta. Refunds unused (or charges extra)
+# tokens; the level may go negative so an under-estimate slows later calls.
+_ADJUST = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tpm = tonumber(ARGV[1])
+local b = redis.call('HMGET', KEYS[1], 'level', 'ts')
+local lvl = tonumber(b[1]) or tpm
+local ts = tonumber(b[2]) or now
+lvl = math.min(tpm, lvl + (now - ts) * tpm / 60)
+redis.call('HSET', KEYS[1], 'level', math.min(tpm, lvl + tonumber(ARGV[2])), 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return '1'
+"""
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a call can't be admitted within llm_rate_limit_max_wait."""
+
+
+def estimate_cost(messages: list[dict], model: str, max_tokens: int | None) -> int:
+    return count_message_tokens(messages, model) + (max_tokens or 0)
+
+
+def _seconds_until(value: str | None) -> float | None:
+    """Parse a reset / retry-after header: seconds, a duration like "6m0s",
+    or an epoch timestamp in seconds or milliseconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION.findall(value)
+        return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts) if parts else None
+    if number > 1e12:
+        return max(0.0, number / 1000 - time.time())
+    if number > 1e9:
+        return max(0.0, number - time.time())
+    return number
+
+
+def pause_from_headers(headers) -> float | None:
+    """Seconds to hold off, when the headers say a quota is exhausted."""
+    for remaining, reset in (
+        ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+        ("x-ratelimit-remaining", "x-ratelimit-reset"),
+    ):
+        left = headers.get(remaining)
+        if left is not None and left.strip() in ("0", "0.0"):
+            return _seconds_until(headers.get(reset)) or 1.0
+    return None
+
+
+class RateLimiter:
+    def __init__(self, redis_url: str, enabled: bool = True):
+        self.redis_url = redis_url
+        self.enabled = enabled
+        self._redis = None
+        self._async_redis = None
+        self._scripts = None
+        self._async_scripts = None
+
+    # Clients are created lazily so importing this module never connects
+
+    def _sync_client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url)
+            self._scripts = (self._redis.register_script(_ACQUIRE), self._redis.register_script(_ADJUST))
+        return self._redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+            self._async_scripts = (
+                self._async_redis.register_script(_ACQUIRE),
+                self._async_redis.register_script(_ADJUST),
+            )
+        return self._async_redis
+
+    @staticmethod
+    def limits_for(model: str) -> tuple[int, int]:
+        limits = settings.llm_rate_limits.get(model, {})
+        return limits.get("rpm", settings.llm_default_rpm), limits.get("tpm", settings.llm_default_tpm)
+
+    @staticmethod
+    def _keys(model: str) -> dict[str, str]:
+        return {kind: f"{KEY_PREFIX}{kind}:{model}" for kind in ("req", "tok", "pause", "strikes")}
+
+    def _acquire_args(self, model: str, cost: int) -> tuple[list[str], list]:
+        keys = self._keys(model)
+        rpm, tpm = self.limits_for(model)
+        return [keys["req"], keys["tok"], keys["pause"]], [rpm, tpm, cost, BUCKET_TTL_SECONDS]
+
+    def _check_deadline(self, model: str, deadline: float, wait: float):
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(
+                f"LLM rate limit for {model}: not admitted within {settings.llm_rate_limit_max_wait}s"
+            )
+
+    def acquire(self, model: str, cost: int) -> float:
+        """Block until the call is admitted; returns seconds waited."""
+        if not self.enabled:
+            return 0.0
+        start = time.monotonic()
+        deadline = start + settings.llm_rate_limit_max_wait
+        keys, args = self._acquire_args(model, cost)
+        while True:
+            try:
+                self._sync_client()
+                wait = float(self._scripts[0](keys=keys, args=args))
+            except Exception as e:
+                logger.warning(f"Rate limiter unavailable, proceeding unthrottled: {e}")
+                return 0.0
+            if wait <= 0:
+                return time.monotonic() - start
+            self._check_deadline(model, deadline, wait)
+            time.sleep(min(wait, 5.0))
+
+    async def aacquire(self, model: str, cost: int) -> float:
+        if not self.enabled:
+            return 0.0
+        start = time.monotonic()
+        deadline = start + settings.llm_rate_limit_max_wait
+        keys, args = self._acquire_args(model, cost)
+        while True:
+            try:
+                self._async_client()
+                wait = float(await self._async_scripts[0](keys=keys, args=args))
+            except Exception as e:
+                logger.warning(f"Rate limiter unavailable, proceeding unthrottled: {e}")
+                return 0.0
+            if wait <= 0:
+                return time.monotonic() - start
+            self._check_deadline(model, deadline, wait)
+            await asyncio.sleep(min(wait, 5.0))
+
+    def _settle_args(self, model: str, reserved: int, used: int) -> tuple[list[str], list]:
+        return [self._keys(model)["tok"]], [self.limits_for(model)[1], reserved - used, BUCKET_TTL_SECONDS]
+
+    def record_response(self, model: str, headers, reserved: int, used: int):
+        """Settle the token reservation and apply header-driven pauses."""
+        if not self.enabled:
+            return
+        keys = self._keys(model)
+        pause = pause_from_headers(headers)
+        try:
+            client = self._sync_client()
+            self._scripts[1](*self._settle_args(model, reserved, used))
+            pipe = client.pipeline()
+            pipe.delete(keys["strikes"])
+            if pause:
+                pipe.set(keys["pause"], 1, px=int(pause * 1000))
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Rate limiter update failed: {e}")
+
+    async def arecord_response(self, model: str, headers, reserved: int, used: int):
+        if not self.enabled:
+            return
+        keys = self._keys(model)
+        pause = pause_from_headers(headers)
+        try:
+            client = self._async_client()
+            await self._async_scripts[1](*self._settle_args(model, reserved, used))
+            pipe = client.pipeline()
+            pipe.delete(keys["strikes"])
+            if pause:
+                pipe.set(keys["pause"], 1, px=int(pause * 1000))
+            await pipe.execute()
+        except Exception as e:
+            logger.debug(f"Rate limiter update failed: {e}")
+
+    @staticmethod
+    def _backoff_seconds(headers, strikes: int) -> float:
+        retry_after = _seconds_until(headers.get("retry-after")) if headers is not None else None
+        return retry_after or min(MAX_BACKOFF_SECONDS, 2.0 ** (strikes - 1))
+
+    def record_rate_limited(self, model: str, headers, reserved: int) -> float:
+        """A 429: refund the reservation and pause the model. Returns the pause."""
+        if not self.enabled:
+            return 0.0
+        keys = self._keys(model)
+        try:
+            client = self._sync_client()
+            self._scripts[1](*self._settle_args(model, reserved, 0))
+            strikes = client.incr(keys["strikes"])
+            client.expire(keys["strikes"], BUCKET_TTL_SECONDS)
+            pause = self._backoff_seconds(headers, strikes)
+            client.set(keys["pause"], 1, px=int(pause * 1000))
+        except Exception as e:
+            logger.debug(f"Rate limiter update failed: {e}")
+            pause = self._backoff_seconds(headers, 1)
+        logger.warning(f"LLM rate limited (model={model}), pausing {pause:.1f}s")
+        return pause
+
+    async def arecord_rate_limited(self, model: str, headers, reserved: int) -> float:
+        if not self.enabled:
+            return 0.0
+        keys = self._keys(model)
+        try:
+            client = self._async_client()
+            await self._async_scripts[1](*self._settle_args(model, reserved, 0))
+            strikes = await client.incr(keys["strikes"])
+            await client.expire(keys["strikes"], BUCKET_TTL_SECONDS)
+            pause = self._backoff_seconds(headers, strikes)
+            await client.set(keys["pause"], 1, px=int(pause * 1000))
+        except Exception as e:
+            logger.debug(f"Rate limiter update failed: {e}")
+            pause = self._backoff_seconds(headers, 1)
+        logger.warning(f"LLM rate limited (model={model}), pausing {pause:.1f}s")
+        return pause
+
+    async def status(self, models: list[str] | None = None) -> dict:
+        """Current bucket levels and utilization per model, under "models";
+        {"available": False, "error": ...} if Redis can't be read."""
+        try:
+            return {"available": True, "models": await self._bucket_status(models)}
+        except Exception as e:
+            logger.warning(f"Rate limiter status unavailable: {e}")
+            return {"available": False, "error": str(e)}
+
+    async def _bucket_status(self, models: list[str] | None) -> dict[str, dict]:
+        client = self._async_client()
+        known = set(models or []) | set(settings.llm_rate_limits)
+        async for key in client.scan_iter(match=f"{KEY_PREFIX}req:*"):
+            known.add(key.decode()[len(f"{KEY_PREFIX}req:"):])
+
+        seconds, micros = await client.time()
+        now = seconds + micros / 1_000_000
+        result = {}
+        for model in sorted(known):
+            keys = self._keys(model)
+            rpm, tpm = self.limits_for(model)
+            levels = {}
+            for kind, capacity in (("req", rpm), ("tok", tpm)):
+                raw_level, raw_ts = await client.hmget(keys[kind], "level", "ts")
+                level = float(raw_level) if raw_level is not None else capacity
+                ts = float(raw_ts) if raw_ts is not None else now
+                levels[kind] = min(capacity, level + (now - ts) * capacity / 60)
+            pause_ms = await client.pttl(keys["pause"])
+            result[model] = {
+                "rpm": rpm,
+                "tpm": tpm,
+                "requests_available": round(levels["req"], 2),
+                "tokens_available": round(levels["tok"]),
+                "request_utilization": round(1 - levels["req"] / rpm, 4),
+                "token_utilization": round(1 - levels["tok"] / tpm, 4),
+                "paused_for_seconds": round(max(0, pause_ms) / 1000, 2),
+                "recent_429s": int(await client.get(keys["strikes"]) or 0),
+            }
+        return result
+
+
+rate_limiter = RateLimiter(settings.redis_url, enabled=settings.llm_rate_limit_enabled)
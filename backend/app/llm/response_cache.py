@@ -0,0 +1,152 @@
+"""Exact-match LLM response cache shared by the API and Celery workers.
+
+Responses are keyed by a hash of (model, messages, temperature, max_tokens
+and any extra request params) and stored in Redis or on disk, so the async
+client and the synchronous worker path hit the same entries. Sampling at
+high temperature is meant to vary, so those calls bypass the cache unless
+the caller asks for it explicitly.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "llmcache:"
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        backend: str = "redis",
+        redis_url: str | None = None,
+        cache_dir: str | None = None,
+        ttl_seconds: int = 7 * 86400,
+        max_temperature: float = 0.3,
+    ):
+        self.backend = backend
+        self.redis_url = redis_url
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self._redis = None
+        self._async_redis = None
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        max_tokens: int,
+        **params,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "params": params,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def should_use(self, temperature: float, cache: bool | None = None) -> bool:
+        """`cache=None` means automatic: only for low-temperature calls."""
+        if self.backend == "off" or cache is False:
+            return False
+        if cache is True:
+            return True
+        return temperature <= self.max_temperature
+
+    # Redis clients are created lazily so importing this module never connects
+
+    def _sync_client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+        return self._async_redis
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text())["response"]
+        except FileNotFoundError:
+            return None
+
+    def _disk_set(self, key: str, response: str):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"response": response}))
+        tmp.replace(path)
+
+    def get(self, key: str) -> str | None:
+        try:
+            if self.backend == "disk":
+                return self._disk_get(key)
+            value = self._sync_client().get(KEY_PREFIX + key)
+            return value.decode() if value is not None else None
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def set(self, key: str, response: str):
+        if not response:
+            return
+        try:
+            if self.backend == "disk":
+                self._disk_set(key, response)
+            else:
+                self._sync_client().set(KEY_PREFIX + key, response, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+    async def aget(self, key: str) -> str | None:
+        try:
+            if self.backend == "disk":
+                return await asyncio.to_thread(self._disk_get, key)
+            value = await self._async_client().get(KEY_PREFIX + key)
+            return value.decode() if value is not None else None
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    async def aset(self, key: str, response: str):
+        if not response:
+            return
+        try:
+            if self.backend == "disk":
+                await asyncio.to_thread(self._disk_set, key, response)
+            else:
+                await self._async_client().set(KEY_PREFIX + key, response, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+
+response_cache = ResponseCache(
+    backend=settings.llm_cache_backend,
+    redis_url=settings.llm_cache_redis_url or settings.redis_url,
+    cache_dir=settings.llm_cache_dir,
+    ttl_seconds=settings.llm_cache_ttl,
+    max_temperature=settings.llm_cache_max_temperature,
+)
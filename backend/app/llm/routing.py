@@ -0,0 +1,187 @@
+"""Latency histograms and fallback/hedged execution over a model route.
+
+A task type's route is its primary model followed by fallbacks (see
+`ModelRegistry.get_route`). A call runs on the first model. If that model
+hasn't answered within its recent p95 latency, a hedged request goes to the
+next model, the first response wins and the loser is cancelled. If a model
+fails outright, the next one is tried. Streams race on time to first token.
+
+Histograms are in-process with log-spaced buckets and are halved
+periodically, so they track recent behaviour rather than all-time.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Model that actually answered the current call, for callers that record it;
+# cleared when a call starts so a cache hit never reports an earlier model
+served_model: ContextVar[str | None] = ContextVar("served_model", default=None)
+
+BUCKET_BOUNDS = tuple(0.05 * 1.5 ** i for i in range(20))  # 50ms .. ~110s
+MIN_SAMPLES = 20
+DECAY_AT = 1000
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self._counts: dict[tuple[str, str], list[float]] = defaultdict(
+            lambda: [0.0] * (len(BUCKET_BOUNDS) + 1)
+        )
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, kind: str, seconds: float):
+        """`kind` is "complete" (full response) or "first_token" (streams)."""
+        bucket = next((i for i, bound in enumerate(BUCKET_BOUNDS) if seconds <= bound), len(BUCKET_BOUNDS))
+        with self._lock:
+            counts = self._counts[(model, kind)]
+            counts[bucket] += 1
+            if sum(counts) >= DECAY_AT:
+                self._counts[(model, kind)] = [c / 2 for c in counts]
+
+    def quantile(self, model: str, kind: str, q: float) -> float | None:
+        """Upper bucket bound at quantile `q`, or None with too few samples."""
+        with self._lock:
+            counts = list(self._counts.get((model, kind), ()))
+        total = sum(counts)
+        if total < MIN_SAMPLES:
+            return None
+        running = 0.0
+        for i, count in enumerate(counts):
+            running += count
+            if running >= q * total:
+                return BUCKET_BOUNDS[min(i, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            keys = list(self._counts)
+        result: dict[str, dict] = {}
+        for model, kind in keys:
+            result.setdefault(model, {})[kind] = {
+                "samples": round(sum(self._counts[(model, kind)])),
+                "p50_s": self.quantile(model, kind, 0.5),
+                "p95_s": self.quantile(model, kind, 0.95),
+            }
+        return result
+
+
+latency = LatencyHistogram()
+
+
+async def hedged(
+    models: list[str],
+    call: Callable[[str], Awaitable[T]],
+    delay_for: Callable[[str], float | None],
+) -> T:
+    """Run `call(model)` along the route; see the module docstring.
+
+    `delay_for(model)` is how long to wait on `model` before hedging to the
+    next one, or None to only fall back on failure.
+    """
+    served_model.set(None)
+    if len(models) == 1:
+        served_model.set(models[0])
+        return await call(models[0])
+
+    remaining = list(models)
+    pending: dict[asyncio.Task, str] = {}
+    last_error: Exception | None = None
+
+    def launch() -> str:
+        model = remaining.pop(0)
+        pending[asyncio.create_task(call(model))] = model
+        return model
+
+    current = launch()
+    try:
+        while pending:
+            delay = delay_for(current) if remaining and len(pending) == 1 else None
+            done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"Hedging {current} after {delay:.2f}s with {remaining[0]}")
+                current = launch()
+                continue
+            for task in done:
+                model = pending.pop(task)
+                if task.exception() is None:
+                    served_model.set(model)
+                    return task.result()
+                last_error = task.exception()
+                logger.warning(f"LLM call on {model} failed, trying next in route: {last_error}")
+            if not pending and remaining:
+                current = launch()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def hedged_stream(
+    models: list[str],
+    open_stream: Callable[[str], AsyncIterator[str]],
+    delay_for: Callable[[str], float | None],
+) -> AsyncIterator[str]:
+    """Streaming variant of `hedged`: the first model to produce a delta wins.
+    Failures after the first delta are not retried."""
+    served_model.set(None)
+    remaining = list(models)
+    pending: dict[asyncio.Task, tuple[str, AsyncIterator[str]]] = {}
+    last_error: Exception | None = None
+    winner: tuple[str, AsyncIterator[str]] | None = None
+    first: str | None = None
+
+    def launch() -> str:
+        model = remaining.pop(0)
+        stream = open_stream(model)
+        pending[asyncio.create_task(anext(stream, None))] = (model, stream)
+        return model
+
+    async def discard(tasks: dict[asyncio.Task, tuple[str, AsyncIterator[str]]]):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _, stream in tasks.values():
+            await stream.aclose()
+
+    current = launch()
+    try:
+        while pending and winner is None:
+            delay = delay_for(current) if remaining and len(pending) == 1 else None
+            done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"Hedging stream on {current} after {delay:.2f}s with {remaining[0]}")
+                current = launch()
+                continue
+            for task in done:
+                model, stream = pending.pop(task)
+                if winner is None and task.exception() is None:
+                    winner, first = (model, stream), task.result()
+                    continue
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    logger.warning(f"LLM stream on {model} failed, trying next in route: {last_error}")
+                await stream.aclose()
+            if winner is None and not pending and remaining:
+                current = launch()
+    finally:
+        await discard(pending)
+        pending = {}
+
+    if winner is None:
+        raise last_error
+    model, stream = winner
+    served_model.set(model)
+    try:
+        if first is not None:
+            yield first
+            async for delta in stream:
+                yield delta
+    finally:
+        await stream.aclose()
@@ -0,0 +1,196 @@
+"""Semantic response cache for LLM prompts.
+
+Entries are bucketed by (task_type, model, scope). A lookup hits when an
+entry in the bucket has the same retrieved chunk ids and its prompt
+embedding is within `threshold` cosine similarity of the new one, so a
+rephrased question over the same evidence reuses the earlier answer.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import numpy as np
+from app.config import settings
+from app.llm.tokens import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    key: tuple
+    embedding: np.ndarray
+    chunk_ids: frozenset
+    response: str
+    prompt_tokens: int
+    completion_tokens: int
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: int = 86400,
+        max_entries: int = 2000,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._buckets: dict[tuple, list[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._tokens_saved = 0
+
+    @staticmethod
+    def _bucket(task_type: str, model: str, scope) -> tuple:
+        return (task_type, model, str(scope))
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            bucket = self._buckets.get(entry.key, [])
+            if entry_id in bucket:
+                bucket.remove(entry_id)
+            if not bucket:
+                self._buckets.pop(entry.key, None)
+
+    def lookup(
+        self,
+        task_type: str,
+        model: str,
+        scope,
+        embedding: list[float],
+        chunk_ids: list[int] | None = None,
+    ) -> CacheEntry | None:
+        key = self._bucket(task_type, model, scope)
+        wanted_chunks = frozenset(chunk_ids or [])
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-8
+        now = time.time()
+
+        with self._lock:
+            best_id, best_sim = None, self.threshold
+            for entry_id in list(self._buckets.get(key, [])):
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                if entry.chunk_ids != wanted_chunks:
+                    continue
+                similarity = float(np.dot(entry.embedding, query))
+                if similarity >= best_sim:
+                    best_id, best_sim = entry_id, similarity
+
+            if best_id is None:
+                self._misses += 1
+                return None
+
+            entry = self._entries[best_id]
+            self._entries.move_to_end(best_id)
+            entry.hits += 1
+            self._hits += 1
+            self._tokens_saved += entry.prompt_tokens + entry.completion_tokens
+            return entry
+
+    def store(
+        self,
+        task_type: str,
+        model: str,
+        scope,
+        embedding: list[float],
+        response: str,
+        chunk_ids: list[int] | None = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+    ) -> None:
+        if not response:
+            return
+        key = self._bucket(task_type, model, scope)
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) + 1e-8
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = CacheEntry(
+                key=key,
+                embedding=vector,
+                chunk_ids=frozenset(chunk_ids or []),
+                response=response,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            self._buckets.setdefault(key, []).append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "tokens_saved": self._tokens_saved,
+            }
+
+
+semantic_cache = SemanticCache(
+    threshold=settings.semantic_cache_threshold,
+    ttl_seconds=settings.semantic_cache_ttl,
+    max_entries=settings.semantic_cache_max_entries,
+)
+
+
+async def cached_complete(
+    messages: list[dict],
+    task_type: str,
+    scope,
+    query_text: str,
+    chunk_ids: list[int] | None = None,
+    query_embedding: list[float] | None = None,
+    **kwargs,
+) -> tuple[str, bool]:
+    """`llm_client.complete` behind the semantic cache. Returns (response, hit)."""
+    from app.llm.client import _cacheable, llm_client
+    from app.processing.embedder import generate_single_embedding
+
+    if not settings.semantic_cache_enabled:
+        return await llm_client.complete(messages=messages, task_type=task_type, **kwargs), False
+
+    model = llm_client.registry.get_model(task_type)
+    if query_embedding is None:
+        query_embedding = await asyncio.to_thread(generate_single_embedding, query_text)
+
+    entry = semantic_cache.lookup(task_type, model, scope, query_embedding, chunk_ids)
+    if entry is not None:
+        return entry.response, True
+
+    response = await llm_client.complete(messages=messages, task_type=task_type, **kwargs)
+    if not _cacheable(response, kwargs.get("json_mode", False)):
+        return response, False
+    semantic_cache.store(
+        task_type, model, scope, query_embedding, response,
+        chunk_ids=chunk_ids,
+        prompt_tokens=count_message_tokens(messages, model),
+        completion_tokens=count_tokens(response, model),
+    )
+    return response, False
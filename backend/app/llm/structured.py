@@ -0,0 +1,269 @@
+"""JSON responses from LLMs: structured-output requests, repair and retry.
+
+Prompts that expect JSON ask for the provider's JSON mode where it's
+supported. Responses are parsed leniently: markdown fences and surrounding
+prose are stripped, trailing commas dropped, and a response cut off
+mid-document is closed after its last complete element. Only if that still
+fails is the model asked once more: to resend valid JSON or, for callers
+that can send the retry without JSON mode (a continuation fragment isn't a
+JSON object), to continue where a truncated response stopped. Outcomes are counted per model in Redis so
+the API can report rates for the Celery workers too.
+"""
+import json
+import logging
+import re
+from typing import Awaitable, Callable
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+STATS_PREFIX = "llmjson:"
+STAT_FIELDS = ("calls", "repaired", "retries", "retry_recovered", "failures")
+
+CONTINUE_JSON = (
+    "Your response was cut off. Continue the JSON exactly where it stopped. "
+    "Output only the remaining text, with no repetition and no commentary."
+)
+RESEND_JSON = (
+    "That response was not valid JSON. Reply again with only the complete JSON "
+    "document, no markdown fences and no commentary."
+)
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+# Models whose provider rejected response_format; filled in at runtime
+_json_mode_unsupported: set[str] = set()
+
+
+class LLMJSONError(ValueError):
+    def __init__(self, message: str, raw: str):
+        super().__init__(message)
+        self.raw = raw
+
+
+def json_mode_supported(model: str) -> bool:
+    return settings.llm_json_mode and model not in _json_mode_unsupported
+
+
+def mark_json_mode_unsupported(model: str, error: Exception):
+    logger.warning(f"JSON mode rejected for {model}, falling back to prompt-only JSON: {error}")
+    _json_mode_unsupported.add(model)
+
+
+def _strip_wrappers(text: str) -> str:
+    text = text.strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):] if starts else text
+
+
+def _scan(text: str) -> tuple[int | None, str, bool]:
+    """Walk a (possibly truncated) JSON document.
+
+    Returns the offset just past the last complete element inside the
+    outermost container, the closers needed at that point, and whether the
+    document is still open at the end of the text.
+    """
+    stack: list[str] = []
+    in_string = escaped = False
+    cut, closers = None, ""
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            cut, closers = i + 1, "".join(reversed(stack))
+        elif ch in "}]" and stack:
+            stack.pop()
+            if not stack:
+                return None, "", False
+            cut, closers = i + 1, "".join(reversed(stack))
+        elif ch == "," and stack:
+            cut, closers = i, "".join(reversed(stack))
+    return cut, closers, bool(stack) or in_string
+
+
+def looks_truncated(text: str) -> bool:
+    return _scan(_strip_wrappers(text))[2]
+
+
+def parse_json(text: str) -> tuple[object, bool]:
+    """Parse an LLM response as JSON; returns (data, repaired)."""
+    try:
+        return json.loads(text), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    body = _strip_wrappers(text or "")
+    candidates = [body, _TRAILING_COMMA.sub(r"\1", body)]
+    cut, closers, still_open = _scan(body)
+    if still_open and cut is not None:
+        candidates.append(_TRAILING_COMMA.sub(r"\1", body[:cut] + closers))
+
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        try:
+            data, _ = decoder.raw_decode(candidate)
+            return data, True
+        except json.JSONDecodeError:
+            continue
+    raise LLMJSONError("response is not valid JSON", text)
+
+
+def retry_messages(messages: list[dict], response: str, continuation: bool = False) -> list[dict]:
+    return [
+        *messages,
+        {"role": "assistant", "content": response},
+        {"role": "user", "content": CONTINUE_JSON if continuation else RESEND_JSON},
+    ]
+
+
+def _parse_retry(first: str, retry: str, continuation: bool) -> object:
+    if not continuation:
+        return parse_json(retry)[0]
+    # A clean resend stands alone; otherwise it's a continuation of the first
+    # response. Repairing the concatenation first could accept a garbled join
+    # when the model resent the whole document.
+    try:
+        data, repaired = parse_json(retry)
+        if not repaired:
+            return data
+    except LLMJSONError:
+        pass
+    for candidate in (first + retry, retry):
+        try:
+            return parse_json(candidate)[0]
+        except LLMJSONError:
+            continue
+    raise LLMJSONError("retry response is not valid JSON", retry)
+
+
+class ParseStats:
+    """Per-model JSON parse outcomes, kept in Redis hashes."""
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._redis = None
+        self._async_redis = None
+
+    def _sync_client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def _async_client(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+            self._async_redis = aioredis.Redis.from_url(self.redis_url)
+        return self._async_redis
+
+    def record(self, model: str, **counts: int):
+        try:
+            pipe = self._sync_client().pipeline()
+            for field, n in counts.items():
+                pipe.hincrby(STATS_PREFIX + model, field, n)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"JSON parse stats write failed: {e}")
+
+    async def arecord(self, model: str, **counts: int):
+        try:
+            pipe = self._async_client().pipeline()
+            for field, n in counts.items():
+                pipe.hincrby(STATS_PREFIX + model, field, n)
+            await pipe.execute()
+        except Exception as e:
+            logger.debug(f"JSON parse stats write failed: {e}")
+
+    async def snapshot(self) -> dict[str, dict]:
+        client = self._async_client()
+        result = {}
+        async for key in client.scan_iter(match=STATS_PREFIX + "*"):
+            raw = await client.hgetall(key)
+            counts = {field: int(raw.get(field.encode(), 0)) for field in STAT_FIELDS}
+            calls = max(1, counts["calls"])
+            counts["retry_rate"] = round(counts["retries"] / calls, 4)
+            counts["failure_rate"] = round(counts["failures"] / calls, 4)
+            result[key.decode()[len(STATS_PREFIX):]] = counts
+        return result
+
+    async def reset(self):
+        client = self._async_client()
+        async for key in client.scan_iter(match=STATS_PREFIX + "*"):
+            await client.delete(key)
+
+
+parse_stats = ParseStats(settings.redis_url)
+
+
+def complete_json_sync(
+    complete: Callable[[list[dict]], str],
+    messages: list[dict],
+    model: str,
+    retry_complete: Callable[[list[dict], bool], str] | None = None,
+) -> object:
+    """Call `complete(messages)` and parse the reply, retrying once on failure.
+
+    Without `retry_complete` the retry goes through `complete` and asks for a
+    full resend. `retry_complete(messages, continuation)` makes the retry
+    instead, e.g. bypassing a cache that would hand back the reply being
+    retried; when `continuation` is True the request asks for the rest of a
+    truncated reply and must be sent without JSON mode."""
+    response = complete(messages)
+    try:
+        data, repaired = parse_json(response)
+        parse_stats.record(model, calls=1, repaired=int(repaired))
+        return data
+    except LLMJSONError:
+        pass
+
+    try:
+        continuation = retry_complete is not None and looks_truncated(response)
+        retry = retry_messages(messages, response, continuation)
+        reply = retry_complete(retry, continuation) if retry_complete else complete(retry)
+        data = _parse_retry(response, reply, continuation)
+    except Exception:
+        parse_stats.record(model, calls=1, retries=1, failures=1)
+        raise
+    parse_stats.record(model, calls=1, retries=1, retry_recovered=1)
+    return data
+
+
+async def complete_json(
+    complete: Callable[[list[dict]], Awaitable[str]],
+    messages: list[dict],
+    model: str,
+    retry_complete: Callable[[list[dict], bool], Awaitable[str]] | None = None,
+) -> object:
+    """Async variant of `complete_json_sync`."""
+    response = await complete(messages)
+    try:
+        data, repaired = parse_json(response)
+        await parse_stats.arecord(model, calls=1, repaired=int(repaired))
+        return data
+    except LLMJSONError:
+        pass
+
+    try:
+        continuation = retry_complete is not None and looks_truncated(response)
+        retry = retry_messages(messages, response, continuation)
+        reply = await (retry_complete(retry, continuation) if retry_complete else complete(retry))
+        data = _parse_retry(response, reply, continuation)
+    except Exception:
+        await parse_stats.arecord(model, calls=1, retries=1, failures=1)
+        raise
+    await parse_stats.arecord(model, calls=1, retries=1, retry_recovered=1)
+    return data
@@ -0,0 +1,42 @@
+"""Token counting with the target model's tokenizer."""
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Chat-format overhead per message (role + separators), per OpenAI's accounting
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model: str):
+    """tiktoken encoding for `model`, or None to fall back to a heuristic.
+
+    OpenRouter model ids look like "vendor/name[:tag]"; tiktoken knows OpenAI
+    names only, so anything else uses cl100k_base, which is within a few
+    percent for most modern BPE vocabularies.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken not installed, using ~4 chars/token estimate")
+        return None
+
+    name = model.split("/")[-1].split(":")[0]
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list[dict], model: str) -> int:
+    return sum(
+        count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages
+    )
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,6 +12,10 @@ import os
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     os.makedirs(settings.covers_path, exist_ok=True)
+    if settings.rerank_enabled:
+        # Load the cross-encoder up front so the first search doesn't blow the budget
+        from app.processing.reranker import get_reranker_model
+        await asyncio.to_thread(get_reranker_model)
     yield
 
 
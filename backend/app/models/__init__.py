@@ -1,25 +1,27 @@
 from app.models.book import Book, BookFile
-from app.models.chunk import BookChunk
+from app.models.chunk import BookChunk, BookEmbedding
 from app.models.category import Category, Tag, BookTag, BookCategory
-from app.models.topic import Topic, BookTopic, TopicRelation
-from app.models.insight import BookInsight, InsightConnection
+from app.models.topic import Topic, BookTopic, TopicRelation, TopicLabel
+from app.models.insight import BookInsight, InsightConnection, BookEdge, InsightMapShard
 from app.models.reading import ReadingProgress, ReadingSession
 from app.models.chat import ChatSession, ChatMessage
 from app.models.feed import FeedItem
-from app.models.processing import ProcessingJob
+from app.models.processing import ProcessingJob, LLMBatch
 from app.models.enrichment import ExternalMetadata
 from app.models.knowledge import LearningPath, LearningPathBook
+from app.models.recommendation import Recommendation
 
 __all__ = [
     "Book", "BookFile",
-    "BookChunk",
+    "BookChunk", "BookEmbedding",
     "Category", "Tag", "BookTag", "BookCategory",
-    "Topic", "BookTopic", "TopicRelation",
-    "BookInsight", "InsightConnection",
+    "Topic", "BookTopic", "TopicRelation", "TopicLabel",
+    "BookInsight", "InsightConnection", "BookEdge", "InsightMapShard",
     "ReadingProgress", "ReadingSession",
     "ChatSession", "ChatMessage",
     "FeedItem",
-    "ProcessingJob",
+    "ProcessingJob", "LLMBatch",
     "ExternalMetadata",
     "LearningPath", "LearningPathBook",
+    "Recommendation",
 ]
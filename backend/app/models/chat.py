@@ -29,6 +29,7 @@ class ChatMessage(Base):
     source_chunks = Column(JSONB, default=[])  # [{chunk_id, book_title, page, snippet}]
     model_used = Column(String(100))
     token_count = Column(Integer)
+    metadata_json = Column(JSONB, default={})  # {timings: {phase_ms: ...}, usage: {prompt_tokens, ...}}
 
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
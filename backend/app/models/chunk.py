@@ -29,3 +29,37 @@ class BookChunk(Base):
               postgresql_with={"m": 16, "ef_construction": 64},
               postgresql_ops={"embedding": "vector_cosine_ops"}),
     )
+
+
+class BookEmbedding(Base):
+    """Running-mean centroid of a book's chunk embeddings.
+
+    One row per book with `chapter` NULL (the whole-book centroid), plus one
+    per chapter. `chunk_count` lets new chunks be folded in without
+    re-reading the ones already counted.
+    """
+    __tablename__ = "book_embeddings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False, index=True)
+    chapter = Column(String(300))
+    chunk_count = Column(Integer, nullable=False, default=0)
+    embedding = Column(Vector(384), nullable=False)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_book_embeddings_book", "book_id", unique=True, postgresql_where=chapter.is_(None)),
+        Index("ix_book_embeddings_book_chapter", "book_id", "chapter", unique=True,
+              postgresql_where=chapter.isnot(None)),
+        # Separate partial HNSW graphs so book-level searches never wade through chapter rows
+        Index("ix_book_embeddings_book_hnsw", "embedding", postgresql_using="hnsw",
+              postgresql_with={"m": 16, "ef_construction": 64},
+              postgresql_ops={"embedding": "vector_cosine_ops"},
+              postgresql_where=chapter.is_(None)),
+        Index("ix_book_embeddings_chapter_hnsw", "embedding", postgresql_using="hnsw",
+              postgresql_with={"m": 16, "ef_construction": 64},
+              postgresql_ops={"embedding": "vector_cosine_ops"},
+              postgresql_where=chapter.isnot(None)),
+    )
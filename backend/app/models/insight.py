@@ -1,5 +1,6 @@
 from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from pgvector.sqlalchemy import Vector
 from app.db.base import Base
 import datetime
@@ -18,6 +19,7 @@ class BookInsight(Base):
     importance = Column(Integer, default=5)  # 1-10
     refinement_level = Column(Integer, default=1)
     embedding = Column(Vector(384))
+    connections_scanned_at = Column(DateTime, index=True)  # set once cross-book neighbours were searched
 
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -45,3 +47,56 @@ class InsightConnection(Base):
 
     insight_a = relationship("BookInsight", foreign_keys=[insight_a_id])
     insight_b = relationship("BookInsight", foreign_keys=[insight_b_id])
+
+    __table_args__ = (
+        # Pairs are stored with insight_a_id < insight_b_id
+        Index("ix_insight_connections_pair", "insight_a_id", "insight_b_id", unique=True),
+        Index("ix_insight_connections_b", "insight_b_id"),
+    )
+
+
+class BookEdge(Base):
+    """Book-to-book aggregate of cross-book insight connections, maintained
+    as connections are inserted (see app.services.book_edges)."""
+    __tablename__ = "book_edges"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_a_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)  # book_a_id < book_b_id
+    book_b_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
+    connection_count = Column(Integer, nullable=False, default=0)
+    strength_sum = Column(Float, nullable=False, default=0.0)
+    max_strength = Column(Float, nullable=False, default=0.0)
+    top_connections = Column(JSONB, default=[])  # strongest few: insight ids, titles, strength, description
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_book_edges_pair", "book_a_id", "book_b_id", unique=True),
+        Index("ix_book_edges_max_strength", "max_strength"),
+    )
+
+
+class InsightMapShard(Base):
+    """Cached map-phase summary of a window of a book's chunks.
+
+    Keyed by a hash of the window's chunk contents so a re-run (after a
+    crash, or for a refinement pass) only summarizes windows it hasn't seen.
+    """
+    __tablename__ = "insight_map_shards"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False, index=True)
+    shard_index = Column(Integer, nullable=False)
+    chunk_hash = Column(String(64), nullable=False)
+    chapter = Column(String(300))
+    first_chunk_index = Column(Integer)
+    last_chunk_index = Column(Integer)
+    summary = Column(Text, nullable=False)
+    model_used = Column(String(100))
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_insight_map_shards_book_hash", "book_id", "chunk_hash", unique=True),
+    )
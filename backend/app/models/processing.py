@@ -1,4 +1,5 @@
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 import datetime
@@ -12,7 +13,7 @@ class ProcessingJob(Base):
     stage = Column(String(50), nullable=False)
     # scan, extract, chunk, embed, insights_pass_1, insights_pass_2, insights_pass_3, enrichment, topic
     status = Column(String(20), default="pending", index=True)
-    # pending, running, completed, failed, skipped
+    # pending, running, completed, failed, skipped; queued / batched in insight batch mode
     celery_task_id = Column(String(100))
     attempts = Column(Integer, default=0)
     error_message = Column(Text)
@@ -23,3 +24,23 @@ class ProcessingJob(Base):
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     book = relationship("Book", back_populates="processing_jobs")
+
+
+class LLMBatch(Base):
+    """A provider batch submission of LLM requests (see app.llm.batch)."""
+    __tablename__ = "llm_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    purpose = Column(String(50), nullable=False)  # insights
+    backend = Column(String(20), nullable=False)  # openai, local
+    provider_batch_id = Column(String(200), index=True)
+    status = Column(String(20), default="submitted", index=True)
+    # submitted, completed (ingested), failed
+    request_count = Column(Integer, default=0)
+    succeeded_count = Column(Integer, default=0)
+    job_ids = Column(JSONB, default=list)
+    error_message = Column(Text)
+    submitted_at = Column(DateTime, default=datetime.datetime.utcnow)
+    completed_at = Column(DateTime)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy.orm import relationship
+from app.db.base import Base
+import datetime
+
+
+class Recommendation(Base):
+    """Materialized home-page recommendations, rewritten as a whole by the
+    refresh task. `inputs_hash` fingerprints the reading history and library
+    state they were computed from; a mismatch with the current fingerprint
+    means they are stale."""
+    __tablename__ = "recommendations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
+    rank = Column(Integer, nullable=False, index=True)
+    score = Column(Float)  # cosine similarity to the closest source book; NULL for recent-book fallback
+    source_book_id = Column(Integer, ForeignKey("books.id", ondelete="SET NULL"))
+    inputs_hash = Column(String(40), nullable=False)
+
+    computed_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    book = relationship("Book", foreign_keys=[book_id])
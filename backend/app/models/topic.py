@@ -16,6 +16,10 @@ class Topic(Base):
     embedding = Column(Vector(384))
     book_count = Column(Integer, default=0)
     color = Column(String(7))  # hex color for UI
+    parent_id = Column(Integer, ForeignKey("topics.id", ondelete="CASCADE"), index=True)
+    level = Column(Integer, nullable=False, default=0)  # 0 = coarse topic, 1 = subtopic
+    membership_hash = Column(String(40))  # hash of the current member book ids
+    label_hash = Column(String(40))  # membership hash the current name was generated for
 
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -50,3 +54,19 @@ class TopicRelation(Base):
 
     topic_a = relationship("Topic", foreign_keys=[topic_a_id])
     topic_b = relationship("Topic", foreign_keys=[topic_b_id])
+
+
+class TopicLabel(Base):
+    """LLM-generated topic label, cached by the hash of the cluster's member
+    book ids so an unchanged cluster is never labeled twice."""
+    __tablename__ = "topic_labels"
+
+    id = Column(Integer, primary_key=True, index=True)
+    membership_hash = Column(String(40), unique=True, nullable=False)
+    name = Column(String(200), nullable=False)
+    description = Column(Text)
+    keywords = Column(ARRAY(String))
+    book_ids = Column(ARRAY(Integer), nullable=False)
+    model_used = Column(String(100))
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,69 @@
+"""Representative chunk selection by clustering chunk embeddings."""
+import logging
+from typing import Callable
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+logger = logging.getLogger(__name__)
+
+MINIBATCH_THRESHOLD = 2000
+
+
+def select_representative_chunks(
+    chunks: list,
+    token_budget: int,
+    seed: int = 42,
+    count_tokens: Callable[[str], int] | None = None,
+    char_budget: int | None = None,
+    separator: str = "",
+) -> list:
+    """Pick the most central chunk of each embedding cluster within a budget.
+
+    `chunks` need .embedding, .content and .chunk_index, plus .token_count
+    unless `count_tokens` is given to count with the target tokenizer. With
+    `char_budget`, the selection joined by `separator` also fits that many
+    characters. The number of clusters is sized so one chunk per cluster
+    roughly fills the budget; clusters are taken largest first (the book's
+    dominant themes) and the selection is returned in reading order.
+    """
+    chunks = [c for c in chunks if c.embedding is not None]
+    if not chunks:
+        return []
+
+    if count_tokens is not None:
+        tokens = np.array([count_tokens(c.content) for c in chunks], dtype=float)
+    else:
+        tokens = np.array([c.token_count or len(c.content.split()) for c in chunks], dtype=float)
+    chars = np.array([len(c.content) + len(separator) for c in chunks], dtype=float)
+    char_budget = char_budget if char_budget is not None else np.inf
+    if tokens.sum() <= token_budget and chars.sum() <= char_budget:
+        return sorted(chunks, key=lambda c: c.chunk_index)
+
+    X = np.asarray([c.embedding for c in chunks], dtype=np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True) + 1e-8
+
+    fits = min(token_budget / max(1.0, tokens.mean()), char_budget / max(1.0, chars.mean()))
+    n_clusters = int(min(len(chunks), max(2, fits)))
+    if len(chunks) > MINIBATCH_THRESHOLD:
+        model = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3, batch_size=1024)
+    else:
+        model = KMeans(n_clusters=n_clusters, random_state=seed, n_init=4)
+    labels = model.fit_predict(X)
+
+    centers = model.cluster_centers_ / (np.linalg.norm(model.cluster_centers_, axis=1, keepdims=True) + 1e-8)
+    similarity = np.einsum("ij,ij->i", X, centers[labels])
+
+    cluster_sizes = np.bincount(labels, minlength=n_clusters)
+    selected, used, used_chars = [], 0.0, 0.0
+    for cluster in np.argsort(-cluster_sizes):
+        members = np.flatnonzero(labels == cluster)
+        if members.size == 0:
+            continue
+        medoid = members[np.argmax(similarity[members])]
+        if used + tokens[medoid] > token_budget or used_chars + chars[medoid] > char_budget:
+            continue
+        selected.append(chunks[medoid])
+        used += tokens[medoid]
+        used_chars += chars[medoid]
+
+    return sorted(selected, key=lambda c: c.chunk_index)
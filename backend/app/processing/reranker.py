@@ -0,0 +1,27 @@
+"""Cross-encoder re-ranking of retrieval candidates."""
+import logging
+from sentence_transformers import CrossEncoder
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_model = None
+
+
+def get_reranker_model() -> CrossEncoder:
+    global _model
+    if _model is None:
+        logger.info(f"Loading re-ranker model: {settings.rerank_model}")
+        _model = CrossEncoder(settings.rerank_model, max_length=512)
+        logger.info("Re-ranker model loaded")
+    return _model
+
+
+def rerank_scores(query: str, passages: list[str]) -> list[float]:
+    """Score (query, passage) pairs in a single batched forward pass."""
+    if not passages:
+        return []
+    model = get_reranker_model()
+    pairs = [(query, p) for p in passages]
+    scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+    return [float(s) for s in scores]
@@ -56,3 +56,9 @@ class BookListResponse(BaseModel):
     total: int
     skip: int
     limit: int
+
+
+class RecommendationStatusOut(BaseModel):
+    computed_at: datetime | None = None
+    count: int
+    stale: bool
@@ -37,6 +37,7 @@ class ChatMessageOut(BaseModel):
     content: str
     source_chunks: list[dict] = []
     model_used: str | None = None
+    metadata_json: dict | None = None
     created_at: datetime
 
     model_config = {"from_attributes": True}
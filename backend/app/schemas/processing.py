@@ -16,6 +16,21 @@ class ProcessingJobOut(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class LLMBatchOut(BaseModel):
+    id: int
+    purpose: str
+    backend: str
+    provider_batch_id: str | None = None
+    status: str
+    request_count: int
+    succeeded_count: int
+    error_message: str | None = None
+    submitted_at: datetime | None = None
+    completed_at: datetime | None = None
+
+    model_config = {"from_attributes": True}
+
+
 class ScanRequest(BaseModel):
     directory: str
 
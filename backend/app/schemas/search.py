@@ -11,6 +11,7 @@ class SearchResult(BaseModel):
     page_number: int | None = None
     chapter: str | None = None
     score: float
+    rerank_score: float | None = None
 
 
 class SearchResponse(BaseModel):
@@ -10,6 +10,8 @@ class TopicOut(BaseModel):
     keywords: list[str] = []
     book_count: int
     color: str | None = None
+    parent_id: int | None = None
+    level: int = 0
     created_at: datetime
 
     model_config = {"from_attributes": True}
@@ -20,6 +22,7 @@ class TopicGraphNode(BaseModel):
     name: str
     book_count: int
     color: str | None = None
+    subtopics: list["TopicGraphNode"] = []
 
 
 class TopicGraphEdge(BaseModel):
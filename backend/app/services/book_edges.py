@@ -0,0 +1,148 @@
+"""Incremental book-to-book edge aggregation (book_edges).
+
+Every cross-book InsightConnection contributes to the edge between its two
+books: connection count, strength sum and max, and the strongest few
+connections for display. `add_connections` folds newly inserted
+connections into existing edges. Connections only disappear through
+cascades when insights are deleted, so `sync_book_edges` compares the
+aggregate count with the source and rebuilds everything on a mismatch.
+
+Sync (Session) functions, called from the connection discovery job. The
+job calls `bump_edges_version` after committing, which invalidates cached
+knowledge maps.
+"""
+import logging
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.orm import Session, aliased
+from app.config import settings
+from app.models.insight import BookInsight, InsightConnection, BookEdge
+
+logger = logging.getLogger(__name__)
+
+TOP_CONNECTIONS = 3
+INSERT_BATCH = 5000
+# Redis counter that versions cached knowledge responses (app.services.knowledge_service);
+# outside the cache prefix, so clearing the cache never resets it and reuses versions
+EDGES_VERSION_KEY = "knowledge-version:edges"
+
+
+def _connection_rows(db: Session, connection_ids: list[int] | None = None):
+    """(book_a, book_b, connection summary) for cross-book connections."""
+    insight_a, insight_b = aliased(BookInsight), aliased(BookInsight)
+    query = (
+        select(
+            InsightConnection.id, InsightConnection.strength, InsightConnection.description,
+            insight_a.id, insight_a.book_id, insight_a.title,
+            insight_b.id, insight_b.book_id, insight_b.title,
+        )
+        .join(insight_a, insight_a.id == InsightConnection.insight_a_id)
+        .join(insight_b, insight_b.id == InsightConnection.insight_b_id)
+        .where(insight_a.book_id != insight_b.book_id)
+    )
+    if connection_ids is not None:
+        query = query.where(InsightConnection.id.in_(connection_ids))
+    for conn_id, strength, description, ia, book_a, title_a, ib, book_b, title_b in db.execute(query).all():
+        if book_a > book_b:
+            book_a, book_b, ia, ib, title_a, title_b = book_b, book_a, ib, ia, title_b, title_a
+        yield book_a, book_b, {
+            "connection_id": conn_id,
+            "strength": strength,
+            "insight_a": {"id": ia, "title": title_a},
+            "insight_b": {"id": ib, "title": title_b},
+            "description": description,
+        }
+
+
+def _group(rows) -> dict[tuple[int, int], list[dict]]:
+    grouped: dict[tuple[int, int], list[dict]] = {}
+    for book_a, book_b, summary in rows:
+        grouped.setdefault((book_a, book_b), []).append(summary)
+    return grouped
+
+
+def _top(connections: list[dict]) -> list[dict]:
+    return sorted(connections, key=lambda c: (-(c["strength"] or 0.0), c["connection_id"]))[:TOP_CONNECTIONS]
+
+
+def add_connections(db: Session, connection_ids: list[int]) -> int:
+    """Fold newly inserted connections into book_edges. Returns edges touched."""
+    if not connection_ids:
+        return 0
+    grouped = _group(_connection_rows(db, connection_ids))
+    if not grouped:
+        return 0
+
+    existing = {
+        (edge.book_a_id, edge.book_b_id): edge
+        for edge in db.execute(
+            select(BookEdge)
+            .where(BookEdge.book_a_id.in_(list({a for a, _ in grouped})))
+            .where(BookEdge.book_b_id.in_(list({b for _, b in grouped})))
+            .with_for_update()
+        ).scalars().all()
+    }
+    for (book_a, book_b), connections in grouped.items():
+        strengths = [c["strength"] or 0.0 for c in connections]
+        edge = existing.get((book_a, book_b))
+        if edge is None:
+            db.add(BookEdge(
+                book_a_id=book_a, book_b_id=book_b,
+                connection_count=len(connections),
+                strength_sum=sum(strengths),
+                max_strength=max(strengths),
+                top_connections=_top(connections),
+            ))
+            continue
+        edge.connection_count += len(connections)
+        edge.strength_sum += sum(strengths)
+        edge.max_strength = max(edge.max_strength, *strengths)
+        edge.top_connections = _top(list(edge.top_connections or []) + connections)
+    db.flush()
+    return len(grouped)
+
+
+def rebuild_book_edges(db: Session) -> int:
+    """Recompute book_edges from all connections. Does not commit."""
+    grouped = _group(_connection_rows(db))
+    db.execute(delete(BookEdge))
+    values = []
+    for (book_a, book_b), connections in grouped.items():
+        strengths = [c["strength"] or 0.0 for c in connections]
+        values.append({
+            "book_a_id": book_a, "book_b_id": book_b,
+            "connection_count": len(connections),
+            "strength_sum": sum(strengths),
+            "max_strength": max(strengths),
+            "top_connections": _top(connections),
+        })
+    for start in range(0, len(values), INSERT_BATCH):
+        db.execute(insert(BookEdge), values[start:start + INSERT_BATCH])
+    logger.info(f"Rebuilt {len(values)} book edges")
+    return len(values)
+
+
+def sync_book_edges(db: Session) -> bool:
+    """Rebuild if connections were deleted since the edges were aggregated.
+    Returns True if a rebuild ran."""
+    insight_a, insight_b = aliased(BookInsight), aliased(BookInsight)
+    source = db.execute(
+        select(func.count(InsightConnection.id))
+        .join(insight_a, insight_a.id == InsightConnection.insight_a_id)
+        .join(insight_b, insight_b.id == InsightConnection.insight_b_id)
+        .where(insight_a.book_id != insight_b.book_id)
+    ).scalar()
+    aggregated = db.execute(select(func.coalesce(func.sum(BookEdge.connection_count), 0))).scalar()
+    if source == aggregated:
+        return False
+    rebuild_book_edges(db)
+    return True
+
+
+def bump_edges_version():
+    """Invalidate cached knowledge responses; call after committing changes
+    to connections or edges."""
+    try:
+        import redis
+        redis.Redis.from_url(settings.redis_url).incr(EDGES_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Knowledge map cache invalidation failed: {e}")
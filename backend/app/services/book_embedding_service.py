@@ -0,0 +1,122 @@
+"""Per-book and per-chapter embedding centroids (book_embeddings).
+
+Centroids are running means over every embedded chunk. The embedding
+pipeline folds each freshly embedded batch into them in the same
+transaction as the chunk writes, so after a book's first batch they never
+need a full rescan.
+`rebuild_book_embeddings` recomputes a book from its chunks in SQL, for
+backfills and repairs.
+
+Sync (Session) functions; async callers go through AsyncSession.run_sync.
+"""
+import logging
+import numpy as np
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+from pgvector.sqlalchemy import Vector
+from app.config import settings
+from app.models.book import Book
+from app.models.chunk import BookChunk, BookEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+def _chapter_key(chapter: str | None) -> str | None:
+    if not settings.book_embedding_chapters or not chapter:
+        return None
+    return chapter
+
+
+def fold_chunk_embeddings(db: Session, book_id: int, chunks: list[BookChunk]):
+    """Add newly embedded `chunks` to the book's centroids. Each chunk must
+    be folded exactly once - callers pass chunks whose embedding they just set."""
+    groups: dict[str | None, list] = {}
+    for chunk in chunks:
+        if chunk.embedding is None:
+            continue
+        groups.setdefault(None, []).append(chunk.embedding)
+        chapter = _chapter_key(chunk.chapter)
+        if chapter:
+            groups.setdefault(chapter, []).append(chunk.embedding)
+    if not groups:
+        return
+
+    rows = {
+        row.chapter: row
+        for row in db.execute(
+            select(BookEmbedding)
+            .where(BookEmbedding.book_id == book_id)
+            .where(BookEmbedding.chapter.is_(None) | BookEmbedding.chapter.in_([c for c in groups if c]))
+        ).scalars().all()
+    }
+    if None not in rows:
+        # First fold for this book: chunks embedded before centroids were
+        # tracked (a resumed book) must count too, so compute from the table
+        db.flush()
+        rebuild_book_embeddings(db, book_id)
+        return
+    for chapter, vectors in groups.items():
+        batch = np.asarray(vectors, dtype=np.float64)
+        row = rows.get(chapter)
+        if row is None:
+            db.add(BookEmbedding(
+                book_id=book_id, chapter=chapter, chunk_count=len(batch), embedding=batch.mean(axis=0).tolist(),
+            ))
+            continue
+        total = row.chunk_count + len(batch)
+        row.embedding = ((np.asarray(row.embedding, dtype=np.float64) * row.chunk_count + batch.sum(axis=0)) / total).tolist()
+        row.chunk_count = total
+
+
+def clear_book_embeddings(db: Session, book_id: int):
+    """Drop a book's centroids, e.g. when its chunks are regenerated."""
+    db.execute(delete(BookEmbedding).where(BookEmbedding.book_id == book_id))
+
+
+def rebuild_book_embeddings(db: Session, book_id: int) -> int:
+    """Recompute a book's centroids from all of its embedded chunks.
+    Returns the number of centroid rows written. Does not commit."""
+    clear_book_embeddings(db, book_id)
+    centroid = func.avg(BookChunk.embedding, type_=Vector(settings.embedding_dimension))
+    base = (
+        select(func.count(BookChunk.id), centroid)
+        .where(BookChunk.book_id == book_id)
+        .where(BookChunk.embedding.isnot(None))
+    )
+    count, embedding = db.execute(base).one()
+    if not count:
+        return 0
+    db.add(BookEmbedding(book_id=book_id, chapter=None, chunk_count=count, embedding=embedding))
+    written = 1
+
+    if settings.book_embedding_chapters:
+        chapters = db.execute(
+            base.add_columns(BookChunk.chapter)
+            .where(BookChunk.chapter.isnot(None))
+            .where(BookChunk.chapter != "")
+            .group_by(BookChunk.chapter)
+        ).all()
+        for count, embedding, chapter in chapters:
+            db.add(BookEmbedding(book_id=book_id, chapter=chapter, chunk_count=count, embedding=embedding))
+            written += 1
+    db.flush()
+    return written
+
+
+def books_missing_embeddings(db: Session, limit: int = 500) -> list[int]:
+    """Books with embedded chunks but no book-level centroid."""
+    has_centroid = (
+        select(BookEmbedding.id)
+        .where(BookEmbedding.book_id == Book.id)
+        .where(BookEmbedding.chapter.is_(None))
+        .exists()
+    )
+    has_embedded_chunk = (
+        select(BookChunk.id)
+        .where(BookChunk.book_id == Book.id)
+        .where(BookChunk.embedding.isnot(None))
+        .exists()
+    )
+    return list(db.execute(
+        select(Book.id).where(~has_centroid).where(has_embedded_chunk).order_by(Book.id).limit(limit)
+    ).scalars().all())
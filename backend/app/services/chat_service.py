@@ -1,11 +1,23 @@
 """RAG chat pipeline."""
+import asyncio
+import hashlib
+import json
 import logging
+import time
+from dataclasses import dataclass
 from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.chat import ChatSession, ChatMessage
-from app.services.search_service import hybrid_search
+from app.services.search_service import hybrid_search_concurrent
 from app.llm.client import llm_client
 from app.llm.prompts import CHAT_SYSTEM, CHAT_WITH_CONTEXT
+from app.llm.context_packer import ContextPacker
+from app.llm.routing import served_model
+from app.llm.semantic_cache import semantic_cache
+from app.llm.tokens import count_message_tokens, count_tokens
+from app.processing.embedder import generate_single_embedding
+from app.config import settings
+from app.utils.timing import timed, phase_timer
 
 logger = logging.getLogger(__name__)
 
@@ -40,63 +52,154 @@ async def get_chat_messages(db: AsyncSession, session_id: int) -> list[ChatMessa
     return list(result.scalars().all())
 
 
-async def send_message(
+@dataclass
+class _PreparedChat:
+    messages: list[dict]
+    source_chunks: list[dict]
+    usage: dict
+    cache_scope: str
+    query_embedding: list[float]
+    chunk_ids: list[int]
+
+
+async def _load_history(db: AsyncSession, session_id: int, exclude_id: int, limit: int) -> list[ChatMessage]:
+    result = await db.execute(
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .where(ChatMessage.id != exclude_id)
+        .order_by(desc(ChatMessage.created_at))
+        .limit(limit)
+    )
+    return list(reversed(result.scalars().all()))
+
+
+async def _prepare_chat(
     db: AsyncSession,
     session_id: int,
     user_message: str,
-) -> ChatMessage:
+    timings: dict[str, float],
+) -> _PreparedChat:
+    """Persist the user turn and build the LLM prompt.
+
+    History loading and retrieval (embedding, FTS, ANN) run concurrently;
+    retrieval uses its own sessions so the request session stays free for
+    history. The prompt is then packed to the configured token budget.
+    """
     session = await db.get(ChatSession, session_id)
     if not session:
         raise ValueError(f"Session {session_id} not found")
 
-    user_msg = ChatMessage(
-        session_id=session_id,
-        role="user",
-        content=user_message,
-    )
+    user_msg = ChatMessage(session_id=session_id, role="user", content=user_message)
     db.add(user_msg)
     await db.flush()
 
-    # RAG: retrieve relevant chunks
+    # RAG: retrieve relevant chunks while history loads
     book_ids = session.book_ids if session.book_ids else None
-    search_results = await hybrid_search(db, user_message, limit=8, book_ids=book_ids)
+    embedding_task = asyncio.create_task(asyncio.to_thread(generate_single_embedding, user_message))
+    with phase_timer(timings, "retrieval_ms"):
+        history, search_results = await asyncio.gather(
+            timed(timings, "history_ms", _load_history(
+                db, session_id, user_msg.id, limit=settings.chat_history_turns,
+            )),
+            hybrid_search_concurrent(
+                user_message, limit=settings.chat_retrieval_limit, book_ids=book_ids,
+                timings=timings, query_embedding=embedding_task,
+            ),
+        )
 
-    context_parts = []
-    source_chunks = []
-    for r in search_results:
-        context_parts.append(
-            f"[{r.get('book_title', 'Unknown')} - p.{r.get('page_number', '?')}]\n{r['content']}"
+    with phase_timer(timings, "prompt_ms"):
+        packer = ContextPacker(
+            model=llm_client.registry.get_model("chat"),
+            budget=settings.chat_context_budget,
+            history_budget=settings.chat_history_budget,
         )
-        source_chunks.append({
-            "chunk_id": r["chunk_id"],
-            "book_title": r.get("book_title"),
-            "page_number": r.get("page_number"),
-            "snippet": r["content"][:200],
+        packed = packer.pack(
+            chunks=search_results,
+            history=[{"role": m.role, "content": m.content} for m in history],
+            system_prompt=CHAT_SYSTEM,
+            user_template=CHAT_WITH_CONTEXT,
+            question=user_message,
+        )
+
+        source_chunks = [
+            {
+                "chunk_id": r["chunk_id"],
+                "book_title": r.get("book_title"),
+                "page_number": r.get("page_number"),
+                "snippet": r["content"][:200],
+            }
+            for r in packed.chunks
+        ]
+
+        messages = [{"role": "system", "content": CHAT_SYSTEM}]
+        messages.extend(packed.history)
+        messages.append({
+            "role": "user",
+            "content": CHAT_WITH_CONTEXT.format(context=packed.context, question=user_message),
         })
 
-    context = "\n\n---\n\n".join(context_parts) if context_parts else "No relevant content found."
+    user_msg.token_count = packer.count(user_message)
+
+    # Follow-ups only share answers when the packed history is identical too
+    history_hash = hashlib.sha256(json.dumps(packed.history).encode()).hexdigest()[:16]
+    return _PreparedChat(
+        messages=messages,
+        source_chunks=source_chunks,
+        usage=packed.usage(),
+        cache_scope=f"books={sorted(book_ids or [])}|history={history_hash}",
+        query_embedding=await embedding_task,
+        chunk_ids=[c["chunk_id"] for c in packed.chunks],
+    )
+
+
+def _cache_lookup(prepared: _PreparedChat) -> str | None:
+    if not settings.semantic_cache_enabled:
+        return None
+    entry = semantic_cache.lookup(
+        "chat", llm_client.registry.get_model("chat"), prepared.cache_scope,
+        prepared.query_embedding, prepared.chunk_ids,
+    )
+    return entry.response if entry else None
+
+
+def _cache_store(prepared: _PreparedChat, response: str):
+    if not settings.semantic_cache_enabled:
+        return
+    model = llm_client.registry.get_model("chat")
+    semantic_cache.store(
+        "chat", model, prepared.cache_scope, prepared.query_embedding, response,
+        chunk_ids=prepared.chunk_ids,
+        prompt_tokens=count_message_tokens(prepared.messages, model),
+        completion_tokens=count_tokens(response, model),
+    )
+
 
-    # Build conversation history
-    history = await get_chat_messages(db, session_id)
-    messages = [{"role": "system", "content": CHAT_SYSTEM}]
-    for msg in history[-10:]:  # Last 10 messages for context
-        if msg.id == user_msg.id:
-            continue
-        messages.append({"role": msg.role, "content": msg.content})
+async def send_message(
+    db: AsyncSession,
+    session_id: int,
+    user_message: str,
+) -> ChatMessage:
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
 
-    messages.append({
-        "role": "user",
-        "content": CHAT_WITH_CONTEXT.format(context=context, question=user_message),
-    })
+    prepared = await _prepare_chat(db, session_id, user_message, timings)
 
-    response = await llm_client.complete(messages=messages, task_type="chat")
+    response = _cache_lookup(prepared)
+    cache_hit = response is not None
+    if not cache_hit:
+        response = await timed(
+            timings, "llm_ms", llm_client.complete(messages=prepared.messages, task_type="chat")
+        )
+        _cache_store(prepared, response)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
     assistant_msg = ChatMessage(
         session_id=session_id,
         role="assistant",
         content=response,
-        source_chunks=source_chunks,
-        model_used=llm_client.registry.get_model("chat"),
+        source_chunks=prepared.source_chunks,
+        model_used=(not cache_hit and served_model.get()) or llm_client.registry.get_model("chat"),
+        metadata_json={"timings": timings, "usage": prepared.usage, "cache_hit": cache_hit},
     )
     db.add(assistant_msg)
     await db.flush()
@@ -105,50 +208,44 @@ async def send_message(
 
 
 async def stream_message(db: AsyncSession, session_id: int, user_message: str):
-    """Stream a chat response. Yields content chunks."""
-    session = await db.get(ChatSession, session_id)
-    if not session:
-        raise ValueError(f"Session {session_id} not found")
-
-    user_msg = ChatMessage(session_id=session_id, role="user", content=user_message)
-    db.add(user_msg)
-    await db.flush()
-
-    book_ids = session.book_ids if session.book_ids else None
-    search_results = await hybrid_search(db, user_message, limit=8, book_ids=book_ids)
-
-    context_parts = []
-    source_chunks = []
-    for r in search_results:
-        context_parts.append(f"[{r.get('book_title', 'Unknown')} - p.{r.get('page_number', '?')}]\n{r['content']}")
-        source_chunks.append({
-            "chunk_id": r["chunk_id"],
-            "book_title": r.get("book_title"),
-            "page_number": r.get("page_number"),
-            "snippet": r["content"][:200],
-        })
-
-    context = "\n\n---\n\n".join(context_parts) if context_parts else "No relevant content found."
-
-    messages = [
-        {"role": "system", "content": CHAT_SYSTEM},
-        {"role": "user", "content": CHAT_WITH_CONTEXT.format(context=context, question=user_message)},
-    ]
-
-    full_response = ""
-    async for chunk in llm_client.complete_stream(messages=messages, task_type="chat"):
-        full_response += chunk
-        yield {"type": "content", "data": chunk}
+    """Stream a chat response. Yields a sources event, content chunks, then done."""
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+
+    prepared = await _prepare_chat(db, session_id, user_message, timings)
+
+    yield {"type": "sources", "data": prepared.source_chunks}
+
+    full_response = _cache_lookup(prepared)
+    cache_hit = full_response is not None
+    if cache_hit:
+        yield {"type": "content", "data": full_response}
+    else:
+        full_response = ""
+        llm_started = time.perf_counter()
+        async for chunk in llm_client.complete_stream(messages=prepared.messages, task_type="chat"):
+            if not full_response:
+                timings["llm_first_token_ms"] = round((time.perf_counter() - llm_started) * 1000, 1)
+            full_response += chunk
+            yield {"type": "content", "data": chunk}
+        timings["llm_ms"] = round((time.perf_counter() - llm_started) * 1000, 1)
+        _cache_store(prepared, full_response)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
     assistant_msg = ChatMessage(
         session_id=session_id,
         role="assistant",
         content=full_response,
-        source_chunks=source_chunks,
-        model_used=llm_client.registry.get_model("chat"),
+        source_chunks=prepared.source_chunks,
+        model_used=(not cache_hit and served_model.get()) or llm_client.registry.get_model("chat"),
+        metadata_json={"timings": timings, "usage": prepared.usage, "cache_hit": cache_hit},
     )
     db.add(assistant_msg)
     await db.flush()
 
-    yield {"type": "sources", "data": source_chunks}
-    yield {"type": "done", "data": {"message_id": assistant_msg.id}}
+    yield {"type": "done", "data": {
+        "message_id": assistant_msg.id,
+        "timings": timings,
+        "usage": prepared.usage,
+        "cache_hit": cache_hit,
+    }}
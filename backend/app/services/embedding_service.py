@@ -4,6 +4,7 @@ from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.chunk import BookChunk
 from app.processing.embedder import generate_embeddings
+from app.services.book_embedding_service import fold_chunk_embeddings
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,7 @@ async def embed_book_chunks(db: AsyncSession, book_id: int, batch_size: int = 64
 
         for chunk, emb in zip(batch, embeddings):
             chunk.embedding = emb
+        await db.run_sync(lambda session: fold_chunk_embeddings(session, book_id, batch))
 
         total += len(batch)
 
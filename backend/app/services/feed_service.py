@@ -1,5 +1,4 @@
 """AI-generated social feed."""
-import json
 import logging
 from sqlalchemy import select, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,6 +6,7 @@ from app.models.feed import FeedItem
 from app.models.insight import BookInsight
 from app.models.book import Book
 from app.llm.client import llm_client
+from app.llm.structured import complete_json
 from app.llm.prompts import GENERATE_FEED_TIL, GENERATE_DAILY_QUOTE
 
 logger = logging.getLogger(__name__)
@@ -51,8 +51,11 @@ async def generate_til_items(db: AsyncSession, limit: int = 3) -> list[FeedItem]
             continue
 
         try:
-            response = await llm_client.complete(
-                messages=[{
+            data = await complete_json(
+                lambda messages: llm_client.complete(
+                    messages=messages, task_type="feed", max_tokens=500, json_mode=True,
+                ),
+                [{
                     "role": "user",
                     "content": GENERATE_FEED_TIL.format(
                         insight_title=insight.title,
@@ -61,10 +64,8 @@ async def generate_til_items(db: AsyncSession, limit: int = 3) -> list[FeedItem]
                         author=book.author or "Unknown",
                     ),
                 }],
-                task_type="feed",
-                max_tokens=500,
+                model=llm_client.registry.get_model("feed"),
             )
-            data = json.loads(response)
             item = FeedItem(
                 item_type="til",
                 title=data.get("title", f"TIL: {insight.title}"),
@@ -0,0 +1,92 @@
+"""Library-wide discovery of cross-book insight connections.
+
+Each insight not yet scanned is compared against every embedded insight in
+one blockwise matrix product (app.utils.vectors.top_k_cosine). Its k
+nearest neighbours from other books that clear the similarity threshold
+become InsightConnection rows. Pairs are stored once (a < b) and inserted
+with ON CONFLICT DO NOTHING. Scanned insights are stamped, so each run
+only pays for insights added since the last one. Connections between an
+old and a new insight are found from the new side. New connections are
+folded into the book-level aggregate (book_edges) in the same transaction.
+"""
+import datetime
+import logging
+import numpy as np
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.insight import BookInsight, InsightConnection
+from app.services.book_edges import add_connections, sync_book_edges
+from app.utils.vectors import normalize_rows, top_k_cosine
+
+logger = logging.getLogger(__name__)
+
+INSERT_BATCH = 5000
+# pg_advisory_xact_lock key serializing discovery runs
+DISCOVERY_LOCK_KEY = 0x696E7363  # "insc"
+
+
+def discover_insight_connections(db: Session, limit: int | None = None) -> dict:
+    """Scan up to `limit` unscanned insights and fold the new connections
+    into book_edges. Does not commit.
+
+    A run that outlasts the beat interval overlaps the next one; the
+    transaction-scoped advisory lock makes them take turns instead of
+    scanning the same insights and racing to create the same book edges."""
+    db.execute(select(func.pg_advisory_xact_lock(DISCOVERY_LOCK_KEY)))
+    rebuilt = sync_book_edges(db)
+    pending = db.execute(
+        select(BookInsight.id)
+        .where(BookInsight.embedding.isnot(None))
+        .where(BookInsight.connections_scanned_at.is_(None))
+        .order_by(BookInsight.id)
+        .limit(limit or settings.insight_connection_batch_size)
+    ).scalars().all()
+    if not pending:
+        return {"scanned": 0, "connections": 0, "edges_rebuilt": rebuilt}
+
+    rows = db.execute(
+        select(BookInsight.id, BookInsight.book_id, BookInsight.embedding)
+        .where(BookInsight.embedding.isnot(None))
+        .order_by(BookInsight.id)
+    ).all()
+    ids = np.asarray([r.id for r in rows])
+    books = np.asarray([r.book_id for r in rows])
+    X = normalize_rows(np.asarray([r.embedding for r in rows], dtype=np.float32))
+    new = np.searchsorted(ids, pending)
+
+    i, j, similarity = top_k_cosine(
+        X[new], X,
+        k=settings.insight_connection_k,
+        threshold=settings.insight_connection_threshold,
+        groups_a=books[new], groups_b=books,
+        normalized=True,
+    )
+    pairs: dict[tuple[int, int], float] = {}
+    for a, b, s in zip(ids[new][i].tolist(), ids[j].tolist(), similarity.tolist()):
+        pairs[(min(a, b), max(a, b))] = s
+
+    values = [
+        {"insight_a_id": a, "insight_b_id": b, "connection_type": "similar", "strength": s}
+        for (a, b), s in pairs.items()
+    ]
+    inserted = []
+    for start in range(0, len(values), INSERT_BATCH):
+        inserted += db.execute(
+            insert(InsightConnection)
+            .values(values[start:start + INSERT_BATCH])
+            .on_conflict_do_nothing(index_elements=["insight_a_id", "insight_b_id"])
+            .returning(InsightConnection.id)
+        ).scalars().all()
+    edges = add_connections(db, inserted)
+    db.execute(
+        update(BookInsight)
+        .where(BookInsight.id.in_(pending))
+        .values(connections_scanned_at=datetime.datetime.utcnow())
+    )
+    logger.info(
+        f"Scanned {len(pending)} insights against {len(ids)}: "
+        f"{len(inserted)} new connections across {edges} book pairs"
+    )
+    return {"scanned": len(pending), "connections": len(inserted), "edges_updated": edges, "edges_rebuilt": rebuilt}
@@ -0,0 +1,320 @@
+"""Insight extraction engine shared by the API service and Celery tasks.
+
+The concept, framework and takeaway prompts read the same context and are
+independent, so they are fanned out concurrently (bounded per provider and
+model by app.llm.concurrency) and parsed as each one completes. A reply
+that can't be parsed or repaired is retried for that category alone (see
+app.llm.structured). Callers persist the collected results in a single
+transaction.
+"""
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, Callable
+from app.models.insight import BookInsight
+from app.llm.concurrency import llm_slot, llm_slot_sync
+from app.llm.structured import complete_json, complete_json_sync
+from app.llm.prompts import (
+    SYSTEM_INSIGHT, EXTRACT_KEY_CONCEPTS, EXTRACT_FRAMEWORKS, EXTRACT_TAKEAWAYS,
+    SUMMARIZE_SECTION,
+)
+from app.llm.tokens import count_tokens
+from app.processing.chunk_selector import select_representative_chunks
+from app.processing.embedder import generate_embeddings
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTENT_CHARS = 50000
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# (insight_type, response key, prompt template)
+EXTRACTIONS = (
+    ("key_concept", "concepts", EXTRACT_KEY_CONCEPTS),
+    ("framework", "frameworks", EXTRACT_FRAMEWORKS),
+    ("takeaway", "takeaways", EXTRACT_TAKEAWAYS),
+)
+
+# complete(prompt_template, messages, retry, json_mode) -> response text;
+# `retry` marks the one follow-up request after an unparseable reply, which
+# asks for a continuation fragment (json_mode False) or a full resend
+AsyncComplete = Callable[[str, list[dict], bool, bool], Awaitable[str]]
+SyncComplete = Callable[[str, list[dict], bool, bool], str]
+
+
+def extraction_messages(prompt: str, title: str, author: str | None, content: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_INSIGHT},
+        {"role": "user", "content": prompt.format(
+            title=title, author=author or "Unknown", content=content[:MAX_CONTENT_CHARS]
+        )},
+    ]
+
+
+def refinement_preamble(pass_level: int, existing: list) -> str:
+    """Prefix for refinement passes listing what earlier passes found, to
+    steer the model to new or deeper insights. `existing` rows need .title."""
+    if pass_level <= 1 or not existing:
+        return ""
+    titles = "; ".join(row.title for row in existing)
+    return f"Already extracted (find new or deeper ones): {titles}{CONTEXT_SEPARATOR}"
+
+
+def select_context_chunks(chunks: list, token_budget: int, model: str, reserved_chars: int = 0) -> list:
+    """Representative chunks for the extraction prompts.
+
+    Tokens are counted with `model`'s tokenizer, and the joined selection
+    also fits in MAX_CONTENT_CHARS (less `reserved_chars` for any preamble).
+    The chunks come back in reading order, so the prompt-length cap would
+    otherwise always drop the later chapters.
+    """
+    return select_representative_chunks(
+        chunks, token_budget,
+        count_tokens=lambda text: count_tokens(text, model),
+        char_budget=max(0, MAX_CONTENT_CHARS - reserved_chars),
+        separator=CONTEXT_SEPARATOR,
+    )
+
+
+def parse_extraction(insight_type: str, key: str, data: object) -> list[dict]:
+    items = data.get(key, []) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return []
+    return [
+        {
+            "insight_type": insight_type,
+            "title": item["title"],
+            "content": item["content"],
+            "supporting_quote": item.get("supporting_quote"),
+            "importance": item.get("importance", 5),
+        }
+        # A repaired truncation can end in a partial item; drop it
+        for item in items
+        if isinstance(item, dict) and item.get("title") and item.get("content")
+    ]
+
+
+def insight_text_key(insight_type: str, title: str, content: str) -> str:
+    normalized = " ".join(f"{insight_type}|{title}|{content}".lower().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def build_insights(
+    book_id: int,
+    pass_level: int,
+    items: list[dict],
+    existing_keys: set[str] | None = None,
+) -> list[BookInsight]:
+    """Create BookInsight rows for new items, embedded in one batched call.
+
+    Items whose text matches an insight from an earlier pass (or an earlier
+    item in this batch) are skipped, so they're neither duplicated nor
+    re-embedded.
+    """
+    seen = set(existing_keys or ())
+    fresh = []
+    for item in items:
+        key = insight_text_key(item["insight_type"], item["title"], item["content"])
+        if key in seen:
+            continue
+        seen.add(key)
+        fresh.append(item)
+
+    if not fresh:
+        return []
+
+    embeddings = generate_embeddings([f"{item['title']}: {item['content']}" for item in fresh])
+    return [
+        BookInsight(
+            book_id=book_id,
+            insight_type=item["insight_type"],
+            title=item["title"],
+            content=item["content"],
+            supporting_quote=item.get("supporting_quote"),
+            importance=item.get("importance", 5),
+            refinement_level=pass_level,
+            embedding=embedding,
+        )
+        for item, embedding in zip(fresh, embeddings)
+    ]
+
+
+async def extract_insights(
+    title: str,
+    author: str | None,
+    content: str,
+    model: str,
+    complete: AsyncComplete,
+) -> list[dict]:
+    """Run all extraction prompts concurrently; failed categories are skipped."""
+
+    async def run(insight_type: str, key: str, prompt: str) -> list[dict]:
+        async def call(messages: list[dict]) -> str:
+            return await complete(prompt, messages, False, True)
+
+        async def retry(messages: list[dict], continuation: bool) -> str:
+            return await complete(prompt, messages, True, not continuation)
+
+        try:
+            async with llm_slot(model):
+                data = await complete_json(
+                    call, extraction_messages(prompt, title, author, content), model, retry_complete=retry,
+                )
+            return parse_extraction(insight_type, key, data)
+        except Exception as e:
+            logger.error(f"{insight_type} extraction failed for '{title}': {e}")
+            return []
+
+    items = []
+    for done in asyncio.as_completed([run(*extraction) for extraction in EXTRACTIONS]):
+        items.extend(await done)
+    return items
+
+
+def extract_insights_sync(
+    title: str,
+    author: str | None,
+    content: str,
+    model: str,
+    complete: SyncComplete,
+) -> list[dict]:
+    """Thread-pool variant of `extract_insights` for Celery workers."""
+
+    def run(insight_type: str, key: str, prompt: str) -> list[dict]:
+        with llm_slot_sync(model):
+            data = complete_json_sync(
+                lambda messages: complete(prompt, messages, False, True),
+                extraction_messages(prompt, title, author, content),
+                model,
+                retry_complete=lambda messages, continuation: complete(prompt, messages, True, not continuation),
+            )
+        return parse_extraction(insight_type, key, data)
+
+    items = []
+    with ThreadPoolExecutor(max_workers=len(EXTRACTIONS)) as pool:
+        futures = {
+            pool.submit(run, insight_type, key, prompt): insight_type
+            for insight_type, key, prompt in EXTRACTIONS
+        }
+        for future in as_completed(futures):
+            try:
+                items.extend(future.result())
+            except Exception as e:
+                logger.error(f"{futures[future]} extraction failed for '{title}': {e}")
+    return items
+
+
+# Map-reduce over the whole book: summarize chunk windows with a cheap model,
+# then run the extraction prompts over the joined summaries.
+
+def plan_map_shards(chunks: list, window_tokens: int) -> list[dict]:
+    """Group ordered chunks into windows that stay within one chapter.
+
+    `chunks` need .chunk_index, .content, .chapter and .token_count. Each
+    shard's `chunk_hash` covers its chunk contents, so the map output can be
+    reused for as long as those chunks are unchanged.
+    """
+    shards = []
+    current, current_tokens = [], 0
+
+    def close():
+        if not current:
+            return
+        digest = hashlib.sha256()
+        for c in current:
+            digest.update(c.content.encode())
+            digest.update(b"\x00")
+        shards.append({
+            "shard_index": len(shards),
+            "chapter": current[0].chapter,
+            "first_chunk_index": current[0].chunk_index,
+            "last_chunk_index": current[-1].chunk_index,
+            "content": "\n\n".join(c.content for c in current),
+            "chunk_hash": digest.hexdigest(),
+        })
+
+    for chunk in chunks:
+        tokens = chunk.token_count or len(chunk.content.split())
+        chapter_changed = current and chunk.chapter != current[-1].chapter
+        if current and (chapter_changed or current_tokens + tokens > window_tokens):
+            close()
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += tokens
+    close()
+    return shards
+
+
+def _section_label(shard: dict) -> str:
+    label = f"Section {shard['shard_index'] + 1}"
+    return f"{label}: {shard['chapter']}" if shard.get("chapter") else label
+
+
+def map_shards_sync(
+    shards: list[dict],
+    title: str,
+    author: str | None,
+    model: str,
+    summarize: Callable[[list[dict]], str],
+    on_summary: Callable[[dict, str], None],
+    max_workers: int = 4,
+) -> None:
+    """Summarize shards in parallel; `on_summary` runs in the calling thread
+    as each one finishes so results can be persisted immediately."""
+
+    def run(shard: dict) -> str:
+        messages = [{"role": "user", "content": SUMMARIZE_SECTION.format(
+            title=title, author=author or "Unknown",
+            section=_section_label(shard), content=shard["content"],
+        )}]
+        with llm_slot_sync(model):
+            return summarize(messages)
+
+    if not shards:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+        futures = {pool.submit(run, shard): shard for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                on_summary(shard, future.result())
+            except Exception as e:
+                logger.error(f"Map shard {shard['shard_index']} failed for '{title}': {e}")
+
+
+def reduce_context(
+    summaries: list[tuple[dict, str]],
+    title: str,
+    author: str | None,
+    summarize: Callable[[list[dict]], str],
+    max_chars: int = MAX_CONTENT_CHARS,
+) -> str:
+    """Join shard summaries in book order, collapsing groups of summaries
+    until the result fits the extraction prompt."""
+    parts = [
+        f"[{_section_label(shard)}]\n{summary}"
+        for shard, summary in sorted(summaries, key=lambda s: s[0]["shard_index"])
+    ]
+    separator = "\n\n---\n\n"
+
+    while len(separator.join(parts)) > max_chars and len(parts) > 1:
+        groups, group, size = [], [], 0
+        for part in parts:
+            if group and size + len(part) > max_chars // 4:
+                groups.append(group)
+                group, size = [], 0
+            group.append(part)
+            size += len(part)
+        groups.append(group)
+        if len(groups) == len(parts):
+            break  # every summary is already oversized on its own
+
+        parts = [
+            summarize([{"role": "user", "content": SUMMARIZE_SECTION.format(
+                title=title, author=author or "Unknown",
+                section="Combined sections", content=separator.join(group),
+            )}])
+            for group in groups
+        ]
+
+    return separator.join(parts)
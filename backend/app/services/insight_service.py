@@ -1,5 +1,5 @@
 """AI insight generation and retrieval."""
-import json
+import asyncio
 import logging
 from sqlalchemy import select, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,11 +7,12 @@ from app.models.insight import BookInsight, InsightConnection
 from app.models.book import Book
 from app.models.chunk import BookChunk
 from app.llm.client import llm_client
-from app.llm.prompts import (
-    SYSTEM_INSIGHT, EXTRACT_KEY_CONCEPTS, EXTRACT_FRAMEWORKS,
-    EXTRACT_TAKEAWAYS, GENERATE_SUMMARY,
+from app.llm.semantic_cache import cached_complete
+from app.config import settings
+from app.services.insight_engine import (
+    CONTEXT_SEPARATOR, EXTRACTIONS, extract_insights, build_insights, insight_text_key,
+    refinement_preamble, select_context_chunks,
 )
-from app.processing.embedder import generate_single_embedding
 
 logger = logging.getLogger(__name__)
 
@@ -38,107 +39,74 @@ async def generate_insights_for_book(
     if not book:
         return []
 
+    existing = (await db.execute(
+        select(BookInsight.insight_type, BookInsight.title, BookInsight.content)
+        .where(BookInsight.book_id == book_id)
+    )).all()
+    preamble = refinement_preamble(pass_level, existing)
+
     # Get representative chunks
-    chunk_limit = 20 if pass_level == 1 else 50
-    result = await db.execute(
-        select(BookChunk)
-        .where(BookChunk.book_id == book_id)
-        .order_by(BookChunk.chunk_index)
-        .limit(chunk_limit)
-    )
-    chunks = list(result.scalars().all())
+    if settings.insight_context_mode == "first_n":
+        chunk_limit = 20 if pass_level == 1 else 50
+        result = await db.execute(
+            select(BookChunk)
+            .where(BookChunk.book_id == book_id)
+            .order_by(BookChunk.chunk_index)
+            .limit(chunk_limit)
+        )
+        chunks = list(result.scalars().all())
+    else:
+        # Map-reduce is a Celery-side job; inline generation uses one cluster-covering pass
+        result = await db.execute(
+            select(BookChunk)
+            .where(BookChunk.book_id == book_id)
+            .where(BookChunk.embedding.isnot(None))
+        )
+        # Clustering and token counting are CPU-bound; keep them off the event loop
+        chunks = await asyncio.to_thread(
+            select_context_chunks,
+            list(result.scalars().all()),
+            settings.insight_context_tokens,
+            llm_client.registry.get_model("insight"),
+            len(preamble),
+        )
     if not chunks:
         return []
 
-    content = "\n\n---\n\n".join(c.content for c in chunks)
-    insights = []
-
-    # Extract concepts
-    try:
-        response = await llm_client.complete(
-            messages=[
-                {"role": "system", "content": SYSTEM_INSIGHT},
-                {"role": "user", "content": EXTRACT_KEY_CONCEPTS.format(
-                    title=book.title, author=book.author or "Unknown", content=content[:50000]
-                )},
-            ],
-            task_type="insight",
-        )
-        data = json.loads(response)
-        for concept in data.get("concepts", []):
-            embedding = generate_single_embedding(f"{concept['title']}: {concept['content']}")
-            insight = BookInsight(
-                book_id=book_id,
-                insight_type="key_concept",
-                title=concept["title"],
-                content=concept["content"],
-                supporting_quote=concept.get("supporting_quote"),
-                importance=concept.get("importance", 5),
-                refinement_level=pass_level,
-                embedding=embedding,
-            )
-            db.add(insight)
-            insights.append(insight)
-    except Exception as e:
-        logger.error(f"Concept extraction failed for book {book_id}: {e}")
-
-    # Extract frameworks
-    try:
-        response = await llm_client.complete(
-            messages=[
-                {"role": "system", "content": SYSTEM_INSIGHT},
-                {"role": "user", "content": EXTRACT_FRAMEWORKS.format(
-                    title=book.title, author=book.author or "Unknown", content=content[:50000]
-                )},
-            ],
-            task_type="insight",
-        )
-        data = json.loads(response)
-        for fw in data.get("frameworks", []):
-            embedding = generate_single_embedding(f"{fw['title']}: {fw['content']}")
-            insight = BookInsight(
-                book_id=book_id,
-                insight_type="framework",
-                title=fw["title"],
-                content=fw["content"],
-                supporting_quote=fw.get("supporting_quote"),
-                importance=fw.get("importance", 5),
-                refinement_level=pass_level,
-                embedding=embedding,
+    content = preamble + CONTEXT_SEPARATOR.join(c.content for c in chunks)
+    chunk_ids = [c.id for c in chunks]
+    category = {prompt: insight_type for insight_type, _, prompt in EXTRACTIONS}
+
+    async def complete(prompt: str, messages: list[dict], retry: bool, json_mode: bool) -> str:
+        if retry:
+            # The caches would hand back the reply being retried
+            return await llm_client.complete(
+                messages=messages, task_type="insight", cache=False, json_mode=json_mode,
             )
-            db.add(insight)
-            insights.append(insight)
-    except Exception as e:
-        logger.error(f"Framework extraction failed for book {book_id}: {e}")
-
-    # Extract takeaways
-    try:
-        response = await llm_client.complete(
-            messages=[
-                {"role": "system", "content": SYSTEM_INSIGHT},
-                {"role": "user", "content": EXTRACT_TAKEAWAYS.format(
-                    title=book.title, author=book.author or "Unknown", content=content[:50000]
-                )},
-            ],
+        response, _ = await cached_complete(
+            messages=messages,
             task_type="insight",
+            # The extraction prompts differ by a few words, and refinement passes
+            # must not be served an earlier pass's answer; keep them apart
+            scope=f"book={book_id}:pass={pass_level}:{category[prompt]}",
+            query_text=prompt.format(title=book.title, author=book.author or "Unknown", content=""),
+            chunk_ids=chunk_ids,
+            cache=True,
+            json_mode=True,
         )
-        data = json.loads(response)
-        for tw in data.get("takeaways", []):
-            embedding = generate_single_embedding(f"{tw['title']}: {tw['content']}")
-            insight = BookInsight(
-                book_id=book_id,
-                insight_type="takeaway",
-                title=tw["title"],
-                content=tw["content"],
-                importance=tw.get("importance", 5),
-                refinement_level=pass_level,
-                embedding=embedding,
-            )
-            db.add(insight)
-            insights.append(insight)
-    except Exception as e:
-        logger.error(f"Takeaway extraction failed for book {book_id}: {e}")
+        return response
+
+    items = await extract_insights(
+        book.title, book.author, content,
+        model=llm_client.registry.get_model("insight"),
+        complete=complete,
+    )
+
+    existing_keys = {insight_text_key(*row) for row in existing}
 
+    # Embedding the new insights is CPU-bound; keep it off the event loop
+    insights = await asyncio.to_thread(build_insights, book_id, pass_level, items, existing_keys)
+    db.add_all(insights)
     await db.flush()
     return insights
 
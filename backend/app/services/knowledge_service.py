@@ -1,10 +1,14 @@
 """Second brain - learning paths and knowledge connections."""
+import json
 import logging
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.config import settings
 from app.models.knowledge import LearningPath, LearningPathBook
-from app.models.insight import InsightConnection, BookInsight
+from app.models.insight import InsightConnection, BookInsight, BookEdge
 from app.models.book import Book
+from app.services.book_edges import EDGES_VERSION_KEY
 
 logger = logging.getLogger(__name__)
 
@@ -22,75 +26,140 @@ async def get_learning_path(db: AsyncSession, path_id: int) -> dict | None:
         return None
 
     result = await db.execute(
-        select(LearningPathBook)
+        select(LearningPathBook, Book)
+        .join(Book, Book.id == LearningPathBook.book_id)
         .where(LearningPathBook.path_id == path_id)
         .order_by(LearningPathBook.position)
     )
-    path_books = result.scalars().all()
-
-    books = []
-    for pb in path_books:
-        book = await db.get(Book, pb.book_id)
-        if book:
-            books.append({"book": book, "position": pb.position, "rationale": pb.rationale})
+    books = [
+        {"book": book, "position": pb.position, "rationale": pb.rationale}
+        for pb, book in result.all()
+    ]
 
     return {"path": path, "books": books}
 
 
-async def get_knowledge_connections(db: AsyncSession, limit: int = 50) -> list[dict]:
-    result = await db.execute(
-        select(InsightConnection)
-        .order_by(InsightConnection.strength.desc())
-        .limit(limit)
-    )
-    connections = result.scalars().all()
-
-    results = []
-    for conn in connections:
-        insight_a = await db.get(BookInsight, conn.insight_a_id)
-        insight_b = await db.get(BookInsight, conn.insight_b_id)
-        if insight_a and insight_b:
-            book_a = await db.get(Book, insight_a.book_id)
-            book_b = await db.get(Book, insight_b.book_id)
-            results.append({
-                "connection": conn,
-                "insight_a": {"insight": insight_a, "book": book_a},
-                "insight_b": {"insight": insight_b, "book": book_b},
-            })
+# Knowledge responses are cached in Redis under a key that includes the
+# version of the connection data, a Redis counter bumped after commits that
+# change insight connections or book_edges: by the connection discovery job,
+# and when a book (cascading to its insights, connections and edges) is
+# deleted. A cache hit costs Redis reads only, never a scan of
+# insight_connections. Superseded entries aren't served again; they just
+# expire. Connections removed any other way (e.g. insights deleted directly
+# in the database) stay visible until the next discovery run's edge sync.
 
-    return results
+CACHE_PREFIX = "knowledge:"
+_redis = None
 
 
-async def get_knowledge_map(db: AsyncSession) -> dict:
-    """Build a knowledge map of all book connections."""
-    result = await db.execute(
-        select(Book).where(Book.processing_status == "completed")
-    )
-    books = result.scalars().all()
+def _cache_client():
+    global _redis
+    if _redis is None:
+        import redis.asyncio as aioredis
+        _redis = aioredis.Redis.from_url(settings.redis_url)
+    return _redis
 
-    result = await db.execute(
-        select(InsightConnection).where(InsightConnection.strength > 0.5)
-    )
-    connections = result.scalars().all()
-
-    book_ids_in_connections = set()
-    edges = []
-    for conn in connections:
-        insight_a = await db.get(BookInsight, conn.insight_a_id)
-        insight_b = await db.get(BookInsight, conn.insight_b_id)
-        if insight_a and insight_b and insight_a.book_id != insight_b.book_id:
-            book_ids_in_connections.add(insight_a.book_id)
-            book_ids_in_connections.add(insight_b.book_id)
+
+async def _edges_version() -> str:
+    return f"edges-{int(await _cache_client().get(EDGES_VERSION_KEY) or 0)}"
+
+
+async def bump_knowledge_version():
+    """Async counterpart of book_edges.bump_edges_version, for API callers."""
+    try:
+        await _cache_client().incr(EDGES_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Knowledge cache invalidation failed: {e}")
+
+
+async def _cached(name: str, build):
+    if settings.knowledge_cache_ttl <= 0:
+        return await build()
+    try:
+        key = f"{CACHE_PREFIX}{await _edges_version()}:{name}"
+        value = await _cache_client().get(key)
+        if value is not None:
+            return json.loads(value)
+    except Exception as e:
+        logger.warning(f"Knowledge cache read failed: {e}")
+        return await build()
+
+    result = await build()
+    try:
+        await _cache_client().set(key, json.dumps(result), ex=settings.knowledge_cache_ttl)
+    except Exception as e:
+        logger.warning(f"Knowledge cache write failed: {e}")
+    return result
+
+
+async def clear_knowledge_cache():
+    client = _cache_client()
+    async for key in client.scan_iter(match=f"{CACHE_PREFIX}*"):
+        await client.delete(key)
+
+
+async def get_knowledge_connections(db: AsyncSession, limit: int = 50) -> list[dict]:
+    async def build():
+        insight_a, insight_b = aliased(BookInsight), aliased(BookInsight)
+        book_a, book_b = aliased(Book), aliased(Book)
+        result = await db.execute(
+            select(
+                InsightConnection.connection_type,
+                InsightConnection.strength,
+                insight_a.title, book_a.title,
+                insight_b.title, book_b.title,
+            )
+            .join(insight_a, insight_a.id == InsightConnection.insight_a_id)
+            .join(insight_b, insight_b.id == InsightConnection.insight_b_id)
+            .outerjoin(book_a, book_a.id == insight_a.book_id)
+            .outerjoin(book_b, book_b.id == insight_b.book_id)
+            .order_by(InsightConnection.strength.desc())
+            .limit(limit)
+        )
+        return [
+            {
+                "connection_type": connection_type,
+                "strength": strength,
+                "insight_a": {"title": title_a, "book_title": book_title_a},
+                "insight_b": {"title": title_b, "book_title": book_title_b},
+            }
+            for connection_type, strength, title_a, book_title_a, title_b, book_title_b in result.all()
+        ]
+
+    return await _cached(f"connections:{limit}", build)
+
+
+async def get_knowledge_map(db: AsyncSession, min_strength: float = 0.5, limit: int = 500) -> dict:
+    """Book-level knowledge map: the strongest book_edges with their books."""
+    async def build():
+        book_a, book_b = aliased(Book), aliased(Book)
+        result = await db.execute(
+            select(
+                BookEdge,
+                book_a.title, book_a.author,
+                book_b.title, book_b.author,
+            )
+            .join(book_a, book_a.id == BookEdge.book_a_id)
+            .join(book_b, book_b.id == BookEdge.book_b_id)
+            .where(BookEdge.max_strength >= min_strength)
+            .order_by(BookEdge.max_strength.desc(), BookEdge.id)
+            .limit(limit)
+        )
+        nodes: dict[int, dict] = {}
+        edges = []
+        for edge, title_a, author_a, title_b, author_b in result.all():
+            nodes.setdefault(edge.book_a_id, {"id": edge.book_a_id, "title": title_a, "author": author_a})
+            nodes.setdefault(edge.book_b_id, {"id": edge.book_b_id, "title": title_b, "author": author_b})
+            top = edge.top_connections or []
             edges.append({
-                "source": insight_a.book_id,
-                "target": insight_b.book_id,
-                "strength": conn.strength,
-                "description": conn.description,
+                "source": edge.book_a_id,
+                "target": edge.book_b_id,
+                "strength": edge.max_strength,
+                "mean_strength": edge.strength_sum / edge.connection_count if edge.connection_count else 0.0,
+                "connection_count": edge.connection_count,
+                "description": next((c["description"] for c in top if c.get("description")), None),
+                "top_connections": top,
             })
+        return {"nodes": list(nodes.values()), "edges": edges}
 
-    nodes = [
-        {"id": b.id, "title": b.title, "author": b.author}
-        for b in books if b.id in book_ids_in_connections
-    ]
-
-    return {"nodes": nodes, "edges": edges}
+    return await _cached(f"map:{min_strength}:{limit}", build)
@@ -86,11 +86,19 @@ class OrchestratorBrain:
             .group_by(BookInsight.book_id)
             .subquery()
         )
+        # Books already waiting on an insight batch aren't picked again
+        awaiting_batch = (
+            select(ProcessingJob.id)
+            .where(ProcessingJob.book_id == Book.id)
+            .where(ProcessingJob.status.in_(["queued", "batched"]))
+            .exists()
+        )
         result = self.db.execute(
             select(Book)
             .join(subquery, Book.id == subquery.c.book_id)
             .where(subquery.c.max_level < 3)
             .where(Book.processing_status == "completed")
+            .where(~awaiting_batch)
             .limit(1)
         )
         book = result.scalar_one_or_none()
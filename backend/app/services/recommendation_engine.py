@@ -0,0 +1,131 @@
+"""Computes the materialized recommendations table.
+
+Sources are the most recently read books. Their centroids probe the
+book-level HNSW index in one LATERAL query, and each candidate scores by
+its similarity to the closest source. Books already being read or finished
+are excluded. With no reading history the list is simply the newest
+completed books.
+
+A refresh is skipped when the inputs fingerprint (recent reading history
+plus the state of book_embeddings) matches the one stored with the current
+rows, so triggers can fire freely.
+"""
+import datetime
+import hashlib
+import logging
+from sqlalchemy import select, delete, func, text, true
+from sqlalchemy.orm import Session, aliased
+from app.config import settings
+from app.models.book import Book
+from app.models.chunk import BookEmbedding
+from app.models.reading import ReadingProgress
+from app.models.recommendation import Recommendation
+
+logger = logging.getLogger(__name__)
+
+MAX_CANDIDATES_PER_SOURCE = 1000
+# pg_advisory_xact_lock key serializing refreshes
+REFRESH_LOCK_KEY = 0x7265636F  # "reco"
+
+
+def recommendation_inputs(db: Session) -> tuple[list[int], set[int], str]:
+    """(source book ids, excluded book ids, inputs fingerprint)."""
+    rows = db.execute(
+        select(ReadingProgress.book_id, ReadingProgress.status)
+        .where(ReadingProgress.status.in_(["reading", "completed"]))
+        .order_by(ReadingProgress.last_read_at.desc().nulls_last(), ReadingProgress.book_id)
+    ).all()
+    sources = [r.book_id for r in rows[:settings.recommendation_history_books]]
+    excluded = {r.book_id for r in rows}
+    library = db.execute(
+        select(func.count(BookEmbedding.id), func.max(BookEmbedding.updated_at))
+        .where(BookEmbedding.chapter.is_(None))
+    ).one()
+    fingerprint = repr((sources, sorted(excluded), library[0], library[1], settings.recommendation_count))
+    return sources, excluded, hashlib.sha1(fingerprint.encode()).hexdigest()
+
+
+def _similar_to_sources(db: Session, sources: list[int], excluded: set[int]) -> list[tuple[int, float, int]]:
+    """(book_id, score, source_book_id), best first."""
+    per_source = min(MAX_CANDIDATES_PER_SOURCE, settings.recommendation_count + len(excluded))
+    db.execute(text(f"SET LOCAL hnsw.ef_search = {int(max(settings.similar_books_ef_search, per_source))}"))
+
+    source = (
+        select(BookEmbedding.book_id.label("source_id"), BookEmbedding.embedding)
+        .where(BookEmbedding.book_id.in_(sources))
+        .where(BookEmbedding.chapter.is_(None))
+        .subquery("source")
+    )
+    other = aliased(BookEmbedding)
+    distance = other.embedding.cosine_distance(source.c.embedding)
+    nearest = (
+        select(other.book_id, distance.label("distance"))
+        .where(other.chapter.is_(None))
+        .order_by(distance)
+        .limit(per_source)
+        .lateral("nearest")
+    )
+    rows = db.execute(
+        select(source.c.source_id, nearest.c.book_id, nearest.c.distance)
+        .select_from(source)
+        .join(nearest, true())
+    ).all()
+
+    best: dict[int, tuple[float, int]] = {}
+    for source_id, book_id, dist in rows:
+        if book_id in excluded:
+            continue
+        score = 1 - dist
+        if book_id not in best or score > best[book_id][0]:
+            best[book_id] = (score, source_id)
+    ranked = sorted(best.items(), key=lambda item: -item[1][0])
+    return [(book_id, score, source_id) for book_id, (score, source_id) in ranked]
+
+
+def refresh_recommendations(db: Session, force: bool = False) -> dict:
+    """Recompute the recommendations table if its inputs changed. Does not commit.
+
+    Refreshes are triggered from several places and may overlap; the
+    transaction-scoped advisory lock makes them take turns, so a later one
+    sees the rows the earlier one wrote instead of inserting alongside them."""
+    db.execute(select(func.pg_advisory_xact_lock(REFRESH_LOCK_KEY)))
+    sources, excluded, inputs_hash = recommendation_inputs(db)
+    current = db.execute(select(Recommendation.inputs_hash).limit(1)).scalar_one_or_none()
+    if not force and current == inputs_hash:
+        return {"status": "fresh"}
+
+    if sources:
+        picks = _similar_to_sources(db, sources, excluded)[:settings.recommendation_count]
+    else:
+        recent = db.execute(
+            select(Book.id)
+            .where(Book.processing_status == "completed")
+            .order_by(Book.created_at.desc())
+            .limit(settings.recommendation_count)
+        ).scalars().all()
+        picks = [(book_id, None, None) for book_id in recent]
+
+    now = datetime.datetime.utcnow()
+    db.execute(delete(Recommendation))
+    db.add_all([
+        Recommendation(
+            book_id=book_id, rank=rank, score=score, source_book_id=source_id,
+            inputs_hash=inputs_hash, computed_at=now,
+        )
+        for rank, (book_id, score, source_id) in enumerate(picks)
+    ])
+    db.flush()
+    logger.info(f"Refreshed recommendations: {len(picks)} books from {len(sources)} sources")
+    return {"status": "refreshed", "count": len(picks), "sources": len(sources)}
+
+
+def recommendation_status(db: Session) -> dict:
+    """Staleness metadata for the materialized list."""
+    _, _, inputs_hash = recommendation_inputs(db)
+    row = db.execute(
+        select(Recommendation.inputs_hash, Recommendation.computed_at, func.count().over().label("count"))
+        .limit(1)
+    ).one_or_none()
+    if row is None:
+        return {"computed_at": None, "count": 0, "stale": True}
+    return {"computed_at": row.computed_at, "count": row.count, "stale": row.inputs_hash != inputs_hash}
@@ -1,95 +1,131 @@
 """Content-based book recommendations."""
 import logging
-import numpy as np
-from sqlalchemy import select
+from sqlalchemy import select, func, text, true
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.config import settings
 from app.models.book import Book
-from app.models.chunk import BookChunk
-from app.models.reading import ReadingProgress
-from app.models.topic import BookTopic
+from app.models.chunk import BookEmbedding
+from app.models.recommendation import Recommendation
+from app.services.recommendation_engine import recommendation_status
 
 logger = logging.getLogger(__name__)
 
 
-async def get_similar_books(db: AsyncSession, book_id: int, limit: int = 6) -> list[dict]:
-    """Find similar books based on content embeddings."""
-    # Get avg embedding for the source book
-    result = await db.execute(
-        select(BookChunk.embedding)
-        .where(BookChunk.book_id == book_id)
-        .where(BookChunk.embedding.isnot(None))
-        .limit(20)
-    )
-    embeddings = [r[0] for r in result.all() if r[0] is not None]
+async def _set_ef_search(db: AsyncSession, candidates: int):
+    """Widen the HNSW candidate list for this transaction; pgvector's default
+    (40) caps both recall and the number of rows a filtered scan can return."""
+    ef_search = max(settings.similar_books_ef_search, candidates)
+    await db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
 
-    if not embeddings:
-        return []
 
-    avg_embedding = np.mean(embeddings, axis=0).tolist()
+async def _similar_by_centroid(db: AsyncSession, book_id: int, limit: int) -> list[dict]:
+    source = await db.execute(
+        select(BookEmbedding.embedding)
+        .where(BookEmbedding.book_id == book_id)
+        .where(BookEmbedding.chapter.is_(None))
+    )
+    embedding = source.scalar_one_or_none()
+    if embedding is None:
+        return []
 
-    # Find books with similar chunks
+    await _set_ef_search(db, limit + 1)
+    distance = BookEmbedding.embedding.cosine_distance(embedding)
     result = await db.execute(
-        select(
-            BookChunk.book_id,
-            BookChunk.embedding.cosine_distance(avg_embedding).label("distance"),
-        )
-        .where(BookChunk.book_id != book_id)
-        .where(BookChunk.embedding.isnot(None))
-        .order_by("distance")
-        .limit(limit * 5)
+        select(Book, distance.label("distance"))
+        .join(BookEmbedding, BookEmbedding.book_id == Book.id)
+        .where(BookEmbedding.chapter.is_(None))
+        .where(BookEmbedding.book_id != book_id)
+        .order_by(distance)
+        .limit(limit)
+    )
+    return [{"book": book, "similarity": 1 - dist} for book, dist in result.all()]
+
+
+async def _similar_by_chapters(db: AsyncSession, book_id: int, limit: int) -> list[dict]:
+    """Max-sim over chapter centroids: a book scores by its closest chapter to
+    any of the source book's chapters. One ANN probe per source chapter
+    (LATERAL), aggregated in SQL."""
+    source = (
+        select(BookEmbedding.embedding)
+        .where(BookEmbedding.book_id == book_id)
+        .where(BookEmbedding.chapter.isnot(None))
+        .order_by(BookEmbedding.chunk_count.desc())
+        .limit(settings.similar_books_max_chapters)
+        .subquery("source")
+    )
+    other = aliased(BookEmbedding)
+    distance = other.embedding.cosine_distance(source.c.embedding)
+    # The source book's own chapters are nearest and filtered out, so over-fetch
+    per_chapter = limit * 2 + settings.similar_books_max_chapters
+    nearest = (
+        select(other.book_id, distance.label("distance"))
+        .where(other.chapter.isnot(None))
+        .where(other.book_id != book_id)
+        .order_by(distance)
+        .limit(per_chapter)
+        .lateral("nearest")
     )
-    rows = result.all()
+    best = func.min(nearest.c.distance)
+
+    await _set_ef_search(db, per_chapter)
+    rows = (await db.execute(
+        select(nearest.c.book_id, best.label("distance"))
+        .select_from(source)
+        .join(nearest, true())
+        .group_by(nearest.c.book_id)
+        .order_by(best)
+        .limit(limit)
+    )).all()
+    if not rows:
+        return []
 
-    # Aggregate by book, take best score
-    book_scores = {}
-    for row in rows:
-        if row.book_id not in book_scores:
-            book_scores[row.book_id] = row.distance
+    books = {
+        book.id: book
+        for book in (await db.execute(select(Book).where(Book.id.in_([r.book_id for r in rows])))).scalars().all()
+    }
+    return [
+        {"book": books[r.book_id], "similarity": 1 - r.distance}
+        for r in rows if r.book_id in books
+    ]
 
-    sorted_books = sorted(book_scores.items(), key=lambda x: x[1])[:limit]
 
-    results = []
-    for bid, distance in sorted_books:
-        book = await db.get(Book, bid)
-        if book:
-            results.append({
-                "book": book,
-                "similarity": 1 - distance,
-            })
+async def get_similar_books(db: AsyncSession, book_id: int, limit: int = 6, mode: str | None = None) -> list[dict]:
+    """Find similar books by ANN over book_embeddings.
 
-    return results
+    mode "centroid" compares whole-book centroids; "chapters" scores by the
+    best-matching chapter pair, which surfaces books that share a strong
+    section rather than an overall theme. Books without chapter centroids
+    fall back to "centroid".
+    """
+    if (mode or settings.similar_books_mode) == "chapters":
+        results = await _similar_by_chapters(db, book_id, limit)
+        if results:
+            return results
+    return await _similar_by_centroid(db, book_id, limit)
 
 
 async def get_recommendations(db: AsyncSession, limit: int = 10) -> list[Book]:
-    """Get personalized recommendations based on reading history."""
+    """Serve the materialized list (see recommendation_engine)."""
+    result = await db.execute(
+        select(Book)
+        .join(Recommendation, Recommendation.book_id == Book.id)
+        .order_by(Recommendation.rank)
+        .limit(limit)
+    )
+    books = list(result.scalars().all())
+    if books:
+        return books
+
+    # Not computed yet: newest books until the refresh task has run
     result = await db.execute(
-        select(ReadingProgress.book_id)
-        .where(ReadingProgress.status.in_(["reading", "completed"]))
-        .order_by(ReadingProgress.last_read_at.desc())
-        .limit(5)
+        select(Book)
+        .where(Book.processing_status == "completed")
+        .order_by(Book.created_at.desc())
+        .limit(limit)
     )
-    read_book_ids = [r[0] for r in result.all()]
-
-    if not read_book_ids:
-        # Return popular/recent books if no history
-        result = await db.execute(
-            select(Book)
-            .where(Book.processing_status == "completed")
-            .order_by(Book.created_at.desc())
-            .limit(limit)
-        )
-        return list(result.scalars().all())
-
-    all_similar = []
-    for bid in read_book_ids:
-        similar = await get_similar_books(db, bid, limit=3)
-        all_similar.extend(similar)
-
-    seen = set(read_book_ids)
-    unique = []
-    for item in all_similar:
-        if item["book"].id not in seen:
-            seen.add(item["book"].id)
-            unique.append(item["book"])
-
-    return unique[:limit]
+    return list(result.scalars().all())
+
+
+async def get_recommendation_status(db: AsyncSession) -> dict:
+    return await db.run_sync(recommendation_status)
@@ -1,11 +1,17 @@
 """Hybrid search: full-text + semantic + reciprocal rank fusion."""
+import asyncio
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable
 from sqlalchemy import select, text, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from pgvector.sqlalchemy import Vector
 from app.models.book import Book
 from app.models.chunk import BookChunk
+from app.db.session import async_session_factory
 from app.processing.embedder import generate_single_embedding
+from app.utils.timing import timed, phase_timer
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -15,10 +21,85 @@ async def hybrid_search(
     query: str,
     limit: int = 20,
     book_ids: list[int] | None = None,
+    rerank: bool | None = None,
 ) -> list[dict]:
+    if rerank is None:
+        rerank = settings.rerank_enabled
+    candidate_limit = max(limit, settings.rerank_top_n) if rerank else limit
+
     query_embedding = generate_single_embedding(query)
 
-    # Full-text search results
+    fts_rows = await fts_search(db, query, candidate_limit * 2, book_ids)
+    sem_rows = await semantic_search(db, query_embedding, candidate_limit * 2, book_ids)
+
+    candidates = fuse_rrf(fts_rows, sem_rows, candidate_limit)
+    if rerank:
+        candidates = await rerank_candidates(query, candidates)
+
+    results = candidates[:limit]
+    await attach_books(db, results)
+    return results
+
+
+async def hybrid_search_concurrent(
+    query: str,
+    limit: int = 20,
+    book_ids: list[int] | None = None,
+    rerank: bool | None = None,
+    timings: dict[str, float] | None = None,
+    query_embedding: Awaitable[list[float]] | None = None,
+) -> list[dict]:
+    """Hybrid search with FTS, query embedding and ANN overlapped.
+
+    FTS and ANN each run on their own session so they can be in flight at the
+    same time; ANN starts as soon as the embedding is ready. Callers that
+    also need the query embedding can pass it in as an awaitable (e.g. a
+    Task) to avoid encoding twice. Per-phase wall times (ms) are recorded
+    into `timings` when given.
+    """
+    if timings is None:
+        timings = {}
+    if rerank is None:
+        rerank = settings.rerank_enabled
+    candidate_limit = max(limit, settings.rerank_top_n) if rerank else limit
+
+    async def run_fts():
+        async with async_session_factory() as db:
+            return await fts_search(db, query, candidate_limit * 2, book_ids)
+
+    async def run_ann():
+        if query_embedding is None:
+            pending = asyncio.to_thread(generate_single_embedding, query)
+        else:
+            pending = query_embedding
+        embedding = await timed(timings, "embedding_ms", pending)
+        async with async_session_factory() as db:
+            return await timed(
+                timings, "ann_ms", semantic_search(db, embedding, candidate_limit * 2, book_ids)
+            )
+
+    fts_rows, sem_rows = await asyncio.gather(
+        timed(timings, "fts_ms", run_fts()),
+        run_ann(),
+    )
+
+    with phase_timer(timings, "fusion_ms"):
+        candidates = fuse_rrf(fts_rows, sem_rows, candidate_limit)
+    if rerank:
+        candidates = await timed(timings, "rerank_ms", rerank_candidates(query, candidates))
+
+    results = candidates[:limit]
+    async with async_session_factory() as db:
+        await timed(timings, "book_lookup_ms", attach_books(db, results))
+    return results
+
+
+async def fts_search(
+    db: AsyncSession,
+    query: str,
+    limit: int,
+    book_ids: list[int] | None = None,
+) -> list:
     fts_query = (
         select(
             BookChunk.id,
@@ -30,16 +111,22 @@ async def hybrid_search(
         )
         .where(BookChunk.search_vector.op("@@")(func.plainto_tsquery("english", query)))
         .order_by(desc("fts_rank"))
-        .limit(limit * 2)
+        .limit(limit)
     )
 
     if book_ids:
         fts_query = fts_query.where(BookChunk.book_id.in_(book_ids))
 
-    fts_result = await db.execute(fts_query)
-    fts_rows = fts_result.all()
+    result = await db.execute(fts_query)
+    return result.all()
+
 
-    # Semantic search results
+async def semantic_search(
+    db: AsyncSession,
+    query_embedding: list[float],
+    limit: int,
+    book_ids: list[int] | None = None,
+) -> list:
     sem_query = (
         select(
             BookChunk.id,
@@ -51,40 +138,32 @@ async def hybrid_search(
         )
         .where(BookChunk.embedding.isnot(None))
         .order_by("distance")
-        .limit(limit * 2)
+        .limit(limit)
     )
 
     if book_ids:
         sem_query = sem_query.where(BookChunk.book_id.in_(book_ids))
 
-    sem_result = await db.execute(sem_query)
-    sem_rows = sem_result.all()
+    result = await db.execute(sem_query)
+    return result.all()
 
-    # Reciprocal Rank Fusion
-    k = 60
+
+def fuse_rrf(fts_rows: list, sem_rows: list, limit: int, k: int = 60) -> list[dict]:
+    """Reciprocal Rank Fusion of FTS and semantic rows."""
     scores = {}
     chunk_data = {}
 
-    for rank, row in enumerate(fts_rows):
-        scores[row.id] = scores.get(row.id, 0) + 1.0 / (k + rank + 1)
-        chunk_data[row.id] = {
-            "chunk_id": row.id,
-            "book_id": row.book_id,
-            "content": row.content,
-            "page_number": row.page_number,
-            "chapter": row.chapter,
-        }
-
-    for rank, row in enumerate(sem_rows):
-        scores[row.id] = scores.get(row.id, 0) + 1.0 / (k + rank + 1)
-        if row.id not in chunk_data:
-            chunk_data[row.id] = {
-                "chunk_id": row.id,
-                "book_id": row.book_id,
-                "content": row.content,
-                "page_number": row.page_number,
-                "chapter": row.chapter,
-            }
+    for rows in (fts_rows, sem_rows):
+        for rank, row in enumerate(rows):
+            scores[row.id] = scores.get(row.id, 0) + 1.0 / (k + rank + 1)
+            if row.id not in chunk_data:
+                chunk_data[row.id] = {
+                    "chunk_id": row.id,
+                    "book_id": row.book_id,
+                    "content": row.content,
+                    "page_number": row.page_number,
+                    "chapter": row.chapter,
+                }
 
     ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
 
@@ -92,15 +171,71 @@ async def hybrid_search(
     for chunk_id, score in ranked:
         data = chunk_data[chunk_id]
         data["score"] = score
+        results.append(data)
+    return results
+
+
+async def attach_books(db: AsyncSession, results: list[dict]) -> None:
+    """Fill book_title/book_author on results with one batched lookup."""
+    book_ids = {r["book_id"] for r in results}
+    if not book_ids:
+        return
 
-        book = await db.get(Book, data["book_id"])
+    rows = await db.execute(
+        select(Book.id, Book.title, Book.author).where(Book.id.in_(book_ids))
+    )
+    books = {r.id: r for r in rows.all()}
+    for data in results:
+        book = books.get(data["book_id"])
         if book:
             data["book_title"] = book.title
             data["book_author"] = book.author
 
-        results.append(data)
 
-    return results
+_rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_rerank_job: Future | None = None
+
+
+async def rerank_candidates(
+    query: str,
+    candidates: list[dict],
+    top_n: int | None = None,
+    budget_ms: int | None = None,
+) -> list[dict]:
+    """Re-order the top-N fused candidates by cross-encoder relevance.
+
+    Scoring runs on a dedicated single-thread executor under a latency
+    budget; if the budget is exceeded (or the model fails) the RRF order is
+    returned unchanged. A scoring job that overran keeps its thread until it
+    finishes, so while one is in flight re-ranking is skipped rather than
+    queued behind it - overruns can't pile up or starve other to_thread work.
+    """
+    global _rerank_job
+    from app.processing.reranker import rerank_scores
+
+    top_n = top_n or settings.rerank_top_n
+    budget_ms = budget_ms or settings.rerank_budget_ms
+    head, tail = candidates[:top_n], candidates[top_n:]
+    if len(head) < 2:
+        return candidates
+    if _rerank_job is not None and not _rerank_job.done():
+        logger.warning("Re-ranker busy, keeping RRF order")
+        return candidates
+
+    _rerank_job = _rerank_executor.submit(rerank_scores, query, [c["content"] for c in head])
+    try:
+        scores = await asyncio.wait_for(asyncio.wrap_future(_rerank_job), timeout=budget_ms / 1000)
+    except asyncio.TimeoutError:
+        logger.warning(f"Re-ranking exceeded {budget_ms}ms budget, keeping RRF order")
+        return candidates
+    except Exception as e:
+        logger.error(f"Re-ranking failed, keeping RRF order: {e}")
+        return candidates
+
+    for data, rerank_score in zip(head, scores):
+        data["rerank_score"] = rerank_score
+    head.sort(key=lambda d: d["rerank_score"], reverse=True)
+    return head + tail
 
 
 async def search_books(
@@ -0,0 +1,312 @@
+"""Incremental topic clustering over book centroids.
+
+Book centroids (the mean of all of a book's chunk embeddings) are read from
+book_embeddings. Topics are clusters of those centroids, and their rows
+persist across runs:
+
+- Incremental update (the default): books without a topic are assigned to
+  the nearest centroid as one mini-batch. Each centroid then moves by the
+  MiniBatchKMeans rule, a running mean with per-center learning rate
+  1/count. Every book is then re-checked against the updated centroids with
+  one matrix product, and only changed BookTopic rows are written.
+- Full rebuild: when no topics exist, the target topic count changes, or it
+  is forced. A fresh MiniBatchKMeans fit runs, and the new clusters are
+  matched to existing topics by centroid similarity, so topic IDs, names
+  and colors survive a rebuild.
+
+Each coarse topic with enough books is split into subtopics (level 1), and
+books belong to both. Subtopics are re-clustered the same way, but only
+when their parent's membership hash changes. Names come from
+topic_labeler; new topics get a "Topic N" placeholder until labeled.
+
+Used by the Celery topic task and (via AsyncSession.run_sync) the API.
+"""
+import colorsys
+import hashlib
+import logging
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import MiniBatchKMeans
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.book import Book
+from app.models.chunk import BookEmbedding
+from app.models.topic import Topic, BookTopic, TopicRelation
+from app.utils.vectors import normalize_rows, cosine_pairs
+
+logger = logging.getLogger(__name__)
+
+MIN_BOOKS = 3
+RELATION_THRESHOLD = 0.3
+
+
+def target_topic_count(n_books: int, n_topics: int = 10) -> int:
+    return min(n_topics, max(2, n_books // 2))
+
+
+def membership_hash(book_ids) -> str:
+    return hashlib.sha1(",".join(str(b) for b in sorted(book_ids)).encode()).hexdigest()
+
+
+def topic_color(seed: str, parent_color: str | None = None) -> str:
+    """Deterministic hex color; subtopics take a lighter shade of the
+    parent's hue so a topic's family reads as one color in the UI."""
+    digest = hashlib.md5(seed.encode()).digest()
+    if parent_color:
+        r, g, b = (int(parent_color[i:i + 2], 16) / 255 for i in (1, 3, 5))
+        hue = (colorsys.rgb_to_hls(r, g, b)[0] + (digest[0] / 255 - 0.5) * 0.08) % 1.0
+        lightness = 0.62
+    else:
+        hue, lightness = digest[0] / 255, 0.48
+    r, g, b = colorsys.hls_to_rgb(hue, lightness, 0.6)
+    return "#" + "".join(f"{round(c * 255):02x}" for c in (r, g, b))
+
+
+def load_book_centroids(db: Session) -> tuple[list[int], np.ndarray]:
+    """(book_ids, unit-norm centroids) of completed books, from book_embeddings."""
+    rows = db.execute(
+        select(BookEmbedding.book_id, BookEmbedding.embedding)
+        .join(Book, Book.id == BookEmbedding.book_id)
+        .where(Book.processing_status == "completed")
+        .where(BookEmbedding.chapter.is_(None))
+        .order_by(BookEmbedding.book_id)
+    ).all()
+    if not rows:
+        return [], np.empty((0, settings.embedding_dimension), dtype=np.float32)
+    return [r[0] for r in rows], normalize_rows(np.asarray([r[1] for r in rows], dtype=np.float32))
+
+
+def _centers(topics: list[Topic]) -> np.ndarray:
+    return normalize_rows(np.asarray([t.embedding for t in topics], dtype=np.float32).reshape(len(topics), -1))
+
+
+def _coarse_book_topics():
+    return select(BookTopic).join(Topic, Topic.id == BookTopic.topic_id).where(Topic.level == 0)
+
+
+def _pending_changes(db: Session) -> int:
+    """Completed books without a topic plus topic rows for books that are
+    no longer completed - zero means an incremental run has nothing to do."""
+    has_topic = (
+        select(BookTopic.id)
+        .join(Topic, Topic.id == BookTopic.topic_id)
+        .where(BookTopic.book_id == Book.id)
+        .where(Topic.level == 0)
+        .exists()
+    )
+    unassigned = db.execute(
+        select(func.count(Book.id))
+        .where(Book.processing_status == "completed")
+        .where(~has_topic)
+        .where(
+            select(BookEmbedding.id)
+            .where(BookEmbedding.book_id == Book.id)
+            .where(BookEmbedding.chapter.is_(None))
+            .exists()
+        )
+    ).scalar()
+    orphaned = db.execute(
+        select(func.count(BookTopic.id))
+        .join(Book, Book.id == BookTopic.book_id)
+        .where(Book.processing_status != "completed")
+    ).scalar()
+    return unassigned + orphaned
+
+
+def _current_assignments(db: Session) -> dict[int, BookTopic]:
+    return {bt.book_id: bt for bt in db.execute(_coarse_book_topics()).scalars().all()}
+
+
+def _minibatch_update(centers: np.ndarray, counts: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """One MiniBatchKMeans step: move each center to the running mean of its
+    points. Returns the batch labels; `centers`/`counts` are updated in place."""
+    labels = np.argmax(X @ centers.T, axis=1)
+    for k in np.unique(labels):
+        members = X[labels == k]
+        total = counts[k] + len(members)
+        centers[k] = (centers[k] * counts[k] + members.sum(axis=0)) / total
+        counts[k] = total
+    centers[:] = normalize_rows(centers)
+    return labels
+
+
+def _next_free_name(taken: set[str]) -> str:
+    i = 1
+    while f"Topic {i}" in taken:
+        i += 1
+    taken.add(f"Topic {i}")
+    return f"Topic {i}"
+
+
+def _full_rebuild(
+    db: Session, topics: list[Topic], X: np.ndarray, n_topics: int, parent: Topic | None = None,
+) -> tuple[list[Topic], np.ndarray]:
+    model = MiniBatchKMeans(n_clusters=n_topics, random_state=42, n_init=3, batch_size=1024)
+    model.fit(X)
+    centers = normalize_rows(model.cluster_centers_.astype(np.float32))
+
+    # Keep IDs/names/colors: match new clusters to the most similar old topics
+    matched: dict[int, Topic] = {}
+    candidates = [t for t in topics if t.embedding is not None]
+    if candidates:
+        rows, cols = linear_sum_assignment(-(centers @ _centers(candidates).T))
+        matched = {int(r): candidates[c] for r, c in zip(rows, cols)}
+    # Bulk delete so book_topics/topic_relations cascade in the database
+    dropped = [t.id for t in topics if t not in matched.values()]
+    if dropped:
+        db.execute(delete(Topic).where(Topic.id.in_(dropped)))
+
+    taken = set(db.execute(select(Topic.name)).scalars().all())
+    result = []
+    for k in range(n_topics):
+        topic = matched.get(k)
+        if topic is None:
+            name = _next_free_name(taken)
+            if parent is None:
+                topic = Topic(name=name, color=topic_color(name), book_count=0, level=0)
+            else:
+                topic = Topic(
+                    name=name, color=topic_color(name, parent.color), book_count=0,
+                    level=parent.level + 1, parent_id=parent.id,
+                )
+            db.add(topic)
+        result.append(topic)
+    db.flush()
+    return result, centers
+
+
+def _sync_topic_relations(db: Session, topics: list[Topic], centers: np.ndarray):
+    """Upsert relations for centroid pairs above the threshold and drop the
+    rest; unchanged relations keep their rows."""
+    i, j, similarity = cosine_pairs(centers, threshold=RELATION_THRESHOLD, normalized=True)
+    ids = [t.id for t in topics]
+    wanted = {
+        (min(ids[a], ids[b]), max(ids[a], ids[b])): s
+        for a, b, s in zip(i.tolist(), j.tolist(), similarity.tolist())
+    }
+    existing = {
+        (r.topic_a_id, r.topic_b_id): r
+        for r in db.execute(select(TopicRelation)).scalars().all()
+    }
+    for key, relation in existing.items():
+        strength = wanted.get(key)
+        if strength is not None and abs(relation.strength - strength) > 1e-4:
+            relation.strength = strength
+    stale = [r.id for key, r in existing.items() if key not in wanted]
+    if stale:
+        db.execute(delete(TopicRelation).where(TopicRelation.id.in_(stale)))
+    new = [
+        {"topic_a_id": a, "topic_b_id": b, "strength": s, "relation_type": "related"}
+        for (a, b), s in wanted.items()
+        if (a, b) not in existing
+    ]
+    if new:
+        db.execute(insert(TopicRelation), new)
+
+
+def _update_subtopics(
+    db: Session, topics: list[Topic], book_ids: list[int], X: np.ndarray, labels: np.ndarray, force: bool,
+) -> int:
+    """Re-split coarse topics whose membership changed. Returns how many were re-split."""
+    resplit = 0
+    for k, parent in enumerate(topics):
+        members = np.flatnonzero(labels == k)
+        member_ids = [book_ids[i] for i in members]
+        digest = membership_hash(member_ids)
+        if not force and parent.membership_hash == digest:
+            continue
+        parent.membership_hash = digest
+        resplit += 1
+
+        children = list(db.execute(
+            select(Topic).where(Topic.parent_id == parent.id).order_by(Topic.id)
+        ).scalars().all())
+        n_sub = min(settings.topic_max_subtopics, len(members) // settings.topic_min_subtopic_books)
+        if n_sub < 2:
+            if children:
+                db.execute(delete(Topic).where(Topic.id.in_([c.id for c in children])))
+            continue
+
+        Xs = X[members]
+        children, centers = _full_rebuild(db, children, Xs, n_sub, parent=parent)
+        sims = Xs @ centers.T
+        sub_labels = np.argmax(sims, axis=1)
+        db.execute(delete(BookTopic).where(BookTopic.topic_id.in_([c.id for c in children])))
+        db.execute(insert(BookTopic), [
+            {"book_id": bid, "topic_id": children[sub_labels[i]].id, "relevance": float(sims[i, sub_labels[i]])}
+            for i, bid in enumerate(member_ids)
+        ])
+        counts = np.bincount(sub_labels, minlength=n_sub)
+        for c, child in enumerate(children):
+            child.embedding = centers[c].tolist()
+            child.book_count = int(counts[c])
+            child.membership_hash = membership_hash([bid for i, bid in enumerate(member_ids) if sub_labels[i] == c])
+    return resplit
+
+
+def update_topics(db: Session, n_topics: int = 10, full: bool = False) -> dict:
+    """Bring topics up to date with the library. Does not commit."""
+    topics = list(db.execute(select(Topic).where(Topic.level == 0).order_by(Topic.id)).scalars().all())
+    incremental = not full and bool(topics) and all(t.embedding is not None for t in topics)
+    if incremental and not _pending_changes(db):
+        return {"mode": "noop", "topics": len(topics), "assignments_changed": 0}
+
+    book_ids, X = load_book_centroids(db)
+    if len(book_ids) < MIN_BOOKS:
+        return {"error": "Not enough books for topic modeling"}
+
+    k = target_topic_count(len(book_ids), n_topics)
+    if not incremental or len(topics) != k:
+        topics, centers = _full_rebuild(db, topics, X, k)
+        mode = "full"
+    else:
+        mode = "incremental"
+        centers = _centers(topics)
+        assigned = set(db.execute(
+            select(BookTopic.book_id).join(Topic, Topic.id == BookTopic.topic_id).where(Topic.level == 0)
+        ).scalars().all())
+        new_rows = [i for i, bid in enumerate(book_ids) if bid not in assigned]
+        if new_rows:
+            counts = np.asarray([max(1, t.book_count or 0) for t in topics], dtype=np.float64)
+            _minibatch_update(centers, counts, X[new_rows])
+
+    assignments = _current_assignments(db)
+
+    # Re-check every book against the (possibly moved) centers
+    sims = X @ centers.T
+    labels = np.argmax(sims, axis=1)
+    relevance = sims[np.arange(len(book_ids)), labels]
+
+    changed = 0
+    for i, bid in enumerate(book_ids):
+        topic_id = topics[labels[i]].id
+        current = assignments.pop(bid, None)
+        if current is None:
+            db.add(BookTopic(book_id=bid, topic_id=topic_id, relevance=float(relevance[i])))
+            changed += 1
+        elif current.topic_id != topic_id:
+            current.topic_id = topic_id
+            current.relevance = float(relevance[i])
+            changed += 1
+    # Books no longer completed (or without embeddings) drop out of topics, subtopics included
+    if assignments:
+        db.execute(delete(BookTopic).where(BookTopic.book_id.in_(list(assignments))))
+        changed += len(assignments)
+
+    counts = np.bincount(labels, minlength=len(topics))
+    for topic, center, count in zip(topics, centers, counts):
+        topic.embedding = center.tolist()
+        topic.book_count = int(count)
+
+    _sync_topic_relations(db, topics, centers)
+    resplit = _update_subtopics(db, topics, book_ids, X, labels, force=mode == "full")
+    db.flush()
+
+    logger.info(
+        f"Topics updated ({mode}): {len(topics)} topics, {changed} assignment changes, {resplit} re-split"
+    )
+    return {
+        "mode": mode, "topics": len(topics), "books": len(book_ids),
+        "assignments_changed": changed, "topics_resplit": resplit,
+    }
@@ -0,0 +1,225 @@
+"""LLM names for topic clusters, one batched call per hierarchy level.
+
+Each cluster is described to the model by sample titles and its most
+distinctive keywords. Keywords come from ts_stat over the cluster's chunk
+search vectors, weighted against the other clusters in the same call.
+Results are stored in topic_labels keyed by the cluster's membership hash,
+so an unchanged cluster never reaches the LLM again. A topic also keeps its
+name while at least topic_relabel_min_overlap (Jaccard) of the books it was
+named for are still members, which keeps names stable as books trickle in.
+"""
+import logging
+import math
+from collections import Counter
+from sqlalchemy import select, func, text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.llm.client import get_sync_llm_client
+from app.llm.prompts import LABEL_TOPICS_BATCH
+from app.llm.structured import complete_json_sync
+from app.models.book import Book
+from app.models.chunk import BookChunk
+from app.models.topic import Topic, BookTopic, TopicLabel
+from app.services.topic_engine import membership_hash
+
+logger = logging.getLogger(__name__)
+
+KEYWORDS_PER_TOPIC = 12
+TITLES_PER_TOPIC = 8
+STAT_TERMS = 200
+
+
+def _members(db: Session) -> dict[int, list[int]]:
+    rows = db.execute(
+        select(BookTopic.topic_id, func.array_agg(BookTopic.book_id)).group_by(BookTopic.topic_id)
+    ).all()
+    return {topic_id: sorted(book_ids) for topic_id, book_ids in rows}
+
+
+def _term_shares(db: Session, book_ids: list[int]) -> dict[str, float]:
+    """Fraction of the cluster's chunks containing each of its most common lexemes."""
+    total = db.execute(
+        select(func.count(BookChunk.id))
+        .where(BookChunk.book_id.in_(book_ids))
+        .where(BookChunk.search_vector.isnot(None))
+    ).scalar()
+    if not total:
+        return {}
+    ids = ",".join(str(int(b)) for b in book_ids)
+    rows = db.execute(
+        text("SELECT word, ndoc FROM ts_stat(:query) ORDER BY ndoc DESC, word LIMIT :n"),
+        {
+            "query": f"SELECT search_vector FROM book_chunks WHERE book_id IN ({ids}) AND search_vector IS NOT NULL",
+            "n": STAT_TERMS,
+        },
+    ).all()
+    return {word: ndoc / total for word, ndoc in rows if len(word) > 2 and not word.isdigit()}
+
+
+def distinctive_keywords(shares: list[dict[str, float]], n: int = KEYWORDS_PER_TOPIC) -> list[list[str]]:
+    """TF-IDF across clusters: common in this cluster, rare in the others."""
+    df = Counter(word for cluster in shares for word in cluster)
+    return [
+        sorted(cluster, key=lambda w: (-cluster[w] * math.log(1 + len(shares) / df[w]), w))[:n]
+        for cluster in shares
+    ]
+
+
+def _sample_titles(db: Session, topic_ids: list[int]) -> dict[int, list[str]]:
+    ranked = (
+        select(
+            BookTopic.topic_id,
+            Book.title,
+            func.row_number().over(
+                partition_by=BookTopic.topic_id, order_by=BookTopic.relevance.desc()
+            ).label("rank"),
+        )
+        .join(Book, Book.id == BookTopic.book_id)
+        .where(BookTopic.topic_id.in_(topic_ids))
+        .subquery()
+    )
+    titles: dict[int, list[str]] = {}
+    for topic_id, title, _ in db.execute(
+        select(ranked).where(ranked.c.rank <= TITLES_PER_TOPIC).order_by(ranked.c.topic_id, ranked.c.rank)
+    ).all():
+        titles.setdefault(topic_id, []).append(title)
+    return titles
+
+
+def _jaccard(a: list[int], b: list[int]) -> float:
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _unique_name(name: str, topic: Topic, taken: set[str], by_id: dict[int, Topic]) -> str:
+    """`name`, disambiguated against every name currently in use. Names are
+    never freed within a run, so a rename can't collide with another topic's
+    not-yet-flushed rename."""
+    name = name.strip()[:200]
+    if not name or name == topic.name:
+        return topic.name
+    candidates = [name]
+    parent = by_id.get(topic.parent_id)
+    if parent:
+        candidates.append(f"{parent.name}: {name}"[:200])
+    candidates += [f"{name} ({i})"[:200] for i in range(2, 100)]
+    for candidate in candidates:
+        if candidate not in taken:
+            taken.add(candidate)
+            return candidate
+    return topic.name
+
+
+def _apply(topic: Topic, label: TopicLabel, digest: str, taken: set[str], by_id: dict[int, Topic]):
+    topic.name = _unique_name(label.name, topic, taken, by_id)
+    topic.description = label.description
+    topic.keywords = label.keywords
+    topic.label_hash = digest
+
+
+def _generate_labels(
+    db: Session, batch: list[tuple[Topic, list[int], str]], by_id: dict[int, Topic],
+) -> list[TopicLabel | None]:
+    keywords = distinctive_keywords([_term_shares(db, book_ids) for _, book_ids, _ in batch])
+    titles = _sample_titles(db, [topic.id for topic, _, _ in batch])
+
+    clusters = []
+    for n, (topic, _, _) in enumerate(batch):
+        parent = by_id.get(topic.parent_id)
+        header = f'[{n}] subtopic of "{parent.name}"' if parent else f"[{n}]"
+        clusters.append(
+            f"{header}\nBooks: {'; '.join(titles.get(topic.id, []))}\nKeywords: {', '.join(keywords[n])}"
+        )
+    level = batch[0][0].level
+    context = "These are subtopics within broader topics." if level else "These are the library's broad topics."
+
+    client = get_sync_llm_client()
+    model = client.registry.get_model("topic")
+    try:
+        data = complete_json_sync(
+            lambda messages: client.complete(
+                messages=messages, task_type="topic", temperature=0.3,
+                max_tokens=200 + 80 * len(batch), json_mode=True,
+            ),
+            [{"role": "user", "content": LABEL_TOPICS_BATCH.format(context=context, clusters="\n\n".join(clusters))}],
+            model=model,
+            retry_complete=lambda messages, continuation: client.complete(
+                messages=messages, task_type="topic", temperature=0.3,
+                max_tokens=200 + 80 * len(batch), cache=False, json_mode=not continuation,
+            ),
+        )
+    except Exception as e:
+        logger.warning(f"Topic labeling failed for {len(batch)} level-{level} topics: {e}")
+        return [None] * len(batch)
+
+    answers: dict[int, dict] = {}
+    for item in (data.get("topics") if isinstance(data, dict) else None) or []:
+        try:
+            answers[int(item["id"])] = item
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    labels = []
+    for n, (_, book_ids, digest) in enumerate(batch):
+        answer = answers.get(n)
+        if not answer or not str(answer.get("name") or "").strip():
+            labels.append(None)
+            continue
+        labels.append(TopicLabel(
+            membership_hash=digest,
+            name=str(answer["name"]).strip()[:200],
+            description=str(answer.get("description") or "").strip() or None,
+            keywords=keywords[n],
+            book_ids=book_ids,
+            model_used=model,
+        ))
+    return labels
+
+
+def label_topics(db: Session) -> dict:
+    """Name every topic whose membership changed, coarse level first so
+    subtopic prompts can mention their parent's name. Does not commit."""
+    topics = list(db.execute(select(Topic).order_by(Topic.level, Topic.id)).scalars().all())
+    if not topics:
+        return {"labeled": 0, "from_cache": 0, "llm_calls": 0}
+    by_id = {t.id: t for t in topics}
+    members = _members(db)
+    digests = {t.id: membership_hash(members[t.id]) for t in topics if members.get(t.id)}
+    wanted = set(digests.values()) | {t.label_hash for t in topics if t.label_hash}
+    cache = {
+        label.membership_hash: label
+        for label in db.execute(select(TopicLabel).where(TopicLabel.membership_hash.in_(wanted))).scalars().all()
+    }
+    taken = {t.name for t in topics}
+
+    labeled = from_cache = calls = 0
+    for level in sorted({t.level for t in topics}):
+        pending = []
+        for topic in (t for t in topics if t.level == level and t.id in digests):
+            digest = digests[topic.id]
+            if topic.label_hash == digest:
+                continue
+            if digest in cache:
+                _apply(topic, cache[digest], digest, taken, by_id)
+                from_cache += 1
+                continue
+            previous = cache.get(topic.label_hash)
+            if previous and _jaccard(previous.book_ids, members[topic.id]) >= settings.topic_relabel_min_overlap:
+                continue
+            pending.append((topic, members[topic.id], digest))
+
+        for start in range(0, len(pending), settings.topic_label_batch_size):
+            batch = pending[start:start + settings.topic_label_batch_size]
+            calls += 1
+            for (topic, _, digest), label in zip(batch, _generate_labels(db, batch, by_id)):
+                if label is None:
+                    continue
+                db.add(label)
+                cache[digest] = label
+                _apply(topic, label, digest, taken, by_id)
+                labeled += 1
+        db.flush()
+
+    if labeled or from_cache:
+        logger.info(f"Labeled {labeled} topics via {calls} LLM calls, {from_cache} from cache")
+    return {"labeled": labeled, "from_cache": from_cache, "llm_calls": calls}
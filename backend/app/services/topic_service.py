@@ -1,21 +1,21 @@
 """Topic modeling and knowledge graph."""
 import logging
-import numpy as np
-from sklearn.cluster import KMeans
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.topic import Topic, BookTopic, TopicRelation
 from app.models.book import Book
-from app.models.chunk import BookChunk
-from app.processing.embedder import generate_single_embedding
+from app.config import settings
+from app.services.topic_engine import update_topics
+from app.services.topic_labeler import label_topics
 
 logger = logging.getLogger(__name__)
 
 
-async def get_topics(db: AsyncSession) -> list[Topic]:
-    result = await db.execute(
-        select(Topic).order_by(Topic.book_count.desc())
-    )
+async def get_topics(db: AsyncSession, level: int | None = None) -> list[Topic]:
+    query = select(Topic).order_by(Topic.book_count.desc())
+    if level is not None:
+        query = query.where(Topic.level == level)
+    result = await db.execute(query)
     return list(result.scalars().all())
 
 
@@ -40,9 +40,18 @@ async def get_topic_graph(db: AsyncSession) -> dict:
     result = await db.execute(select(TopicRelation).where(TopicRelation.strength > 0.3))
     relations = result.scalars().all()
 
+    subtopics: dict[int, list[dict]] = {}
+    for t in topics:
+        if t.parent_id is not None:
+            subtopics.setdefault(t.parent_id, []).append(
+                {"id": t.id, "name": t.name, "book_count": t.book_count, "color": t.color}
+            )
     nodes = [
-        {"id": t.id, "name": t.name, "book_count": t.book_count, "color": t.color}
-        for t in topics
+        {
+            "id": t.id, "name": t.name, "book_count": t.book_count, "color": t.color,
+            "subtopics": subtopics.get(t.id, []),
+        }
+        for t in topics if t.parent_id is None
     ]
     edges = [
         {"source": r.topic_a_id, "target": r.topic_b_id, "strength": r.strength}
@@ -52,61 +61,11 @@ async def get_topic_graph(db: AsyncSession) -> dict:
     return {"nodes": nodes, "edges": edges}
 
 
-async def run_topic_modeling(db: AsyncSession, n_topics: int = 10) -> list[Topic]:
-    """K-means clustering on book embeddings -> topics."""
-    result = await db.execute(
-        select(Book.id)
-        .where(Book.processing_status == "completed")
-    )
-    book_ids = [r[0] for r in result.all()]
-
-    if len(book_ids) < n_topics:
-        n_topics = max(2, len(book_ids) // 2)
-
-    # Get average embedding per book
-    book_embeddings = []
-    valid_book_ids = []
-    for bid in book_ids:
-        chunk_result = await db.execute(
-            select(BookChunk.embedding)
-            .where(BookChunk.book_id == bid)
-            .where(BookChunk.embedding.isnot(None))
-            .limit(20)
-        )
-        embeddings = [r[0] for r in chunk_result.all() if r[0] is not None]
-        if embeddings:
-            avg = np.mean(embeddings, axis=0)
-            book_embeddings.append(avg)
-            valid_book_ids.append(bid)
-
-    if len(book_embeddings) < 2:
-        return []
-
-    X = np.array(book_embeddings)
-    kmeans = KMeans(n_clusters=n_topics, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(X)
-
-    topics = []
-    for i in range(n_topics):
-        cluster_books = [valid_book_ids[j] for j in range(len(labels)) if labels[j] == i]
-        if not cluster_books:
-            continue
-
-        center = kmeans.cluster_centers_[i].tolist()
-        topic = Topic(
-            name=f"Topic {i + 1}",
-            embedding=center,
-            book_count=len(cluster_books),
-            color=f"#{hash(f'topic{i}') % 0xFFFFFF:06x}",
-        )
-        db.add(topic)
-        await db.flush()
-
-        for bid in cluster_books:
-            bt = BookTopic(book_id=bid, topic_id=topic.id, relevance=0.8)
-            db.add(bt)
-
-        topics.append(topic)
-
+async def run_topic_modeling(db: AsyncSession, n_topics: int = 10, full: bool = False) -> list[Topic]:
+    """Update topics in place (see topic_engine), name the changed ones like
+    the rebuild_topics task does, and return the coarse topics."""
+    result = await db.run_sync(lambda session: update_topics(session, n_topics=n_topics, full=full))
+    if settings.topic_llm_labels and "error" not in result:
+        await db.run_sync(label_topics)
     await db.flush()
-    return topics
+    return await get_topics(db, level=0)
@@ -0,0 +1,28 @@
+"""Per-phase timing helpers for request pipelines."""
+import time
+from contextlib import contextmanager
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+async def timed(timings: dict[str, float], phase: str, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable` and record its wall time (ms) under `phase`."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[phase] = _elapsed_ms(start)
+
+
+@contextmanager
+def phase_timer(timings: dict[str, float], phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = _elapsed_ms(start)
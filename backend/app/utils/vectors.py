@@ -0,0 +1,93 @@
+"""Vectorized cosine similarity over embedding matrices."""
+import numpy as np
+
+# Similarity cells per block (float32): bounds block memory at ~128MB
+MAX_BLOCK_CELLS = 1 << 25
+
+
+def normalize_rows(X) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    return X / np.maximum(np.linalg.norm(X, axis=-1, keepdims=True), 1e-8)
+
+
+def _similarity_blocks(A, B, groups_a, groups_b, block_size: int):
+    """Yield (start, sims) for blocks of rows of A against all of B, with
+    pairs sharing a group label set to -inf."""
+    ga = None if groups_a is None else np.asarray(groups_a)
+    gb = None if groups_b is None else np.asarray(groups_b)
+    for start in range(0, len(A), block_size):
+        sims = A[start:start + block_size] @ B.T
+        if ga is not None and gb is not None:
+            sims[ga[start:start + len(sims), None] == gb[None, :]] = -np.inf
+        yield start, sims
+
+
+def _triples(out_i, out_j, out_s) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if not out_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(out_i), np.concatenate(out_j), np.concatenate(out_s)
+
+
+def cosine_pairs(
+    A,
+    B=None,
+    threshold: float = 0.0,
+    groups_a=None,
+    groups_b=None,
+    block_size: int = 2048,
+    normalized: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All (i, j, similarity) with cosine similarity above `threshold`.
+
+    With `B` None this is a self-join of `A` returning each pair once (i < j).
+    If group labels are given (e.g. the book of each insight), pairs within
+    the same group are skipped. Rows of `A` are processed in blocks, so
+    memory stays at block_size x len(B) however large `A` grows.
+    """
+    self_join = B is None
+    A = A if normalized else normalize_rows(A)
+    B = A if self_join else (B if normalized else normalize_rows(B))
+    groups_b = groups_a if self_join else groups_b
+
+    out_i, out_j, out_s = [], [], []
+    columns = np.arange(len(B))
+    for start, sims in _similarity_blocks(A, B, groups_a, groups_b, block_size):
+        mask = sims > threshold
+        if self_join:
+            mask &= columns[None, :] > np.arange(start, start + len(sims))[:, None]
+        i, j = np.nonzero(mask)
+        out_i.append(i + start)
+        out_j.append(j)
+        out_s.append(sims[i, j])
+    return _triples(out_i, out_j, out_s)
+
+
+def top_k_cosine(
+    A,
+    B,
+    k: int,
+    threshold: float = -1.0,
+    groups_a=None,
+    groups_b=None,
+    block_size: int | None = None,
+    normalized: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """For each row of `A`, its `k` most similar rows of `B` above `threshold`,
+    as (i, j, similarity) triples. Pairs sharing a group label are skipped.
+    Blocks default to as many rows of `A` as fit in MAX_BLOCK_CELLS."""
+    A = A if normalized else normalize_rows(A)
+    B = B if normalized else normalize_rows(B)
+    k = min(k, len(B))
+    if not k:
+        return _triples([], [], [])
+    block_size = block_size or max(1, MAX_BLOCK_CELLS // max(1, len(B)))
+
+    out_i, out_j, out_s = [], [], []
+    for start, sims in _similarity_blocks(A, B, groups_a, groups_b, block_size):
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(sims, idx, axis=1)
+        keep = top > threshold
+        out_i.append(np.nonzero(keep)[0] + start)
+        out_j.append(idx[keep])
+        out_s.append(top[keep])
+    return _triples(out_i, out_j, out_s)
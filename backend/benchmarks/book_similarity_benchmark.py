@@ -0,0 +1,121 @@
+"""Benchmark: recall and latency of book-similarity ANN on a synthetic corpus.
+
+Generates a clustered synthetic library (topic -> book -> chapter vectors)
+and loads it into books/book_embeddings inside one transaction. It then
+times `get_similar_books` in both modes against exact numpy ground truth
+and rolls everything back at the end, so the library is untouched. Loading
+goes through the live HNSW indexes and takes a few minutes at 50k books.
+Run it against a development database.
+
+Usage (from backend/):
+    python -m benchmarks.book_similarity_benchmark --books 50000 --chapters 4 --queries 100
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import numpy as np
+from sqlalchemy import insert, text
+from app.config import settings
+from app.db.session import async_session_factory
+from app.models.book import Book
+from app.models.chunk import BookEmbedding
+from app.services.recommendation_service import get_similar_books
+
+INSERT_BATCH = 5000
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    return X / np.linalg.norm(X, axis=-1, keepdims=True)
+
+
+def make_corpus(n_books: int, n_chapters: int, n_topics: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """(book centroids [n_books, d], chapter vectors [n_books, n_chapters, d])."""
+    rng = np.random.default_rng(seed)
+    dim = settings.embedding_dimension
+    topics = _normalize(rng.standard_normal((n_topics, dim)))
+    books = _normalize(topics[rng.integers(0, n_topics, n_books)] + 0.6 * _normalize(rng.standard_normal((n_books, dim))))
+    chapters = _normalize(books[:, None, :] + 0.5 * _normalize(rng.standard_normal((n_books, n_chapters, dim))))
+    return _normalize(chapters.mean(axis=1)).astype(np.float32), chapters.astype(np.float32)
+
+
+def exact_top_k(scores: np.ndarray, exclude: int, k: int) -> set[int]:
+    scores[exclude] = -np.inf
+    return set(np.argpartition(-scores, k)[:k].tolist())
+
+
+def summarize(label: str, recalls: list[float], latencies: list[float], k: int):
+    lat = sorted(latencies)
+    print(
+        f"{label:>14}: recall@{k}={statistics.mean(recalls):.3f} "
+        f"latency p50={statistics.median(lat):.1f}ms p95={lat[int(len(lat) * 0.95) - 1]:.1f}ms"
+    )
+
+
+async def run(n_books: int, n_chapters: int, n_topics: int, n_queries: int, limit: int, seed: int):
+    centroids, chapters = make_corpus(n_books, n_chapters, n_topics, seed)
+    flat_chapters = chapters.reshape(-1, chapters.shape[-1])
+
+    async with async_session_factory() as db:
+        start = time.perf_counter()
+        ids = (await db.execute(
+            insert(Book).returning(Book.id, sort_by_parameter_order=True),
+            [
+                {"title": f"Synthetic {i}", "file_hash": f"bench-{seed}-{i}", "processing_status": "completed"}
+                for i in range(n_books)
+            ],
+        )).scalars().all()
+        rows = []
+        for i, book_id in enumerate(ids):
+            rows.append({"book_id": book_id, "chapter": None, "chunk_count": n_chapters, "embedding": centroids[i].tolist()})
+            rows.extend(
+                {"book_id": book_id, "chapter": f"Chapter {c + 1}", "chunk_count": 1, "embedding": chapters[i, c].tolist()}
+                for c in range(n_chapters)
+            )
+        for i in range(0, len(rows), INSERT_BATCH):
+            await db.execute(insert(BookEmbedding), rows[i:i + INSERT_BATCH])
+        await db.execute(text("ANALYZE book_embeddings"))
+        print(f"loaded {n_books} books / {len(rows)} centroids in {time.perf_counter() - start:.0f}s")
+
+        index_of = {book_id: i for i, book_id in enumerate(ids)}
+        queries = np.random.default_rng(seed + 1).choice(n_books, size=min(n_queries, n_books), replace=False)
+        stats = {label: {"recall": [], "lat": []} for label in ("exact-centroid", "exact-chapters", "centroid", "chapters")}
+
+        try:
+            for q in queries:
+                q = int(q)
+                t = time.perf_counter()
+                truth_centroid = exact_top_k(centroids @ centroids[q], q, limit)
+                stats["exact-centroid"]["lat"].append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                chapter_scores = (flat_chapters @ chapters[q].T).max(axis=1).reshape(n_books, n_chapters).max(axis=1)
+                truth_chapters = exact_top_k(chapter_scores, q, limit)
+                stats["exact-chapters"]["lat"].append((time.perf_counter() - t) * 1000)
+                stats["exact-centroid"]["recall"].append(1.0)
+                stats["exact-chapters"]["recall"].append(1.0)
+
+                for mode, truth in (("centroid", truth_centroid), ("chapters", truth_chapters)):
+                    t = time.perf_counter()
+                    results = await get_similar_books(db, ids[q], limit=limit, mode=mode)
+                    stats[mode]["lat"].append((time.perf_counter() - t) * 1000)
+                    found = {index_of[r["book"].id] for r in results if r["book"].id in index_of}
+                    stats[mode]["recall"].append(len(found & truth) / limit)
+        finally:
+            await db.rollback()
+
+    print(f"books={n_books} chapters/book={n_chapters} queries={len(queries)} limit={limit} "
+          f"ef_search>={settings.similar_books_ef_search}")
+    for label, s in stats.items():
+        summarize(label, s["recall"], s["lat"], limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--chapters", type=int, default=4)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.books, args.chapters, args.topics, args.queries, args.limit, args.seed))
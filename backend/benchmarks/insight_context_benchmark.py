@@ -0,0 +1,102 @@
+"""Benchmark: insight prompt tokens per book, first-N chunks vs representative selection.
+
+For each sampled book this reports the prompt tokens the extraction step
+would send under the old first-N strategy (20 / 50 chunks) and under
+clustering-based selection, plus two coverage measures: the share of
+chapters represented and the mean best cosine similarity of every chunk to
+the selected set. Coverage counts only the chunks that survive the
+MAX_CONTENT_CHARS prompt cap, and `cut` is the share of selected
+characters the cap drops.
+
+Usage (from backend/):
+    python -m benchmarks.insight_context_benchmark --books 20 --budget 12000
+"""
+import argparse
+import statistics
+import time
+import numpy as np
+from sqlalchemy import select, func
+from app.db.session import sync_session_factory
+from app.llm.client import llm_client
+from app.llm.tokens import count_tokens
+from app.models.book import Book
+from app.models.chunk import BookChunk
+from app.services.insight_engine import CONTEXT_SEPARATOR, MAX_CONTENT_CHARS, select_context_chunks
+
+
+def coverage(all_chunks: list, selected: list) -> tuple[float, float]:
+    if not selected:
+        return 0.0, 0.0
+    chapters = {c.chapter for c in all_chunks}
+    chapter_cov = len({c.chapter for c in selected}) / max(1, len(chapters))
+    X = np.asarray([c.embedding for c in all_chunks], dtype=np.float32)
+    S = np.asarray([c.embedding for c in selected], dtype=np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True) + 1e-8
+    S /= np.linalg.norm(S, axis=1, keepdims=True) + 1e-8
+    return chapter_cov, float((X @ S.T).max(axis=1).mean())
+
+
+def in_prompt(picked: list) -> tuple[list, float]:
+    """The chunks extraction_messages keeps whole, and the share of characters it cuts."""
+    kept, used = [], 0
+    for c in picked:
+        used += len(c.content) + len(CONTEXT_SEPARATOR)
+        if used - len(CONTEXT_SEPARATOR) > MAX_CONTENT_CHARS:
+            break
+        kept.append(c)
+    total = len(CONTEXT_SEPARATOR.join(c.content for c in picked))
+    return kept, max(0, total - MAX_CONTENT_CHARS) / max(1, total)
+
+
+def run(n_books: int, budget: int):
+    model = llm_client.registry.get_model("insight")
+    rows = {"first_20": [], "first_50": [], "representative": []}
+
+    with sync_session_factory() as db:
+        book_ids = db.execute(
+            select(Book.id).where(Book.processing_status == "completed").order_by(func.random()).limit(n_books)
+        ).scalars().all()
+
+        for book_id in book_ids:
+            chunks = db.execute(
+                select(BookChunk)
+                .where(BookChunk.book_id == book_id)
+                .where(BookChunk.embedding.isnot(None))
+                .order_by(BookChunk.chunk_index)
+            ).scalars().all()
+            if len(chunks) < 2:
+                continue
+
+            for label, limit in (("first_20", 20), ("first_50", 50)):
+                kept, cut = in_prompt(chunks[:limit])
+                content = CONTEXT_SEPARATOR.join(c.content for c in chunks[:limit])[:MAX_CONTENT_CHARS]
+                rows[label].append((count_tokens(content, model), *coverage(chunks, kept), cut, 0.0))
+
+            start = time.perf_counter()
+            picked = select_context_chunks(chunks, budget, model)
+            elapsed = (time.perf_counter() - start) * 1000
+            kept, cut = in_prompt(picked)
+            content = CONTEXT_SEPARATOR.join(c.content for c in picked)[:MAX_CONTENT_CHARS]
+            rows["representative"].append((count_tokens(content, model), *coverage(chunks, kept), cut, elapsed))
+
+    print(f"books={len(rows['representative'])} budget={budget} tokens")
+    for label, samples in rows.items():
+        if not samples:
+            continue
+        tokens, chapters, semantic, cut, ms = zip(*samples)
+        print(
+            f"{label:>15}: tokens/book={statistics.mean(tokens):.0f} "
+            f"chapter_coverage={statistics.mean(chapters):.1%} "
+            f"semantic_coverage={statistics.mean(semantic):.3f} "
+            f"cut={statistics.mean(cut):.1%}"
+            + (f" select_ms={statistics.mean(ms):.1f}" if label == "representative" else "")
+        )
+    print("(each of the 3 extraction prompts sends these tokens, so per-book cost is ~3x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--budget", type=int, default=12000)
+    args = parser.parse_args()
+    run(args.books, args.budget)
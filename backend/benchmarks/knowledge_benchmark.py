@@ -0,0 +1,121 @@
+"""Benchmark: knowledge endpoints before/after removing N+1 lookups.
+
+Seeds a synthetic graph (books -> insights -> 10k connections by default)
+inside one transaction and times:
+  - before: the old per-connection db.get loop for /knowledge/map
+  - joined: the current build from book_edges, cache disabled
+  - cached: the current build served from Redis (after one warm-up call)
+Everything is rolled back and the knowledge cache cleared at the end. Run
+it against a development database.
+
+Usage (from backend/):
+    python -m benchmarks.knowledge_benchmark --connections 10000 --runs 20
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from sqlalchemy import insert, select
+from app.config import settings
+from app.db.session import async_session_factory
+from app.models.book import Book
+from app.models.insight import BookInsight, InsightConnection
+from app.services import knowledge_service
+from app.services.book_edges import rebuild_book_edges
+
+INSERT_BATCH = 5000
+
+
+async def legacy_knowledge_map(db) -> dict:
+    """The pre-join implementation, kept here as the baseline."""
+    books = (await db.execute(select(Book).where(Book.processing_status == "completed"))).scalars().all()
+    connections = (await db.execute(
+        select(InsightConnection).where(InsightConnection.strength > 0.5)
+    )).scalars().all()
+    book_ids, edges = set(), []
+    for conn in connections:
+        insight_a = await db.get(BookInsight, conn.insight_a_id)
+        insight_b = await db.get(BookInsight, conn.insight_b_id)
+        if insight_a and insight_b and insight_a.book_id != insight_b.book_id:
+            book_ids.update((insight_a.book_id, insight_b.book_id))
+            edges.append({"source": insight_a.book_id, "target": insight_b.book_id, "strength": conn.strength})
+    return {"nodes": [b.id for b in books if b.id in book_ids], "edges": edges}
+
+
+async def seed(db, n_books: int, n_insights: int, n_connections: int, rng: random.Random):
+    book_ids = (await db.execute(
+        insert(Book).returning(Book.id, sort_by_parameter_order=True),
+        [{"title": f"Synthetic {i}", "file_hash": f"kbench-{i}", "processing_status": "completed"}
+         for i in range(n_books)],
+    )).scalars().all()
+    insight_ids = (await db.execute(
+        insert(BookInsight).returning(BookInsight.id, sort_by_parameter_order=True),
+        [{"book_id": book_ids[i % n_books], "insight_type": "key_concept", "title": f"Insight {i}", "content": "..."}
+         for i in range(n_insights)],
+    )).scalars().all()
+    book_of = {iid: book_ids[i % n_books] for i, iid in enumerate(insight_ids)}
+
+    pairs = set()
+    while len(pairs) < n_connections:
+        a, b = rng.sample(insight_ids, 2)
+        if book_of[a] != book_of[b]:
+            pairs.add((min(a, b), max(a, b)))
+    rows = [
+        {"insight_a_id": a, "insight_b_id": b, "connection_type": "similar", "strength": rng.uniform(0.3, 1.0)}
+        for a, b in pairs
+    ]
+    for i in range(0, len(rows), INSERT_BATCH):
+        await db.execute(insert(InsightConnection), rows[i:i + INSERT_BATCH])
+    await db.flush()
+    await db.run_sync(rebuild_book_edges)
+
+
+async def timed(db, fn, runs: int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        db.expunge_all()  # no identity-map hits carried between runs
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(n_books: int, n_insights: int, n_connections: int, runs: int, seed_value: int):
+    async with async_session_factory() as db:
+        try:
+            await seed(db, n_books, n_insights, n_connections, random.Random(seed_value))
+            ttl = settings.knowledge_cache_ttl
+            results = {}
+            results["before"] = await timed(db, lambda: legacy_knowledge_map(db), max(1, runs // 4))
+            settings.knowledge_cache_ttl = 0
+            results["joined"] = await timed(db, lambda: knowledge_service.get_knowledge_map(db), runs)
+            results["joined /connections"] = await timed(
+                db, lambda: knowledge_service.get_knowledge_connections(db, limit=50), runs,
+            )
+            settings.knowledge_cache_ttl = ttl or 3600
+            # The map's cache version doesn't see uncommitted seed data
+            await knowledge_service.clear_knowledge_cache()
+            await knowledge_service.get_knowledge_map(db)
+            results["cached"] = await timed(db, lambda: knowledge_service.get_knowledge_map(db), runs)
+            settings.knowledge_cache_ttl = ttl
+        finally:
+            await db.rollback()
+            await knowledge_service.clear_knowledge_cache()
+
+    print(f"books={n_books} insights={n_insights} connections={n_connections}")
+    for label, samples in results.items():
+        lat = sorted(samples)
+        p95 = lat[max(0, int(len(lat) * 0.95) - 1)]
+        print(f"{label:>20}: p50={statistics.median(lat):.1f}ms p95={p95:.1f}ms (n={len(lat)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--insights", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.books, args.insights, args.connections, args.runs, args.seed))
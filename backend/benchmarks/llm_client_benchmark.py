@@ -0,0 +1,127 @@
+"""Benchmark: per-call client construction vs the pooled LLM clients.
+
+Starts a local stand-in OpenAI-compatible server that answers
+/chat/completions instantly, so the measured time is pure client overhead
+(client construction, connection setup, request/response handling).
+
+"before" builds a fresh OpenAI client per call, as the old Celery
+_sync_llm_call helpers did; "after" reuses the per-process clients from
+app.llm.client. The stand-in is plain HTTP/1.1, so TLS handshake savings
+against the real provider come on top of these numbers. The shared rate
+limiter and request coalescer are switched off for the run: they add Redis
+round-trips unrelated to connection handling, and the benchmark shouldn't
+need Redis.
+
+Usage (from backend/):
+    python -m benchmarks.llm_client_benchmark --calls 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openai import AsyncOpenAI, OpenAI
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "bench",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+def report(label: str, samples: list[float]):
+    samples = sorted(samples)
+    print(
+        f"{label:>14}: mean={statistics.mean(samples):.2f}ms "
+        f"p50={statistics.median(samples):.2f}ms p95={samples[int(len(samples) * 0.95) - 1]:.2f}ms"
+    )
+
+
+def bench_sync(base_url: str, calls: int):
+    from app.llm.client import SyncLLMClient
+
+    before = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client = OpenAI(base_url=base_url, api_key="bench")
+        client.chat.completions.create(model="bench", messages=MESSAGES, max_tokens=1)
+        before.append((time.perf_counter() - start) * 1000)
+
+    pooled = SyncLLMClient(base_url=base_url)
+    after = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        pooled.complete(MESSAGES, max_tokens=1, cache=False)
+        after.append((time.perf_counter() - start) * 1000)
+
+    report("sync before", before)
+    report("sync after", after)
+
+
+async def bench_async(base_url: str, calls: int):
+    from app.llm.client import LLMClient
+
+    before = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client = AsyncOpenAI(base_url=base_url, api_key="bench")
+        await client.chat.completions.create(model="bench", messages=MESSAGES, max_tokens=1)
+        before.append((time.perf_counter() - start) * 1000)
+
+    pooled = LLMClient(base_url=base_url)
+    after = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await pooled.complete(MESSAGES, max_tokens=1, cache=False)
+        after.append((time.perf_counter() - start) * 1000)
+
+    report("async before", before)
+    report("async after", after)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    from app.llm.coalesce import coalescer
+    from app.llm.rate_limit import rate_limiter
+    rate_limiter.enabled = False
+    coalescer.enabled = False
+
+    server, url = start_server()
+    try:
+        bench_sync(url, args.calls)
+        asyncio.run(bench_async(url, args.calls))
+    finally:
+        server.shutdown()
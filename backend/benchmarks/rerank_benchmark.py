@@ -0,0 +1,102 @@
+"""Benchmark: cross-encoder re-ranking vs plain RRF order.
+
+Known-item evaluation against the live library: a query is derived from a
+random chunk, and we measure where that chunk lands with and without
+re-ranking. "Tokens to hit" is the context a RAG prompt must carry to include
+the source chunk, so the difference is what re-ranking saves per query.
+
+Usage (from backend/):
+    python -m benchmarks.rerank_benchmark --queries 50 --limit 8
+"""
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+from sqlalchemy import select, func
+from app.db.session import async_session_factory
+from app.models.chunk import BookChunk
+from app.processing.chunker import TextChunker
+from app.processing.reranker import get_reranker_model
+from app.services.search_service import hybrid_search
+
+STOPWORDS = {
+    "the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was",
+    "were", "it", "that", "this", "with", "as", "by", "be", "at", "from", "but", "not",
+}
+
+
+def make_query(content: str, rng: random.Random) -> str | None:
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", content) if 8 <= len(s.split()) <= 40]
+    if not sentences:
+        return None
+    words = [w for w in re.findall(r"[A-Za-z']+", rng.choice(sentences)) if w.lower() not in STOPWORDS]
+    rng.shuffle(words)
+    return " ".join(words[:8]) or None
+
+
+def tokens_to_hit(results: list[dict], chunk_id: int, chunker: TextChunker) -> int | None:
+    total = 0
+    for r in results:
+        total += chunker.estimate_tokens(r["content"])
+        if r["chunk_id"] == chunk_id:
+            return total
+    return None
+
+
+async def run(n_queries: int, limit: int, seed: int):
+    rng = random.Random(seed)
+    chunker = TextChunker()
+    get_reranker_model()  # exclude model load from timings
+
+    async with async_session_factory() as db:
+        rows = (await db.execute(
+            select(BookChunk.id, BookChunk.content)
+            .where(BookChunk.embedding.isnot(None))
+            .order_by(func.random())
+            .limit(n_queries * 3)
+        )).all()
+
+        samples = []
+        for row in rows:
+            query = make_query(row.content, rng)
+            if query:
+                samples.append((row.id, query))
+            if len(samples) >= n_queries:
+                break
+
+        stats = {False: {"lat": [], "hits": 0, "tokens": []}, True: {"lat": [], "hits": 0, "tokens": []}}
+        for chunk_id, query in samples:
+            for rerank in (False, True):
+                start = time.perf_counter()
+                results = await hybrid_search(db, query, limit=limit, rerank=rerank)
+                stats[rerank]["lat"].append((time.perf_counter() - start) * 1000)
+                used = tokens_to_hit(results, chunk_id, chunker)
+                if used is not None:
+                    stats[rerank]["hits"] += 1
+                    stats[rerank]["tokens"].append(used)
+
+    print(f"queries={len(samples)} limit={limit}")
+    for rerank, label in ((False, "rrf"), (True, "rerank")):
+        s = stats[rerank]
+        lat = sorted(s["lat"])
+        print(
+            f"{label:>7}: hit@{limit}={s['hits'] / max(1, len(samples)):.2%} "
+            f"tokens_to_hit(mean)={statistics.mean(s['tokens']) if s['tokens'] else 0:.0f} "
+            f"latency p50={statistics.median(lat):.1f}ms p95={lat[int(len(lat) * 0.95) - 1]:.1f}ms"
+        )
+
+    if stats[False]["tokens"] and stats[True]["tokens"]:
+        saved = statistics.mean(stats[False]["tokens"]) - statistics.mean(stats[True]["tokens"])
+        added = statistics.median(stats[True]["lat"]) - statistics.median(stats[False]["lat"])
+        print(f"tokens saved per hit: {saved:.0f}, latency added (p50): {added:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.queries, args.limit, args.seed))
@@ -19,10 +19,13 @@ celery_app.conf.update(
         "celery_app.tasks.book_tasks.*": {"queue": "processing"},
         "celery_app.tasks.embedding_tasks.*": {"queue": "embedding"},
         "celery_app.tasks.insight_tasks.*": {"queue": "llm"},
+        # CPU-bound matrix work, no LLM calls
+        "celery_app.tasks.insight_tasks.discover_connections": {"queue": "processing"},
         "celery_app.tasks.enrichment_tasks.*": {"queue": "llm"},
         "celery_app.tasks.topic_tasks.*": {"queue": "llm"},
         "celery_app.tasks.feed_tasks.*": {"queue": "llm"},
         "celery_app.tasks.orchestrator_tasks.*": {"queue": "processing"},
+        "celery_app.tasks.recommendation_tasks.*": {"queue": "processing"},
     },
     beat_schedule={},  # Populated from schedules.py
 )
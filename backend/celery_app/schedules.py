@@ -1,5 +1,6 @@
 """Celery Beat schedules."""
 from celery.schedules import crontab
+from app.config import settings
 
 
 def setup_beat_schedule(app):
@@ -12,8 +13,37 @@ def setup_beat_schedule(app):
             "task": "celery_app.tasks.feed_tasks.generate_daily_feed",
             "schedule": crontab(hour=8, minute=0),
         },
+        # Centroids for books embedded before book_embeddings; a no-op afterwards
+        "book-embedding-backfill": {
+            "task": "celery_app.tasks.embedding_tasks.backfill_book_embeddings",
+            "schedule": 3600.0,
+        },
+        # Safety net; reading progress and new embeddings also trigger refreshes
+        "recommendations-refresh": {
+            "task": "celery_app.tasks.recommendation_tasks.refresh_recommendations",
+            "schedule": settings.recommendation_refresh_interval,
+        },
+        "insight-connections": {
+            "task": "celery_app.tasks.insight_tasks.discover_connections",
+            "schedule": settings.insight_connection_interval,
+        },
+        "topic-update": {
+            "task": "celery_app.tasks.topic_tasks.rebuild_topics",
+            "schedule": settings.topic_update_interval,
+        },
+        # Full refit bounds the drift of incremental centroid updates
         "weekly-topic-rebuild": {
             "task": "celery_app.tasks.topic_tasks.rebuild_topics",
             "schedule": crontab(hour=3, minute=0, day_of_week=0),  # Sunday 3 AM
+            "kwargs": {"full": True},
+        },
+        # Both are no-ops unless INSIGHT_BATCH_MODE has queued jobs
+        "submit-insight-batch": {
+            "task": "celery_app.tasks.insight_tasks.submit_insight_batch",
+            "schedule": settings.insight_batch_submit_interval,
+        },
+        "poll-insight-batches": {
+            "task": "celery_app.tasks.insight_tasks.poll_insight_batches",
+            "schedule": settings.llm_batch_poll_interval,
         },
     }
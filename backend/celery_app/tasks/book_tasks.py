@@ -10,6 +10,7 @@ from app.processing.extractors.epub_extractor import EPUBExtractor
 from app.processing.chunker import TextChunker
 from app.processing.pipeline import compute_file_hash, save_cover_image, scan_directory
 from app.processing.metadata_parser import parse_filename
+from app.services.book_embedding_service import clear_book_embeddings
 from sqlalchemy import select
 import datetime
 
@@ -244,6 +245,7 @@ def chunk_text(self, book_id: int) -> dict:
             )
             from sqlalchemy import delete
             db.execute(delete(BookChunk).where(BookChunk.book_id == book_id))
+            clear_book_embeddings(db, book_id)
 
             # Store new chunks
             for chunk in chunks:
@@ -6,6 +6,9 @@ from app.models.book import Book
 from app.models.chunk import BookChunk
 from app.models.processing import ProcessingJob
 from app.processing.embedder import generate_embeddings
+from app.services.book_embedding_service import (
+    fold_chunk_embeddings, rebuild_book_embeddings, books_missing_embeddings,
+)
 from sqlalchemy import select
 import datetime
 
@@ -59,6 +62,8 @@ def generate_book_embeddings(self, book_id: int, batch_size: int = 64) -> dict:
 
                 for chunk, emb in zip(batch, embeddings):
                     chunk.embedding = emb
+                # Same transaction as the chunk writes, so no chunk is counted twice
+                fold_chunk_embeddings(db, book_id, batch)
 
                 total += len(batch)
 
@@ -74,8 +79,12 @@ def generate_book_embeddings(self, book_id: int, batch_size: int = 64) -> dict:
             db.commit()
 
             # Chain to insights
-            from celery_app.tasks.insight_tasks import generate_book_insights
-            generate_book_insights.delay(book_id, pass_level=1)
+            from celery_app.tasks.insight_tasks import dispatch_book_insights
+            dispatch_book_insights(book_id, pass_level=1)
+
+            # The new centroid can change recommendations
+            from celery_app.tasks.recommendation_tasks import schedule_recommendation_refresh
+            schedule_recommendation_refresh()
 
             return {"book_id": book_id, "embedded": total}
 
@@ -86,3 +95,16 @@ def generate_book_embeddings(self, book_id: int, batch_size: int = 64) -> dict:
                 job.error_message = str(e)
             db.commit()
             return {"error": str(e)}
+
+
+@celery_app.task(name="celery_app.tasks.embedding_tasks.backfill_book_embeddings")
+def backfill_book_embeddings(limit: int = 500) -> dict:
+    """Compute centroids for books embedded before book_embeddings existed."""
+    with sync_session_factory() as db:
+        book_ids = books_missing_embeddings(db, limit=limit)
+        for book_id in book_ids:
+            rebuild_book_embeddings(db, book_id)
+            db.commit()
+        if book_ids:
+            logger.info(f"Backfilled centroids for {len(book_ids)} books")
+        return {"backfilled": len(book_ids)}
@@ -1,33 +1,17 @@
 """Feed generation tasks."""
-import json
 import logging
 from celery_app.celery import celery_app
 from app.db.session import sync_session_factory
 from app.models.book import Book
 from app.models.insight import BookInsight
 from app.models.feed import FeedItem
+from app.llm.client import get_sync_llm_client
+from app.llm.structured import complete_json_sync
 from sqlalchemy import select, func
 
 logger = logging.getLogger(__name__)
 
 
-def _sync_llm_call(messages: list[dict]) -> str:
-    from openai import OpenAI
-    from app.config import settings
-
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=settings.openrouter_api_key,
-    )
-    response = client.chat.completions.create(
-        model=settings.default_model,
-        messages=messages,
-        temperature=0.8,
-        max_tokens=500,
-    )
-    return response.choices[0].message.content or ""
-
-
 @celery_app.task(name="celery_app.tasks.feed_tasks.generate_daily_feed")
 def generate_daily_feed() -> dict:
     """Generate daily feed items."""
@@ -50,16 +34,22 @@ def generate_daily_feed() -> dict:
                 continue
 
             try:
-                response = _sync_llm_call([{
-                    "role": "user",
-                    "content": GENERATE_FEED_TIL.format(
-                        insight_title=insight.title,
-                        insight_content=insight.content,
-                        book_title=book.title,
-                        author=book.author or "Unknown",
+                client = get_sync_llm_client()
+                data = complete_json_sync(
+                    lambda messages: client.complete(
+                        messages=messages, task_type="feed", temperature=0.8, max_tokens=500, json_mode=True,
                     ),
-                }])
-                data = json.loads(response)
+                    [{
+                        "role": "user",
+                        "content": GENERATE_FEED_TIL.format(
+                            insight_title=insight.title,
+                            insight_content=insight.content,
+                            book_title=book.title,
+                            author=book.author or "Unknown",
+                        ),
+                    }],
+                    model=client.registry.get_model("feed"),
+                )
 
                 item = FeedItem(
                     item_type="til",
@@ -1,43 +1,191 @@
 """AI insight generation tasks."""
-import json
 import logging
 from celery_app.celery import celery_app
 from app.db.session import sync_session_factory
 from app.models.book import Book
 from app.models.chunk import BookChunk
-from app.models.insight import BookInsight
-from app.models.processing import ProcessingJob
-from app.processing.embedder import generate_single_embedding
-from sqlalchemy import select
+from app.models.insight import BookInsight, InsightMapShard
+from app.models.processing import ProcessingJob, LLMBatch
+from app.llm.batch import (
+    IN_PROGRESS, FAILED, LocalBatchBackend, batch_line, get_batch_backend, result_content,
+)
+from app.llm.client import get_sync_llm_client
+from app.llm.structured import (
+    JSON_RESPONSE_FORMAT, LLMJSONError, json_mode_supported, parse_json, parse_stats,
+)
+from app.services.insight_engine import (
+    EXTRACTIONS, extract_insights_sync, extraction_messages, parse_extraction,
+    build_insights, insight_text_key, plan_map_shards, map_shards_sync, reduce_context,
+    refinement_preamble, select_context_chunks,
+)
+from app.services.insight_connections import discover_insight_connections
+from app.services.book_edges import bump_edges_version
+from app.config import settings
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
 import datetime
 
 logger = logging.getLogger(__name__)
 
 
-def _sync_llm_call(messages: list[dict], task_type: str = "insight") -> str:
-    """Synchronous LLM call for Celery workers."""
-    from openai import OpenAI
-    from app.config import settings
+def _map_reduce_content(db, book: Book, client) -> str:
+    """Summaries of the whole book for the extraction prompts.
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=settings.openrouter_api_key,
+    Map shards are persisted as they complete and looked up by chunk hash, so
+    an interrupted run resumes where it stopped and later refinement passes
+    reuse every unchanged summary without re-reading the book.
+    """
+    chunks = db.execute(
+        select(BookChunk.chunk_index, BookChunk.content, BookChunk.chapter, BookChunk.token_count)
+        .where(BookChunk.book_id == book.id)
+        .order_by(BookChunk.chunk_index)
+    ).all()
+    if not chunks:
+        return ""
+
+    shards = plan_map_shards(chunks, settings.insight_map_window_tokens)
+    cached = {
+        s.chunk_hash: s.summary
+        for s in db.execute(
+            select(InsightMapShard).where(InsightMapShard.book_id == book.id)
+        ).scalars().all()
+    }
+    summaries = [(shard, cached[shard["chunk_hash"]]) for shard in shards if shard["chunk_hash"] in cached]
+    # Identical windows (repeated boilerplate) are summarized once
+    pending: dict[str, list[dict]] = {}
+    for shard in shards:
+        if shard["chunk_hash"] not in cached:
+            pending.setdefault(shard["chunk_hash"], []).append(shard)
+
+    map_model = client.registry.get_model("summary")
+
+    def summarize(messages: list[dict]) -> str:
+        return client.complete(
+            messages=messages, task_type="summary", temperature=0.3, max_tokens=600, cache=True,
+        )
+
+    def on_summary(shard: dict, summary: str):
+        # A concurrent run may have stored the same window already
+        db.execute(
+            insert(InsightMapShard)
+            .values(
+                book_id=book.id,
+                shard_index=shard["shard_index"],
+                chunk_hash=shard["chunk_hash"],
+                chapter=(shard["chapter"] or "")[:300] or None,
+                first_chunk_index=shard["first_chunk_index"],
+                last_chunk_index=shard["last_chunk_index"],
+                summary=summary,
+                model_used=map_model,
+            )
+            .on_conflict_do_nothing(index_elements=["book_id", "chunk_hash"])
+        )
+        db.commit()
+        summaries.extend((same, summary) for same in pending[shard["chunk_hash"]])
+
+    logger.info(f"Book {book.id}: {len(shards)} map shards, {len(pending)} to summarize")
+    map_shards_sync(
+        [group[0] for group in pending.values()],
+        book.title, book.author, map_model, summarize, on_summary,
     )
 
-    response = client.chat.completions.create(
-        model=settings.default_model,
-        messages=messages,
-        temperature=0.7,
-        max_tokens=4096,
+    if len(summaries) < len(shards):
+        raise RuntimeError(f"{len(shards) - len(summaries)} map shards failed; will resume on retry")
+
+    content = reduce_context(summaries, book.title, book.author, summarize)
+    # Windows whose chunks have since changed will never be looked up again
+    db.execute(
+        delete(InsightMapShard)
+        .where(InsightMapShard.book_id == book.id)
+        .where(InsightMapShard.chunk_hash.notin_([shard["chunk_hash"] for shard in shards]))
     )
-    return response.choices[0].message.content or ""
+    return content
+
+
+def _insight_content(db, book: Book, pass_level: int, client, existing: list, allow_map_reduce: bool = True) -> str:
+    """Context for the extraction prompts under the configured context mode."""
+    mode = settings.insight_context_mode
+    preamble = refinement_preamble(pass_level, existing)
+
+    if mode == "map_reduce" and allow_map_reduce:
+        content = _map_reduce_content(db, book, client)
+    elif mode in ("map_reduce", "representative"):
+        chunks = db.execute(
+            select(BookChunk)
+            .where(BookChunk.book_id == book.id)
+            .where(BookChunk.embedding.isnot(None))
+        ).scalars().all()
+        selected = select_context_chunks(
+            chunks, settings.insight_context_tokens, client.registry.get_model("insight"),
+            reserved_chars=len(preamble),
+        )
+        content = "\n\n---\n\n".join(c.content for c in selected)
+    else:
+        chunk_limit = 20 if pass_level == 1 else 50
+        chunks = db.execute(
+            select(BookChunk)
+            .where(BookChunk.book_id == book.id)
+            .order_by(BookChunk.chunk_index)
+            .limit(chunk_limit)
+        ).scalars().all()
+        content = "\n\n---\n\n".join(c.content for c in chunks)
+
+    return preamble + content if content else content
+
+
+def _existing_insights(db, book_id: int) -> list:
+    return db.execute(
+        select(BookInsight.insight_type, BookInsight.title, BookInsight.content)
+        .where(BookInsight.book_id == book_id)
+    ).all()
+
+
+def _store_insights(db, book: Book, job: ProcessingJob, pass_level: int, items: list[dict], existing: list) -> int:
+    """Persist new insights, mark the book and job done and chain enrichment."""
+    existing_keys = {insight_text_key(*row) for row in existing}
+    insights = build_insights(book.id, pass_level, items, existing_keys)
+    db.add_all(insights)
+
+    book.processing_status = "completed"
+    book.processing_progress = 100.0
+    job.status = "completed"
+    job.completed_at = datetime.datetime.utcnow()
+    db.commit()
+
+    from celery_app.tasks.enrichment_tasks import enrich_book
+    enrich_book.delay(book.id)
+    return len(insights)
+
+
+def _get_or_create_job(db, book_id: int, stage: str) -> ProcessingJob:
+    job = db.execute(
+        select(ProcessingJob)
+        .where(ProcessingJob.book_id == book_id)
+        .where(ProcessingJob.stage == stage)
+    ).scalar_one_or_none()
+    if not job:
+        job = ProcessingJob(book_id=book_id, stage=stage, status="pending", attempts=0)
+        db.add(job)
+    return job
+
+
+def dispatch_book_insights(book_id: int, pass_level: int = 1):
+    """Start insight generation now, or queue it for the next batch
+    submission when INSIGHT_BATCH_MODE is on."""
+    if not settings.insight_batch_mode:
+        generate_book_insights.delay(book_id, pass_level=pass_level)
+        return
+    with sync_session_factory() as db:
+        job = _get_or_create_job(db, book_id, f"insights_pass_{pass_level}")
+        if job.status not in ("queued", "batched"):
+            job.status = "queued"
+            job.error_message = None
+        db.commit()
 
 
 @celery_app.task(name="celery_app.tasks.insight_tasks.generate_book_insights", bind=True)
 def generate_book_insights(self, book_id: int, pass_level: int = 1) -> dict:
     """Generate AI insights for a book."""
-    from app.llm.prompts import SYSTEM_INSIGHT, EXTRACT_KEY_CONCEPTS, EXTRACT_FRAMEWORKS, EXTRACT_TAKEAWAYS
-
     with sync_session_factory() as db:
         book = db.get(Book, book_id)
         if not book:
@@ -45,17 +193,7 @@ def generate_book_insights(self, book_id: int, pass_level: int = 1) -> dict:
 
         book.processing_status = "generating_insights"
 
-        stage = f"insights_pass_{pass_level}"
-        job = db.execute(
-            select(ProcessingJob)
-            .where(ProcessingJob.book_id == book_id)
-            .where(ProcessingJob.stage == stage)
-        ).scalar_one_or_none()
-
-        if not job:
-            job = ProcessingJob(book_id=book_id, stage=stage, status="pending")
-            db.add(job)
-
+        job = _get_or_create_job(db, book_id, f"insights_pass_{pass_level}")
         job.status = "running"
         job.celery_task_id = self.request.id
         job.started_at = datetime.datetime.utcnow()
@@ -63,120 +201,230 @@ def generate_book_insights(self, book_id: int, pass_level: int = 1) -> dict:
         db.commit()
 
         try:
-            chunk_limit = 20 if pass_level == 1 else 50
-            chunks = db.execute(
-                select(BookChunk)
-                .where(BookChunk.book_id == book_id)
-                .order_by(BookChunk.chunk_index)
-                .limit(chunk_limit)
-            ).scalars().all()
-
-            if not chunks:
+            client = get_sync_llm_client()
+            existing = _existing_insights(db, book_id)
+            content = _insight_content(db, book, pass_level, client, existing)
+
+            if not content:
                 job.status = "skipped"
                 db.commit()
                 return {"book_id": book_id, "insights": 0}
 
-            content = "\n\n---\n\n".join(c.content for c in chunks)
-            insights_count = 0
+            def complete(prompt: str, messages: list[dict], retry: bool, json_mode: bool) -> str:
+                # A cached retry would be the reply being retried
+                return client.complete(
+                    messages=messages, task_type="insight", cache=not retry, json_mode=json_mode,
+                )
+
+            items = extract_insights_sync(
+                book.title, book.author, content,
+                model=client.registry.get_model("insight"),
+                complete=complete,
+            )
+            insights_count = _store_insights(db, book, job, pass_level, items, existing)
 
-            # Extract key concepts
+            return {"book_id": book_id, "insights": insights_count, "pass_level": pass_level}
+
+        except Exception as e:
+            logger.error(f"Insight generation failed for book {book_id}: {e}")
+            job.status = "failed"
+            job.error_message = str(e)
+            db.commit()
+            return {"error": str(e)}
+
+
+# Batch mode: queued jobs are submitted together as one provider batch and
+# ingested by a polling task, so backlog processing doesn't hold a worker
+# slot per request.
+
+@celery_app.task(name="celery_app.tasks.insight_tasks.submit_insight_batch")
+def submit_insight_batch() -> dict:
+    """Submit the extraction prompts of all queued insight jobs as one batch."""
+    with sync_session_factory() as db:
+        jobs = db.execute(
+            select(ProcessingJob)
+            .where(ProcessingJob.stage.like("insights_pass_%"))
+            .where(ProcessingJob.status == "queued")
+            .order_by(ProcessingJob.updated_at)
+            .limit(settings.insight_batch_max_books)
+        ).scalars().all()
+        if not jobs:
+            return {"submitted": 0}
+
+        client = get_sync_llm_client()
+        model = client.registry.get_model("insight")
+        lines, batched = [], []
+        for job in jobs:
+            book = db.get(Book, job.book_id)
+            pass_level = int(job.stage.rsplit("_", 1)[1])
             try:
-                response = _sync_llm_call(
-                    messages=[
-                        {"role": "system", "content": SYSTEM_INSIGHT},
-                        {"role": "user", "content": EXTRACT_KEY_CONCEPTS.format(
-                            title=book.title, author=book.author or "Unknown", content=content[:50000]
-                        )},
-                    ],
+                # Map-reduce would make synchronous LLM calls here; batches use
+                # representative selection instead
+                content = _insight_content(
+                    db, book, pass_level, client, _existing_insights(db, book.id), allow_map_reduce=False,
                 )
-                data = json.loads(response)
-                for concept in data.get("concepts", []):
-                    embedding = generate_single_embedding(f"{concept['title']}: {concept['content']}")
-                    insight = BookInsight(
-                        book_id=book_id,
-                        insight_type="key_concept",
-                        title=concept["title"],
-                        content=concept["content"],
-                        supporting_quote=concept.get("supporting_quote"),
-                        importance=concept.get("importance", 5),
-                        refinement_level=pass_level,
-                        embedding=embedding,
-                    )
-                    db.add(insight)
-                    insights_count += 1
             except Exception as e:
-                logger.error(f"Concept extraction failed: {e}")
+                logger.error(f"Batch context failed for book {job.book_id}: {e}")
+                job.status, job.error_message = "failed", str(e)
+                continue
+            if not content:
+                job.status = "skipped"
+                continue
+
+            for insight_type, _, prompt in EXTRACTIONS:
+                body = {
+                    "model": model,
+                    "messages": extraction_messages(prompt, book.title, book.author, content),
+                    "temperature": 0.7,
+                    "max_tokens": 4096,
+                }
+                if json_mode_supported(model):
+                    body["response_format"] = JSON_RESPONSE_FORMAT
+                lines.append(batch_line(f"insight:{job.id}:{insight_type}", body))
+            batched.append((job, book))
+
+        if not lines:
+            db.commit()
+            return {"submitted": 0}
 
-            # Extract frameworks
+        backend = get_batch_backend()
+        try:
+            provider_batch_id = backend.submit(lines)
+        except Exception as e:
+            logger.error(f"Insight batch submission failed: {e}")
+            db.rollback()
+            return {"error": str(e)}
+
+        batch = LLMBatch(
+            purpose="insights",
+            backend=backend.name,
+            provider_batch_id=provider_batch_id,
+            request_count=len(lines),
+            job_ids=[job.id for job, _ in batched],
+        )
+        db.add(batch)
+        now = datetime.datetime.utcnow()
+        for job, book in batched:
+            job.status = "batched"
+            job.started_at = now
+            job.attempts += 1
+            book.processing_status = "generating_insights"
+        db.commit()
+
+        logger.info(f"Submitted insight batch {batch.id} ({provider_batch_id}): {len(batched)} books, {len(lines)} requests")
+        return {"batch_id": batch.id, "books": len(batched), "requests": len(lines)}
+
+
+def _requeue_or_fail(job: ProcessingJob, error: str):
+    job.error_message = error
+    job.status = "queued" if job.attempts < settings.insight_batch_max_attempts else "failed"
+
+
+def _ingest_insight_batch(db, batch: LLMBatch, results: list[dict]) -> int:
+    """Store the insights of a finished batch; returns requests that succeeded."""
+    model = get_sync_llm_client().registry.get_model("insight")
+    keys = {insight_type: key for insight_type, key, _ in EXTRACTIONS}
+
+    by_job: dict[int, list[tuple[str, str | None]]] = {}
+    for result in results:
+        _, job_id, insight_type = result["custom_id"].split(":", 2)
+        by_job.setdefault(int(job_id), []).append((insight_type, result_content(result)))
+
+    succeeded = 0
+    for job_id in batch.job_ids:
+        job = db.get(ProcessingJob, job_id)
+        if job is None or job.status != "batched":
+            continue
+        book = db.get(Book, job.book_id)
+        items, parsed = [], 0
+        for insight_type, content in by_job.get(job_id, []):
+            if content is None:
+                continue
             try:
-                response = _sync_llm_call(
-                    messages=[
-                        {"role": "system", "content": SYSTEM_INSIGHT},
-                        {"role": "user", "content": EXTRACT_FRAMEWORKS.format(
-                            title=book.title, author=book.author or "Unknown", content=content[:50000]
-                        )},
-                    ],
-                )
-                data = json.loads(response)
-                for fw in data.get("frameworks", []):
-                    embedding = generate_single_embedding(f"{fw['title']}: {fw['content']}")
-                    insight = BookInsight(
-                        book_id=book_id,
-                        insight_type="framework",
-                        title=fw["title"],
-                        content=fw["content"],
-                        supporting_quote=fw.get("supporting_quote"),
-                        importance=fw.get("importance", 5),
-                        refinement_level=pass_level,
-                        embedding=embedding,
-                    )
-                    db.add(insight)
-                    insights_count += 1
-            except Exception as e:
-                logger.error(f"Framework extraction failed: {e}")
+                data, repaired = parse_json(content)
+            except LLMJSONError:
+                parse_stats.record(model, calls=1, failures=1)
+                continue
+            parse_stats.record(model, calls=1, repaired=int(repaired))
+            items.extend(parse_extraction(insight_type, keys[insight_type], data))
+            parsed += 1
+        succeeded += parsed
 
-            # Extract takeaways
+        if not parsed:
+            _requeue_or_fail(job, f"No usable responses in batch {batch.id}")
+            db.commit()
+            continue
+        try:
+            pass_level = int(job.stage.rsplit("_", 1)[1])
+            _store_insights(db, book, job, pass_level, items, _existing_insights(db, book.id))
+        except Exception as e:
+            logger.error(f"Storing batch insights failed for book {job.book_id}: {e}")
+            db.rollback()
+            job = db.get(ProcessingJob, job_id)
+            _requeue_or_fail(job, str(e))
+            db.commit()
+    return succeeded
+
+
+@celery_app.task(name="celery_app.tasks.insight_tasks.poll_insight_batches")
+def poll_insight_batches() -> dict:
+    """Check submitted insight batches and ingest the finished ones."""
+    with sync_session_factory() as db:
+        batches = db.execute(
+            select(LLMBatch)
+            .where(LLMBatch.purpose == "insights")
+            .where(LLMBatch.status == "submitted")
+            .order_by(LLMBatch.submitted_at)
+        ).scalars().all()
+        if not batches:
+            return {"pending": 0}
+
+        backend = get_batch_backend()
+        ingested, pending = 0, 0
+        for batch in batches:
+            if batch.backend != backend.name:
+                logger.warning(f"Batch {batch.id} was submitted to '{batch.backend}', not polling it with '{backend.name}'")
+                continue
             try:
-                response = _sync_llm_call(
-                    messages=[
-                        {"role": "system", "content": SYSTEM_INSIGHT},
-                        {"role": "user", "content": EXTRACT_TAKEAWAYS.format(
-                            title=book.title, author=book.author or "Unknown", content=content[:50000]
-                        )},
-                    ],
-                )
-                data = json.loads(response)
-                for tw in data.get("takeaways", []):
-                    embedding = generate_single_embedding(f"{tw['title']}: {tw['content']}")
-                    insight = BookInsight(
-                        book_id=book_id,
-                        insight_type="takeaway",
-                        title=tw["title"],
-                        content=tw["content"],
-                        importance=tw.get("importance", 5),
-                        refinement_level=pass_level,
-                        embedding=embedding,
+                state = backend.status(batch.provider_batch_id)
+                if state == IN_PROGRESS:
+                    pending += 1
+                    continue
+                if state == FAILED:
+                    batch.status = "failed"
+                    batch.error_message = "Provider reported the batch failed or expired"
+                    for job_id in batch.job_ids:
+                        job = db.get(ProcessingJob, job_id)
+                        if job is not None and job.status == "batched":
+                            _requeue_or_fail(job, batch.error_message)
+                else:
+                    batch.succeeded_count = _ingest_insight_batch(
+                        db, batch, backend.results(batch.provider_batch_id),
                     )
-                    db.add(insight)
-                    insights_count += 1
+                    batch.status = "completed"
+                    ingested += 1
+                batch.completed_at = datetime.datetime.utcnow()
+                db.commit()
             except Exception as e:
-                logger.error(f"Takeaway extraction failed: {e}")
+                logger.error(f"Polling insight batch {batch.id} failed: {e}")
+                db.rollback()
 
-            book.processing_status = "completed"
-            book.processing_progress = 100.0
-            job.status = "completed"
-            job.completed_at = datetime.datetime.utcnow()
-            db.commit()
+        return {"ingested": ingested, "pending": pending}
 
-            # Trigger enrichment
-            from celery_app.tasks.enrichment_tasks import enrich_book
-            enrich_book.delay(book_id)
 
-            return {"book_id": book_id, "insights": insights_count, "pass_level": pass_level}
+@celery_app.task(name="celery_app.tasks.insight_tasks.run_local_batch")
+def run_local_batch(batch_id: str) -> dict:
+    """Run a claimed local-backend batch; the poller ingests its output."""
+    LocalBatchBackend(settings.llm_batch_dir).run(batch_id)
+    return {"batch_id": batch_id}
 
-        except Exception as e:
-            logger.error(f"Insight generation failed for book {book_id}: {e}")
-            job.status = "failed"
-            job.error_message = str(e)
-            db.commit()
-            return {"error": str(e)}
+
+@celery_app.task(name="celery_app.tasks.insight_tasks.discover_connections")
+def discover_connections(limit: int | None = None) -> dict:
+    """Connect insights added since the last run to their cross-book neighbours."""
+    with sync_session_factory() as db:
+        result = discover_insight_connections(db, limit=limit)
+        db.commit()
+        if result.get("connections") or result.get("edges_rebuilt"):
+            bump_edges_version()
+        return result
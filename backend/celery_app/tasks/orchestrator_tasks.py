@@ -31,8 +31,8 @@ def orchestrator_tick() -> dict:
                 return {"status": "dispatched", "action": "resume_processing", "book_id": action["book_id"]}
 
             elif action["action"] == "refine_insights":
-                from celery_app.tasks.insight_tasks import generate_book_insights
-                generate_book_insights.delay(action["book_id"], pass_level=2)
+                from celery_app.tasks.insight_tasks import dispatch_book_insights
+                dispatch_book_insights(action["book_id"], pass_level=2)
                 return {"status": "dispatched", "action": "refine_insights", "book_id": action["book_id"]}
 
             elif action["action"] == "generate_feed":
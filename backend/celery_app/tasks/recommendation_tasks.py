@@ -0,0 +1,22 @@
+"""Recommendation refresh tasks."""
+import logging
+from celery_app.celery import celery_app
+from app.config import settings
+from app.db.session import sync_session_factory
+from app.services.recommendation_engine import refresh_recommendations as refresh
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(name="celery_app.tasks.recommendation_tasks.refresh_recommendations")
+def refresh_recommendations(force: bool = False) -> dict:
+    """Recompute the materialized recommendations; a no-op if nothing changed."""
+    with sync_session_factory() as db:
+        result = refresh(db, force=force)
+        db.commit()
+        return result
+
+
+def schedule_recommendation_refresh():
+    """Queue a refresh shortly after the caller's transaction commits."""
+    refresh_recommendations.apply_async(countdown=settings.recommendation_refresh_delay)